@@ -0,0 +1,185 @@
+"""
+Compare distorsion_generator with the column and row loop it replaced on text
+lines of 10 to 400 characters, distorted on both axes.
+
+    python benchmarks/distorsion.py
+"""
+
+import math
+import os
+import random
+import sys
+import timeit
+from typing import Tuple
+
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from trdg import computer_text_generator_update
+from trdg.distorsion_generator import _apply_func_distorsion
+
+FONT_DIR = os.path.join(os.path.dirname(__file__), "..", "trdg", "fonts", "latin")
+WORDS = ["lorem", "ipsum", "dolor", "sit", "amet", "consectetur", "adipiscing"]
+
+
+def loop_distorsion(
+    image: Image, mask: Image, vertical: bool, horizontal: bool, max_offset: int, func
+) -> Tuple:
+    """The implementation that moves every column and row in a Python loop"""
+
+    # Nothing to do!
+    if not vertical and not horizontal:
+        return image, mask
+
+    # FIXME: From looking at the code I think both are already RGBA
+    rgb_image = image.convert("RGBA")
+    # Label masks are moved as they are, color masks as RGB. The mask is
+    # optional, None when the caller doesn't need one.
+    mask_arr = None
+    if mask is not None:
+        mask_arr = np.array(mask if mask.mode == "I;16" else mask.convert("RGB"))
+
+    img_arr = np.array(rgb_image)
+
+    vertical_offsets = [func(i) for i in range(img_arr.shape[1])]
+    horizontal_offsets = [
+        func(i)
+        for i in range(
+            img_arr.shape[0]
+            + (
+                (max(vertical_offsets) - min(min(vertical_offsets), 0))
+                if vertical
+                else 0
+            )
+        )
+    ]
+
+    new_img_arr = np.zeros(
+        (
+            img_arr.shape[0] + (2 * max_offset if vertical else 0),
+            img_arr.shape[1] + (2 * max_offset if horizontal else 0),
+            4,
+        )
+    )
+
+    new_img_arr_copy = np.copy(new_img_arr)
+
+    new_mask_arr = new_mask_arr_copy = None
+    if mask_arr is not None:
+        new_mask_arr = np.zeros(
+            (
+                # I keep img_arr to maximise the chance of
+                # a breakage if img and mask don't match
+                img_arr.shape[0] + (2 * max_offset if vertical else 0),
+                img_arr.shape[1] + (2 * max_offset if horizontal else 0),
+            )
+            + mask_arr.shape[2:],
+            dtype=mask_arr.dtype,
+        )
+
+        new_mask_arr_copy = np.copy(new_mask_arr)
+
+    if vertical:
+        column_height = img_arr.shape[0]
+        for i, o in enumerate(vertical_offsets):
+            column_pos = (i + max_offset) if horizontal else i
+            new_img_arr[
+                max_offset + o : column_height + max_offset + o, column_pos, :
+            ] = img_arr[:, i, :]
+            if mask_arr is not None:
+                new_mask_arr[
+                    max_offset + o : column_height + max_offset + o, column_pos
+                ] = mask_arr[:, i]
+
+    if horizontal:
+        row_width = img_arr.shape[1]
+        for i, o in enumerate(horizontal_offsets):
+            if vertical:
+                new_img_arr_copy[
+                    i, max_offset + o : row_width + max_offset + o, :
+                ] = new_img_arr[i, max_offset : row_width + max_offset, :]
+                if mask_arr is not None:
+                    new_mask_arr_copy[
+                        i, max_offset + o : row_width + max_offset + o
+                    ] = new_mask_arr[i, max_offset : row_width + max_offset]
+            else:
+                new_img_arr[
+                    i, max_offset + o : row_width + max_offset + o, :
+                ] = img_arr[i, :, :]
+                if mask_arr is not None:
+                    new_mask_arr[
+                        i, max_offset + o : row_width + max_offset + o
+                    ] = mask_arr[i]
+
+    return (
+        Image.fromarray(
+            np.uint8(new_img_arr_copy if horizontal and vertical else new_img_arr)
+        ).convert("RGBA"),
+        Image.fromarray(
+            new_mask_arr_copy if horizontal and vertical else new_mask_arr
+        )
+        if mask_arr is not None
+        else None,
+    )
+
+
+def make_line(length):
+    text = ""
+    while len(text) < length:
+        text += random.choice(WORDS) + " "
+    image, mask, _ = computer_text_generator_update.generate(
+        text[:length].strip(), FONT_DIR, False, 20, 40, 0, False, 0, 1.0, 0, False, False
+    )
+    return image, mask
+
+
+def main():
+    random.seed(0)
+    print(
+        "{:>6} {:>12} {:>12} {:>12} {:>8}".format(
+            "chars", "width (px)", "loop (ms)", "remap (ms)", "speedup"
+        )
+    )
+    for length in (10, 50, 100, 200, 400):
+        image, mask = make_line(length)
+        max_offset = int(image.height**0.5)
+
+        def offset(x):
+            return int(math.sin(math.radians(x)) * max_offset)
+
+        def offsets(x):
+            return (np.sin(np.radians(x)) * max_offset).astype(int)
+
+        for a, b in zip(
+            loop_distorsion(image, mask, True, True, max_offset, offset),
+            _apply_func_distorsion(image, mask, True, True, max_offset, offsets),
+        ):
+            assert np.array_equal(np.asarray(a), np.asarray(b))
+        number = 5
+        loop = (
+            timeit.timeit(
+                lambda: loop_distorsion(image, mask, True, True, max_offset, offset),
+                number=number,
+            )
+            / number
+        )
+        remap = (
+            timeit.timeit(
+                lambda: _apply_func_distorsion(
+                    image, mask, True, True, max_offset, offsets
+                ),
+                number=number,
+            )
+            / number
+        )
+        print(
+            "{:>6} {:>12} {:>12.2f} {:>12.2f} {:>7.1f}x".format(
+                length, image.width, loop * 1000, remap * 1000, loop / remap
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+"""
+Compare utils.mask_to_bboxes with the per-character scan it replaced on masks
+of 10 to 200 characters. The scan reads the RGB encoded masks characters were
+drawn in before masks became label images.
+
+    python benchmarks/mask_to_bboxes.py
+"""
+
+import os
+import random
+import sys
+import timeit
+
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from trdg import computer_text_generator_update
+from trdg.utils import mask_to_bboxes
+
+FONT_DIR = os.path.join(os.path.dirname(__file__), "..", "trdg", "fonts", "latin")
+WORDS = ["lorem", "ipsum", "dolor", "sit", "amet", "consectetur", "adipiscing"]
+
+
+def scan_mask_to_bboxes(mask, tess=False):
+    """The implementation that looks for every character color in turn"""
+
+    mask_arr = np.array(mask)
+
+    bboxes = []
+
+    i = 0
+    space_thresh = 1
+    while True:
+        try:
+            color_tuple = ((i + 1) // (255 * 255), (i + 1) // 255, (i + 1) % 255)
+            letter = np.where(np.all(mask_arr == color_tuple, axis=-1))
+            if space_thresh == 0 and letter:
+                x1 = min(bboxes[-1][2] + 1, np.min(letter[1]) - 1)
+                y1 = (
+                    min(bboxes[-1][3] + 1, np.min(letter[0]) - 1)
+                    if not tess
+                    else min(
+                        mask_arr.shape[0] - np.min(letter[0]) + 2, bboxes[-1][1] - 1
+                    )
+                )
+                x2 = max(bboxes[-1][2] + 1, np.min(letter[1]) - 2)
+                y2 = (
+                    max(bboxes[-1][3] + 1, np.min(letter[0]) - 2)
+                    if not tess
+                    else max(
+                        mask_arr.shape[0] - np.min(letter[0]) + 2, bboxes[-1][1] - 1
+                    )
+                )
+                bboxes.append((x1, y1, x2, y2))
+                space_thresh += 1
+            bboxes.append(
+                (
+                    max(0, np.min(letter[1]) - 1),
+                    max(0, np.min(letter[0]) - 1)
+                    if not tess
+                    else max(0, mask_arr.shape[0] - np.max(letter[0]) - 1),
+                    min(mask_arr.shape[1] - 1, np.max(letter[1]) + 1),
+                    min(mask_arr.shape[0] - 1, np.max(letter[0]) + 1)
+                    if not tess
+                    else min(
+                        mask_arr.shape[0] - 1, mask_arr.shape[0] - np.min(letter[0]) + 1
+                    ),
+                )
+            )
+            i += 1
+        except Exception:
+            if space_thresh == 0:
+                break
+            space_thresh -= 1
+            i += 1
+
+    return bboxes
+
+
+def to_color_mask(mask):
+    """The RGB encoded mask the scan worked on, from a label mask"""
+
+    labels = np.array(mask).astype(np.int32)
+    color_arr = np.stack(
+        (labels // (255 * 255), labels // 255, labels % 255), axis=-1
+    ).astype(np.uint8)
+    return Image.fromarray(color_arr)
+
+
+def make_mask(length):
+    text = ""
+    while len(text) < length:
+        text += random.choice(WORDS) + " "
+    _, mask, _ = computer_text_generator_update.generate(
+        text[:length].strip(), FONT_DIR, False, 20, 40, 0, False, 0, 1.0, 0, False, False
+    )
+    return mask
+
+
+def main():
+    random.seed(0)
+    print("{:>6} {:>12} {:>12} {:>8}".format("chars", "scan (ms)", "labels (ms)", "speedup"))
+    for length in (10, 25, 50, 100, 200):
+        mask = make_mask(length)
+        color_mask = to_color_mask(mask)
+        for tess in (False, True):
+            assert [
+                tuple(int(v) for v in b) for b in scan_mask_to_bboxes(color_mask, tess)
+            ] == [tuple(int(v) for v in b) for b in mask_to_bboxes(mask, tess)]
+        number = 5
+        scan = (
+            timeit.timeit(lambda: scan_mask_to_bboxes(color_mask), number=number) / number
+        )
+        labels = timeit.timeit(lambda: mask_to_bboxes(mask), number=number) / number
+        print(
+            "{:>6} {:>12.2f} {:>12.2f} {:>7.1f}x".format(
+                length, scan * 1000, labels * 1000, scan / labels
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
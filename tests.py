@@ -1,9 +1,18 @@
+import contextlib
+import io
+import multiprocessing
 import os
+import pickle
+import random
 import sys
 import unittest
+import unittest.mock
 import subprocess
 import hashlib
 import string
+import numpy as np
+import shutil
+import tempfile
 
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "./trdg")))
 
@@ -12,10 +21,29 @@ try:
 except:
     pass
 
+from PIL import Image
 from diffimg import diff
 
 from trdg.data_generator_update import FakeTextDataGenerator
+from trdg import computer_text_generator_update
 from trdg import background_generator
+from trdg import background_generator_update
+from trdg import distorsion_generator
+from trdg import geometry
+from trdg.font_cache import FontCache
+from trdg.font_registry import FontRegistry
+from trdg.image_cache import ImageCache, _image_cache
+from trdg.glyph_coverage import GlyphCoverageIndex, read_cmap
+from trdg.glyph_metrics import GlyphMetrics
+from trdg.font_cache import font_cache_stats
+from trdg.utils import extents_to_bboxes, label_extents, load_image, mask_to_bboxes
+from trdg.worker import generate_task, init_worker
+from trdg.run import collect_warmups, report_throughput
+from trdg.generation_config import GenerationConfig, Orientation
+from trdg.texture_bank import TextureBank, texture_window
+from trdg.background_atlas import build_atlas, is_atlas
+from trdg.compositing import composite, place_mask
+from trdg.sample import Sample, SampleRejected
 from trdg.generators import (
     GeneratorFromDict,
     GeneratorFromRandom,
@@ -1132,6 +1160,699 @@ class DataGenerator(unittest.TestCase):
         self.assertTrue(len(bkgd.histogram()) > 20 and bkgd.size == (128, 64))
 
 
+class Backgrounds(unittest.TestCase):
+    def test_gaussian_noise_is_single_channel(self):
+        for generator in (background_generator, background_generator_update):
+            bkgd = generator.gaussian_noise(64, 128)
+            self.assertEqual((bkgd.mode, bkgd.size), ("L", (128, 64)))
+            self.assertAlmostEqual(np.asarray(bkgd).mean(), 235, delta=2)
+
+    def test_quasicrystal_texture_resolution(self):
+        small = background_generator.quasicrystal_texture(33, 65, 30.0, 1.0, 12)
+        large = background_generator.quasicrystal_texture(129, 257, 30.0, 1.0, 12)
+        self.assertEqual(small.dtype, np.float32)
+        self.assertEqual(large.shape, (129, 257))
+        self.assertTrue(np.all(np.abs(large) <= 1.0001))
+        # Every fourth point of the finer grid is a point of the coarser one
+        np.testing.assert_allclose(large[::4, ::4], small, atol=1e-4)
+
+    def test_texture_bank_windows(self):
+        texture = np.arange(40 * 60, dtype=np.uint32).reshape(40, 60).astype(np.uint8)
+        bank = TextureBank([texture])
+        for _ in range(20):
+            window = bank.window(10, 25)
+            self.assertEqual(window.shape, (10, 25))
+            self.assertTrue(np.shares_memory(window, texture))
+        self.assertIsNone(bank.window(41, 10))
+
+        try:
+            background_generator_update.use_texture_bank(2, 2, 64, 256)
+            self.assertEqual(background_generator_update.quasicrystal(32, 200).size, (200, 32))
+            # Larger than the textures, made as before
+            self.assertEqual(background_generator_update.quasicrystal(32, 300).size, (300, 32))
+        finally:
+            background_generator_update.use_texture_bank(2, 0)
+
+    def test_texture_bank_from_config(self):
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            Image.new("RGB", (300, 100), "red").save(os.path.join(tmp_dir, "bg.png"))
+            with open(os.path.join(tmp_dir, "notes.txt"), "w") as f:
+                f.write("not an image")
+            _image_cache.clear()
+            init_worker(
+                GenerationConfig(
+                    background_type=3, image_dir=tmp_dir, texture_bank_size=4
+                )
+            )
+            # Decoded into the bank only
+            self.assertEqual(len(_image_cache), 0)
+            self.assertEqual(texture_window(3, 32, 100, tmp_dir).shape, (32, 100, 3))
+            bkgd = background_generator.image(32, 100, tmp_dir)
+            self.assertEqual((bkgd.mode, bkgd.size), ("RGB", (100, 32)))
+        finally:
+            background_generator_update.use_texture_bank(3, 0, image_dir=tmp_dir)
+            _image_cache.clear()
+            shutil.rmtree(tmp_dir)
+
+    def test_texture_bank_memmap_dir_from_config(self):
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            config = GenerationConfig(
+                background_type=2, texture_bank_size=2, texture_bank_dir=tmp_dir
+            )
+            init_worker(config)
+            self.assertEqual(len(os.listdir(tmp_dir)), 2)
+            self.assertIsInstance(texture_window(2, 32, 100).base, np.memmap)
+            # Mapped again, not made again
+            mtimes = sorted(
+                os.stat(os.path.join(tmp_dir, name)).st_mtime_ns
+                for name in os.listdir(tmp_dir)
+            )
+            init_worker(config)
+            self.assertEqual(
+                sorted(
+                    os.stat(os.path.join(tmp_dir, name)).st_mtime_ns
+                    for name in os.listdir(tmp_dir)
+                ),
+                mtimes,
+            )
+        finally:
+            background_generator_update.use_texture_bank(2, 0)
+            shutil.rmtree(tmp_dir)
+
+    def test_background_atlas(self):
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            image_dir = os.path.join(tmp_dir, "images")
+            os.mkdir(image_dir)
+            Image.new("RGB", (400, 100), "red").save(os.path.join(image_dir, "a.png"))
+            Image.new("L", (90, 30), 7).save(os.path.join(image_dir, "b.png"))
+            with open(os.path.join(image_dir, "notes.txt"), "w") as f:
+                f.write("not an image")
+            path = os.path.join(tmp_dir, "images.npy")
+
+            atlas = build_atlas(image_dir, path, (60, 60))
+            self.assertTrue(is_atlas(path))
+            self.assertEqual(atlas.entries, [(0, 60, 240), (240 * 60 * 3, 60, 180)])
+            self.assertEqual(atlas.image(1)[0, 0].tolist(), [7, 7, 7])
+
+            bkgd = background_generator_update.image(32, 200, path, False)
+            self.assertEqual((bkgd.mode, bkgd.size), ("RGB", (200, 32)))
+            bkgd = background_generator_update.image(80, 300, path, True)
+            self.assertEqual((bkgd.mode, bkgd.size), ("L", (300, 80)))
+        finally:
+            shutil.rmtree(tmp_dir)
+
+
+class FontCaching(unittest.TestCase):
+    def test_font_cache_hits_and_variants(self):
+        cache = FontCache()
+        font = cache.get("tests/font_ar.ttf", 20)
+        self.assertIs(cache.get("tests/font_ar.ttf", 20), font)
+        variant = cache.get("tests/font_ar.ttf", 32)
+        self.assertEqual(variant.size, 32)
+        self.assertEqual(cache.stats()["hits"], 1)
+        self.assertEqual(cache.stats()["misses"], 2)
+        self.assertEqual(cache.nbytes, os.path.getsize("tests/font_ar.ttf"))
+
+    def test_font_cache_eviction(self):
+        cache = FontCache(max_entries=2)
+        for size in (10, 11, 12):
+            cache.get("tests/font_ar.ttf", size)
+        self.assertEqual(len(cache), 2)
+        cache.get("tests/font_ar.ttf", 10)
+        self.assertEqual(cache.stats()["misses"], 4)
+
+        cache = FontCache(max_bytes=os.path.getsize("tests/font_ar.ttf"))
+        cache.get("tests/font_ar.ttf", 10)
+        cache.get("tests/font_ckb.ttf", 10)
+        self.assertEqual(len(cache), 1)
+        self.assertEqual(cache.nbytes, os.path.getsize("tests/font_ckb.ttf"))
+
+    def test_font_loaded_at_picked_size(self):
+        random.seed(5)
+        image_font, font_size = computer_text_generator_update._get_valid_font_from_directory(
+            "trdg/fonts/latin", "Hello", 24, 48
+        )
+        self.assertEqual(image_font.size, font_size)
+
+
+class ImageCaching(unittest.TestCase):
+    def test_image_cache_budget_and_listing(self):
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            for name in ("a.png", "b.png"):
+                Image.new("RGB", (40, 30), "red").save(os.path.join(tmp_dir, name))
+            cache = ImageCache(max_bytes=40 * 30 * 3, max_height=15)
+            self.assertEqual(sorted(cache.list_dir(tmp_dir)), ["a.png", "b.png"])
+            image = cache.get(os.path.join(tmp_dir, "a.png"))
+            self.assertEqual(image.size, (20, 15))
+            self.assertIs(cache.get(os.path.join(tmp_dir, "a.png")), image)
+            cache.get(os.path.join(tmp_dir, "b.png"))
+            self.assertEqual((len(cache), cache.stats()["hits"]), (2, 1))
+
+            cache.max_height = None
+            cache.clear()
+            cache.get(os.path.join(tmp_dir, "a.png"))
+            cache.get(os.path.join(tmp_dir, "b.png"))
+            self.assertEqual(len(cache), 1)
+
+            os.remove(os.path.join(tmp_dir, "a.png"))
+            os.utime(tmp_dir, ns=(0, 0))
+            self.assertEqual(cache.list_dir(tmp_dir), ["b.png"])
+        finally:
+            shutil.rmtree(tmp_dir)
+
+    def test_image_cache_reduced_jpeg_decode(self):
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmp_dir, "a.jpg")
+            Image.new("RGB", (800, 600), "red").save(path)
+            cache = ImageCache()
+            self.assertEqual(cache.get(path, (150, 32)).size, (200, 150))
+            self.assertEqual(cache.get(path, (300, 32)).size, (400, 300))
+            self.assertEqual(cache.get(path, (100, 10)).size, (200, 150))
+            self.assertEqual(cache.get(path, (900, 32)).size, (800, 600))
+            self.assertEqual(cache.get(path, (300, 32)).size, (400, 300))
+            self.assertEqual(cache.stats()["misses"], 3)
+
+            png_path = os.path.join(tmp_dir, "b.png")
+            Image.new("RGB", (800, 600), "red").save(png_path)
+            self.assertEqual(cache.get(png_path, (150, 32)).size, (800, 600))
+        finally:
+            shutil.rmtree(tmp_dir)
+
+
+class FontSelection(unittest.TestCase):
+    def test_font_registry_manifest(self):
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            font_dir = os.path.join(tmp_dir, "fonts")
+            os.mkdir(font_dir)
+            shutil.copy("tests/font_ar.ttf", font_dir)
+            with open(os.path.join(font_dir, "broken.ttf"), "w") as f:
+                f.write("not a font")
+            manifest_path = os.path.join(tmp_dir, "manifest.json")
+
+            registry = FontRegistry(font_dir, manifest_path)
+            self.assertEqual(
+                registry.fonts, [os.path.join(os.path.abspath(font_dir), "font_ar.ttf")]
+            )
+            self.assertTrue(registry.entries[0]["scalable"])
+            self.assertTrue(os.path.isfile(manifest_path))
+
+            manifest_mtime = os.stat(manifest_path).st_mtime_ns
+            self.assertEqual(FontRegistry(font_dir, manifest_path).fonts, registry.fonts)
+            self.assertEqual(os.stat(manifest_path).st_mtime_ns, manifest_mtime)
+
+            shutil.copy("tests/font_ckb.ttf", font_dir)
+            self.assertEqual(len(FontRegistry(font_dir, manifest_path)), 2)
+        finally:
+            shutil.rmtree(tmp_dir)
+
+    def test_glyph_coverage_index(self):
+        index = GlyphCoverageIndex(["a", "b"], [[(65, 90)], [(65, 70), (97, 122)]])
+        self.assertEqual(index.fonts_for_text("AB C"), ["a", "b"])
+        self.assertEqual(index.fonts_for_text("Az"), ["b"])
+        self.assertEqual(index.fonts_for_text("ZZ"), ["a"])
+        self.assertEqual(index.fonts_for_text("中"), [])
+
+        with open("tests/font_ar.ttf", "rb") as f:
+            coverage = read_cmap(f.read())
+        self.assertTrue(any(start <= ord("ب") <= end for start, end in coverage))
+
+    def test_glyph_metrics_match_freetype(self):
+        image_font = FontCache().get("tests/font_ar.ttf", 24)
+        metrics = GlyphMetrics(image_font, zero_width_chars=["b"])
+        text = "abc ab"
+        self.assertEqual(
+            list(metrics.advances(text)),
+            [round(image_font.getlength(c)) for c in text],
+        )
+        self.assertEqual(list(metrics.bottoms(text)), [image_font.getbbox(c)[3] for c in text])
+        self.assertEqual(list(metrics.widths(text))[1], 0)
+
+
+class Workers(unittest.TestCase):
+    def test_init_worker_preloads(self):
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            Image.new("RGB", (40, 30), "red").save(os.path.join(tmp_dir, "bg.png"))
+            init_worker(
+                GenerationConfig(
+                    fonts=["tests/font_ar.ttf"],
+                    size=27,
+                    background_type=3,
+                    image_dir=tmp_dir,
+                )
+            )
+            image_path = os.path.join(tmp_dir, "bg.png")
+            self.assertIs(load_image(image_path), load_image(image_path))
+
+            hits = font_cache_stats()["hits"]
+            computer_text_generator_update.get_font("tests/font_ar.ttf", 27)
+            self.assertEqual(font_cache_stats()["hits"], hits + 1)
+        finally:
+            shutil.rmtree(tmp_dir)
+
+    def test_generate_task_reports_rejections(self):
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            image_dir = os.path.join(tmp_dir, "images")
+            os.mkdir(image_dir)
+            # Rejected for its low contrast, as the generator measures it
+            Image.new("RGB", (200, 100), "#555555").save(os.path.join(image_dir, "bg.png"))
+            config = GenerationConfig(
+                fonts=["tests/font_ar.ttf"],
+                out_dir=tmp_dir,
+                size=32,
+                background_type=3,
+                image_dir=image_dir,
+                text_color="#808080",
+                name_format=2,
+            )
+            init_worker(config)
+            self.assertEqual(
+                generate_task((0, "hello", "tests/font_ar.ttf", 1)), (0, "low contrast")
+            )
+            self.assertFalse(os.path.exists(os.path.join(tmp_dir, "0.jpg")))
+
+            Image.new("RGB", (200, 100), "white").save(os.path.join(image_dir, "bg.png"))
+            _image_cache.clear()
+            self.assertEqual(generate_task((0, "hello", "tests/font_ar.ttf", 1)), (0, None))
+            self.assertTrue(os.path.exists(os.path.join(tmp_dir, "0.jpg")))
+        finally:
+            _image_cache.clear()
+            shutil.rmtree(tmp_dir)
+
+    def test_collect_warmups_of_reporting_workers(self):
+        warmup_queue = multiprocessing.Queue()
+        warmup_queue.put((1, 0.0, 2.0))
+        warmups = collect_warmups(warmup_queue, 4, timeout=0.1)
+        self.assertEqual(warmups, [(1, 0.0, 2.0)])
+        with contextlib.redirect_stdout(io.StringIO()) as output:
+            report_throughput(warmups, [1.0, 3.0, 4.0, 5.0])
+            report_throughput([], [1.0, 2.0])
+        self.assertIn("over 1 workers", output.getvalue())
+
+    def test_generator_config_follows_attributes(self):
+        generator = GeneratorFromStrings(
+            ["hello"], count=2, fonts=["tests/font_ar.ttf"], size=20
+        )
+        config = generator.config
+        self.assertIs(generator.config, config)
+        generator.size = 40
+        generator.fonts.append("tests/font_ckb.ttf")
+        self.assertEqual(generator.config.size, 40)
+        self.assertEqual(len(generator.config.fonts), 2)
+        image, label = next(generator)
+        self.assertEqual((image.height, label), (40, "hello"))
+
+    def test_generation_config(self):
+        config = GenerationConfig(
+            text_color="#000000,#888888", margins=3, orientation=1
+        )
+        self.assertEqual(config.text_color, ((0, 0, 0), (136, 136, 136)))
+        self.assertEqual(config.margins, (3, 3, 3, 3))
+        self.assertIs(config.orientation, Orientation.VERTICAL)
+        with self.assertRaises(AttributeError):
+            config.size = 64
+        self.assertEqual(
+            pickle.loads(pickle.dumps(config)).__getstate__(), config.__getstate__()
+        )
+        self.assertRaises(ValueError, GenerationConfig, background_type=7)
+
+
+class Rendering(unittest.TestCase):
+    def assertSameRendering(self, *args):
+        outputs = []
+        for engine in ("draw", "atlas"):
+            random.seed(42)
+            outputs.append(
+                computer_text_generator_update.generate(*args, rendering_engine=engine)
+            )
+        (draw_img, draw_mask, draw_size), (atlas_img, atlas_mask, atlas_size) = outputs
+        self.assertEqual(draw_size, atlas_size)
+        self.assertEqual(draw_img.tobytes(), atlas_img.tobytes())
+        self.assertEqual(draw_mask.tobytes(), atlas_mask.tobytes())
+
+    def test_atlas_matches_draw_horizontal(self):
+        self.assertSameRendering(
+            "Hello world", "trdg/fonts/latin", False, 20, 40, 0, True, 3, 1.0, 1, False, False, 1
+        )
+
+    def test_atlas_matches_draw_vertical(self):
+        self.assertSameRendering(
+            "สวัสดีครับ", "trdg/fonts/th", True, 20, 40, 1, False, 0, 1.0, 0, False, False, 2
+        )
+
+    def test_single_pass_mask_follows_image(self):
+        outputs = []
+        for engine in ("draw", "single_pass"):
+            random.seed(7)
+            outputs.append(
+                computer_text_generator_update.generate(
+                    "สวัสดี ครับ", "trdg/fonts/th", False, 20, 40, 0, False, 0, 1.0, 0,
+                    False, True, 2, rendering_engine=engine,
+                )
+            )
+        (draw_img, _, _), (img, mask, _) = outputs
+        self.assertEqual(draw_img.tobytes(), img.tobytes())
+        img_arr, mask_arr = np.array(img), np.array(mask)
+        self.assertEqual(mask.mode, "I;16")
+        self.assertTrue(np.array_equal(mask_arr != 0, img_arr[..., 3] > 0))
+        # Background and the two words, the space has no pixels
+        self.assertEqual(list(np.unique(mask_arr)), [0, 1, 3])
+
+    def test_split_clusters(self):
+        self.assertEqual(computer_text_generator_update._split_clusters("abc"), [0, 1, 2])
+        self.assertEqual(computer_text_generator_update._split_clusters("नमस्ते"), [0, 1, 2])
+        self.assertEqual(computer_text_generator_update._split_clusters("สวัสดี"), [0, 1, 3, 4])
+        self.assertEqual(
+            computer_text_generator_update.split_clusters("नमस्ते"), ["न", "म", "स्ते"]
+        )
+
+    def test_shaped_line_warns_of_ignored_spacing(self):
+        random.seed(3)
+        with self.assertWarnsRegex(UserWarning, "character_spacing, word_split"):
+            computer_text_generator_update.generate(
+                "नमस्ते", "trdg/fonts/hi", False, 20, 40, 0, False, 0, 1.0, 2, False,
+                True, rendering_engine="raqm",
+            )
+
+    def test_shaped_line_mask_labels_clusters(self):
+        random.seed(3)
+        img, mask, _ = computer_text_generator_update.generate(
+            "नमस्ते", "trdg/fonts/hi", False, 20, 40, 0, False, 0, 1.0, 0, False, False,
+            rendering_engine="raqm",
+        )
+        img_arr, mask_arr = np.array(img), np.array(mask)
+        self.assertEqual(img.size, mask.size)
+        self.assertTrue(np.array_equal(mask_arr != 0, img_arr[..., 3] > 0))
+        self.assertEqual(list(np.unique(mask_arr[mask_arr != 0])), [1, 2, 3])
+
+    def test_cluster_offsets_measure_each_cluster_once(self):
+        class KernedFont(object):
+            # Each character is 10 wide, the whole line is kerned by 4
+            def __init__(self):
+                self.measured = []
+
+            def getlength(self, text, direction=None):
+                self.measured.append(text)
+                return 10 * len(text) - (4 if len(text) == 5 else 0)
+
+        font = KernedFont()
+        offsets = computer_text_generator_update._cluster_offsets(
+            font, "abcde", [0, 1, 3, 4]
+        )
+        self.assertEqual(font.measured, ["a", "bc", "d", "e", "abcde"])
+        # Scaled from 50 to the 46 of the whole line
+        self.assertEqual(list(offsets), [0, 9, 28, 37])
+
+    def test_unknown_rendering_engine(self):
+        self.assertRaises(
+            ValueError,
+            computer_text_generator_update.generate,
+            "Hello", "trdg/fonts/latin", False, 20, 40, 0, False, 0, 1.0, 0, False, False,
+            rendering_engine="unknown",
+        )
+
+
+class BoundingBoxes(unittest.TestCase):
+    def test_mask_only_rendered_when_needed(self):
+        outputs = []
+        for output_mask in (0, 1):
+            random.seed(11)
+            outputs.append(
+                FakeTextDataGenerator.generate(
+                    0, "Hello world", "trdg/fonts/latin", None, False, 20, 40, None,
+                    False, 0, 0, False, 0, False, 1, 2, 2, False, 0, -1, 0, "#282828",
+                    0, 1.0, 0, (5, 5, 5, 5), False, output_mask, False, None,
+                )
+            )
+        image, (masked_image, mask) = outputs
+        self.assertEqual(image.tobytes(), masked_image.tobytes())
+        self.assertEqual(mask.mode, "I;16")
+        self.assertEqual(mask.size, image.size)
+
+    def test_generate_returns_sample(self):
+        args = (
+            0, "Hello world", "trdg/fonts/latin", None, False, 20, 40, None, False, 0,
+            0, False, 0, False, 1, 0, 0, False, 0, -1, 0, "#282828", 0, 1.0, 0,
+            (5, 5, 5, 5), False, 0, False, None,
+        )
+        random.seed(4)
+        image = FakeTextDataGenerator.generate(*args, output_bboxes=1)
+        random.seed(4)
+        # No output flag needed for the mask and the boxes
+        sample = FakeTextDataGenerator.generate(*args, return_sample=True)
+        self.assertIsInstance(sample, Sample)
+        self.assertEqual(sample.image.tobytes(), image.tobytes())
+        self.assertEqual(sample.mask.mode, "I;16")
+        self.assertEqual(sample.mask.size, sample.image.size)
+        self.assertEqual(len(sample.bboxes()), len("Hello world"))
+        self.assertIs(sample.bboxes(), sample.bboxes())
+        self.assertEqual(sample.bboxes(), mask_to_bboxes(sample.mask))
+
+    def test_tesseract_boxes_of_shaped_line(self):
+        out_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, out_dir)
+        random.seed(4)
+        FakeTextDataGenerator.generate(
+            0, "नमस्ते", "trdg/fonts/hi", out_dir, False, 20, 40, "jpg", False, 0,
+            0, False, 0, False, 1, 0, 0, False, 2, -1, 0, "#282828", 0, 1.0, 0,
+            (5, 5, 5, 5), False, 0, False, None, output_bboxes=2,
+            rendering_engine="raqm",
+        )
+        with open(os.path.join(out_dir, "0.box"), encoding="utf-8") as f:
+            pieces = [line.split(" ")[0] for line in f]
+        # One box per grapheme cluster, written with its characters
+        self.assertEqual(pieces, ["न", "म", "स्ते"])
+
+    def test_layout_bboxes(self):
+        for engine in ("draw", "single_pass"):
+            random.seed(3)
+            img, mask, _, extents = computer_text_generator_update.generate(
+                "ab cd", "trdg/fonts/latin", False, 20, 40, 0, False, 0, 1.0, 0, False,
+                False, rendering_engine=engine, return_bboxes=True,
+            )
+            self.assertEqual(len(extents), 5)
+            self.assertIsNone(extents[2])
+            # The ink of the glyphs, as tight as the mask
+            self.assertEqual(extents, label_extents(np.array(mask)))
+
+    def test_layout_bboxes_with_stroke(self):
+        # Grayscale samples always get a stroke
+        for engine in ("draw", "atlas", "single_pass"):
+            for stroke_width in (1, 2):
+                random.seed(3)
+                img, mask, _, extents = computer_text_generator_update.generate(
+                    "Hello world", "trdg/fonts/latin", False, 20, 40, 0, False, 0,
+                    1.0, 0, False, True, stroke_width=stroke_width,
+                    rendering_engine=engine, return_bboxes=True,
+                )
+                mask_extents = label_extents(np.array(mask))
+                if engine != "single_pass":
+                    # The stroke is drawn with label 0, the boxes skip it
+                    self.assertEqual(extents, mask_extents)
+                    continue
+                # The stroke is labelled, later glyphs cover some of it
+                for extent, mask_extent in zip(extents, mask_extents):
+                    if extent is None:
+                        self.assertIsNone(mask_extent)
+                        continue
+                    self.assertEqual(extent[:2], mask_extent[:2])
+                    self.assertGreaterEqual(extent[2], mask_extent[2])
+                    self.assertEqual(extent[3], mask_extent[3])
+
+    def test_extents_to_bboxes_matches_mask(self):
+        mask = np.zeros((20, 40, 3), dtype=np.uint8)
+        extents = [(2, 3, 6, 15), None, (12, 5, 20, 17), (22, 2, 30, 12)]
+        for i, extent in enumerate(extents):
+            if extent is not None:
+                x0, y0, x1, y1 = extent
+                mask[y0 : y1 + 1, x0 : x1 + 1, 2] = i + 1
+        mask = Image.fromarray(mask)
+        for tess in (False, True):
+            self.assertEqual(
+                extents_to_bboxes(extents, 40, 20, tess),
+                [tuple(int(v) for v in b) for b in mask_to_bboxes(mask, tess)],
+            )
+
+    def test_label_extents(self):
+        labels = np.zeros((10, 10), dtype=np.int32)
+        labels[2:4, 1:5] = 1
+        labels[7, 8] = 3
+        self.assertEqual(label_extents(labels), [(1, 2, 4, 3), None, (8, 7, 8, 7)])
+        self.assertEqual(label_extents(np.zeros((4, 4), dtype=np.int32)), [])
+        rgba_mask = Image.new("RGBA", (10, 10), (0, 0, 1, 255))
+        self.assertEqual(mask_to_bboxes(rgba_mask), [])
+
+
+class Transforms(unittest.TestCase):
+    def test_distorsion_moves_mask_with_image(self):
+        alpha = np.zeros((30, 80), dtype=np.uint8)
+        alpha[5:25, 10:70] = np.random.RandomState(0).randint(0, 2, (20, 60)) * 255
+        image = Image.fromarray(np.dstack([alpha] * 4))
+        mask = Image.fromarray((alpha > 0).astype(np.uint16))
+        for distort in (distorsion_generator.sin, distorsion_generator.random):
+            for vertical, horizontal in ((True, False), (False, True), (True, True)):
+                new_image, new_mask = distort(image, mask, vertical, horizontal)
+                self.assertEqual(new_mask.mode, "I;16")
+                self.assertEqual(new_image.size, new_mask.size)
+                self.assertTrue(
+                    np.array_equal(
+                        np.asarray(new_image)[..., 3] > 0, np.asarray(new_mask) > 0
+                    )
+                )
+                self.assertEqual(
+                    np.count_nonzero(np.asarray(new_mask)), np.count_nonzero(alpha)
+                )
+
+    def test_geometry_matches_separate_passes(self):
+        alpha = np.zeros((30, 80), dtype=np.uint8)
+        alpha[5:25, 10:70] = np.random.RandomState(0).randint(0, 2, (20, 60)) * 255
+        image = Image.fromarray(np.dstack([alpha] * 4))
+        mask = Image.fromarray((alpha > 0).astype(np.uint16) * np.arange(80, dtype=np.uint16))
+        for angle in (0, 7, -30, 90, 180, 270):
+            matrix, size = geometry.rotation(image.size, angle)
+            self.assertEqual(size, image.rotate(angle, expand=1).size)
+            _, new_mask = geometry.warp(image, mask, matrix, None, size, size)
+            self.assertEqual(new_mask.tobytes(), mask.rotate(angle, expand=1).tobytes())
+        field = distorsion_generator.displacement_field(1, image.size, True, True)
+        new_image, new_mask = geometry.warp(image, mask, None, field, field.size, field.size)
+        distorted_image, distorted_mask = distorsion_generator.sin(image, mask, True, True)
+        self.assertEqual(new_mask.tobytes(), distorted_mask.tobytes())
+        self.assertEqual(
+            new_image.getchannel("A").tobytes(), distorted_image.getchannel("A").tobytes()
+        )
+
+
+class Compositing(unittest.TestCase):
+    def test_composite_matches_paste(self):
+        random_state = np.random.RandomState(0)
+        text = Image.fromarray(random_state.randint(0, 256, (10, 40, 4), dtype=np.uint8))
+        for mode in ("L", "RGB", "RGBA"):
+            background = Image.fromarray(
+                random_state.randint(0, 256, (20, 60, 4), dtype=np.uint8)
+            ).convert(mode)
+            pixels = background.tobytes()
+            for image_mode, offset in (("RGB", (5, 3)), ("RGBA", (-5, 15)), ("1", (30, 0))):
+                expected = background.convert("RGBA")
+                expected.paste(text, offset, text)
+                self.assertEqual(
+                    composite(background, text, offset, image_mode).tobytes(),
+                    expected.convert(image_mode).tobytes(),
+                )
+            self.assertEqual(background.tobytes(), pixels)
+
+        mask = Image.new("I;16", (4, 3), 7)
+        full_mask = place_mask(mask, (10, 5), (8, 1))
+        self.assertEqual(full_mask.mode, "I;16")
+        # Clipped to the right edge
+        self.assertEqual(np.count_nonzero(np.asarray(full_mask)), 6)
+        self.assertTrue(np.all(np.asarray(full_mask)[1:4, 8:] == 7))
+
+    def test_colors_stand_out_from_background(self):
+        # Darker on the left, any cut of at least 20 x 30 is 90 to 120 on average
+        background = Image.fromarray(
+            np.tile(np.linspace(90, 150, 200).round().astype(np.uint8), (30, 1))
+        )
+        low, high = background_generator_update.gray_range(background, (1, 30))
+        self.assertEqual(low, 90)
+        self.assertAlmostEqual(high, 120, delta=0.5)
+
+        margin = computer_text_generator_update.MIN_CONTRAST
+        for gray_scale, stroke_width in ((True, 0), (False, 0), (False, 2)):
+            for _ in range(50):
+                fill, stroke_width, stroke_fill = computer_text_generator_update._pick_colors(
+                    gray_scale, stroke_width, "#282828", 2, background_gray=(low, high)
+                )
+                levels = [sum(fill) / 3] + ([sum(stroke_fill) / 3] if stroke_width else [])
+                self.assertTrue(
+                    all(level <= low - margin for level in levels)
+                    or all(level >= high + margin for level in levels)
+                )
+
+    def test_rejections_return_none_unless_raised(self):
+        # Spaces only, nothing is drawn
+        args = (
+            0, "  ", "trdg/fonts/latin", None, False, 32, 32, "jpg", False, 0, 0,
+            False, 0, False, 1, 0, 0, False, 0, -1, 0, "#282828", 0, 1, 0,
+            (2, 2, 2, 2), False, 0, False, None,
+        )
+        self.assertIsNone(FakeTextDataGenerator.generate(*args))
+        with self.assertRaises(SampleRejected) as raised:
+            FakeTextDataGenerator.generate(*args, raise_rejections=True)
+        self.assertEqual(raised.exception.cause, "no visible text")
+
+    def test_gray_levels_of_palette_and_la_backgrounds(self):
+        palette = Image.new("RGB", (20, 10), (90, 120, 150)).convert(
+            "P", palette=Image.Palette.ADAPTIVE
+        )
+        for background in (palette, Image.new("LA", (20, 10), (120, 30))):
+            self.assertEqual(
+                background_generator_update.gray_range(background, (5, 5)), (120, 120)
+            )
+            self.assertEqual(background_generator_update.mean_gray(background), 120)
+
+    def test_gray_scale_stays_grayscale(self):
+        random.seed(3)
+        img, _, _ = computer_text_generator_update.generate(
+            "Hello", "trdg/fonts/latin", True, 30, 30, 0, False, 0, 1.0, 0, False, False,
+            rendering_engine="atlas", with_mask=False,
+        )
+        self.assertEqual(img.mode, "LA")
+        matrix, size = geometry.rotation(img.size, 5)
+        self.assertEqual(geometry.warp(img, None, matrix, None, size, (60, 20))[0].mode, "LA")
+        self.assertEqual(distorsion_generator.sin(img, None)[0].mode, "LA")
+        for background_type in (0, 1, 2):
+            background = background_generator_update.generate(
+                background_type, 32, 100, None, True
+            )
+            self.assertEqual(background.mode, "L")
+
+        random.seed(3)
+        image = FakeTextDataGenerator.generate(
+            0, "Hello", "trdg/fonts/latin", None, True, 32, 32, "jpg", False, 0, 5, False,
+            1, False, 2, 1, 0, False, 0, -1, 0, "#282828", 0, 1, 0, (2, 2, 2, 2), False,
+            0, False, None, image_mode="L",
+        )
+        self.assertEqual(image.mode, "L")
+
+    def test_image_mode_l_renders_in_one_channel(self):
+        modes = []
+
+        def recording(generate):
+            def wrapper(*args, **kwargs):
+                outputs = generate(*args, **kwargs)
+                image = outputs[0] if isinstance(outputs, tuple) else outputs
+                modes.append(image.mode)
+                return outputs
+
+            return wrapper
+
+        random.seed(3)
+        with unittest.mock.patch.object(
+            computer_text_generator_update,
+            "generate",
+            recording(computer_text_generator_update.generate),
+        ), unittest.mock.patch.object(
+            background_generator_update,
+            "generate",
+            recording(background_generator_update.generate),
+        ):
+            image = FakeTextDataGenerator.generate(
+                0, "Hello", "trdg/fonts/latin", None, False, 32, 32, "jpg", False, 0,
+                5, False, 1, False, 0, 1, 0, False, 0, -1, 0, "#282828", 0, 1, 0,
+                (2, 2, 2, 2), False, 0, False, None, image_mode="L",
+            )
+        # Background, then text, without gray_scale
+        self.assertEqual(modes, ["L", "LA"])
+        self.assertEqual(image.mode, "L")
+
+
 # class CommandLineInterface(unittest.TestCase):
 #     def test_output_dir(self):
 #         args = ["python3", "run.py", "-c", "1", "--output_dir", "../tests/out_2/"]
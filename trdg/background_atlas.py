@@ -0,0 +1,209 @@
+"""
+Background images resized once and packed in a single memory-mapped file
+"""
+
+import argparse
+import json
+import os
+import random as rnd
+from typing import Tuple
+
+import numpy as np
+from PIL import Image
+
+from trdg.image_cache import list_images
+
+# Atlases opened by this process, by path
+_atlases = {}
+
+
+def _index_path(path: str) -> str:
+    return os.path.splitext(path)[0] + ".json"
+
+
+def is_atlas(path: str) -> bool:
+    """
+    Whether path, given where an image directory is expected, is an atlas
+    """
+
+    return path is not None and path.endswith(".npy") and os.path.isfile(path)
+
+
+class BackgroundAtlas(object):
+    """
+    Background images stored one after the other as uint8 RGB pixels in a .npy
+    file, with a .json index of their (offset, height, width) next to it. The
+    file is memory-mapped: windows are cut from it without decoding anything,
+    and all the processes share the same pages.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.pixels = np.load(path, mmap_mode="r")
+        with open(_index_path(path), "r") as f:
+            index = json.load(f)
+        self.channels = index["channels"]
+        self.entries = [tuple(entry) for entry in index["entries"]]
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def image(self, i: int) -> np.ndarray:
+        """
+        Pixels of the i-th image, a view of the file
+        """
+
+        offset, height, width = self.entries[i]
+        return self.pixels[offset : offset + height * width * self.channels].reshape(
+            height, width, self.channels
+        )
+
+    def window(self, height: int, width: int) -> np.ndarray:
+        """
+        Random height x width window of a random image. Only an image smaller
+        than the window is resized, otherwise the window is a view of the file.
+        """
+
+        pixels = self.image(rnd.randint(0, len(self.entries) - 1))
+        if pixels.shape[0] < height or pixels.shape[1] < width:
+            scale = max(height / pixels.shape[0], width / pixels.shape[1])
+            pixels = np.asarray(
+                Image.fromarray(np.asarray(pixels)).resize(
+                    (
+                        max(width, int(pixels.shape[1] * scale)),
+                        max(height, int(pixels.shape[0] * scale)),
+                    ),
+                    Image.Resampling.LANCZOS,
+                )
+            )
+        y = rnd.randint(0, pixels.shape[0] - height)
+        x = rnd.randint(0, pixels.shape[1] - width)
+        return pixels[y : y + height, x : x + width]
+
+
+def load_atlas(path: str) -> BackgroundAtlas:
+    """
+    Open an atlas once per process
+    """
+
+    atlas = _atlases.get(path)
+    if atlas is None:
+        atlas = BackgroundAtlas(path)
+        _atlases[path] = atlas
+    return atlas
+
+
+def build_atlas(
+    image_dir: str,
+    path: str,
+    heights: Tuple[int, int],
+    seed: int = None,
+) -> BackgroundAtlas:
+    """
+    Resize every image of image_dir to a height picked between heights[0] and
+    heights[1] (both included), keeping its aspect ratio, and pack them in the
+    atlas at path. Files that aren't images are skipped.
+    """
+
+    random = rnd.Random(seed)
+    min_height, max_height = heights
+    if min_height <= 0 or max_height < min_height:
+        raise ValueError("Invalid height range")
+
+    # Sizes first, opening an image only reads its header
+    sources = []
+    for name in sorted(list_images(image_dir)):
+        source = os.path.join(image_dir, name)
+        try:
+            with Image.open(source) as image:
+                width, height = image.size
+        except OSError:
+            continue
+        new_height = random.randint(min_height, max_height)
+        sources.append(
+            (source, max(1, round(width * new_height / height)), new_height)
+        )
+    if not sources:
+        raise ValueError("No images where found in the images folder!")
+
+    entries = []
+    offset = 0
+    for _, width, height in sources:
+        entries.append((offset, height, width))
+        offset += height * width * 3
+
+    pixels = np.lib.format.open_memmap(path, mode="w+", dtype=np.uint8, shape=(offset,))
+    for (source, width, height), (offset, _, _) in zip(sources, entries):
+        with Image.open(source) as image:
+            image = image.convert("RGB").resize((width, height), Image.Resampling.LANCZOS)
+            pixels[offset : offset + height * width * 3] = np.asarray(image).reshape(-1)
+    pixels.flush()
+    del pixels
+
+    with open(_index_path(path), "w") as f:
+        json.dump({"channels": 3, "entries": entries}, f)
+
+    _atlases.pop(path, None)
+    return load_atlas(path)
+
+
+def main():
+    """
+    Entry point of trdg-prepare-backgrounds
+    """
+
+    parser = argparse.ArgumentParser(
+        description="Resize the background images once and pack them in a "
+        "memory-mapped atlas that can be given as --image_dir"
+    )
+    parser.add_argument(
+        "-id",
+        "--image_dir",
+        type=str,
+        required=True,
+        help="Define the directory of the background images",
+    )
+    parser.add_argument(
+        "-hg",
+        "--height",
+        type=int,
+        nargs="+",
+        required=True,
+        help="Define the height of the resized images, or a range of heights to pick from",
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        type=str,
+        nargs="?",
+        help="Define the atlas file, next to the image directory by default",
+        default=None,
+    )
+    parser.add_argument(
+        "-s",
+        "--seed",
+        type=int,
+        nargs="?",
+        help="Define the seed of the heights picked in the range",
+        default=None,
+    )
+    args = parser.parse_args()
+
+    if len(args.height) > 2:
+        parser.error("--height takes one height or a range of two")
+    output = args.output
+    if output is None:
+        output = os.path.normpath(args.image_dir) + ".npy"
+
+    atlas = build_atlas(
+        args.image_dir, output, (args.height[0], args.height[-1]), args.seed
+    )
+    print(
+        "{} images, {:.1f} MB in {}".format(
+            len(atlas), atlas.pixels.nbytes / (1024 * 1024), output
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -6,19 +6,27 @@ import numpy as np
 
 from PIL import Image, ImageDraw, ImageFilter
 
+from trdg.background_atlas import is_atlas, load_atlas
+from trdg.image_cache import list_images
+from trdg.texture_bank import texture_window
+from trdg.utils import load_image
+
 
 def gaussian_noise(height: int, width: int) -> Image:
     """
-    Create a background with Gaussian noise (to mimic paper)
+    Create a grayscale background with Gaussian noise (to mimic paper)
     """
 
-    # We create an all white image
-    image = np.ones((height, width)) * 255
+    window = texture_window(0, height, width)
+    if window is not None:
+        return Image.fromarray(window)
 
-    # We add gaussian noise
+    # Straight into one byte per pixel, RGBA is only made when colored text
+    # is composited on it
+    image = np.empty((height, width), dtype=np.uint8)
     cv2.randn(image, 235, 10)
 
-    return Image.fromarray(image).convert("RGBA")
+    return Image.fromarray(image)
 
 
 def plain_white(height: int, width: int) -> Image:
@@ -26,44 +34,75 @@ def plain_white(height: int, width: int) -> Image:
     Create a plain white background
     """
 
+    window = texture_window(1, height, width)
+    if window is not None:
+        return Image.fromarray(window).convert("RGBA")
+
     return Image.new("L", (width, height), 255).convert("RGBA")
 
 
+def quasicrystal_texture(
+    height: int, width: int, frequency: float, phase: float, rotation_count: int
+) -> np.ndarray:
+    """
+    Quasicrystal pattern over [-2pi, 2pi] on both axes sampled on a height x
+    width grid, as float32 values between -1 and 1. The same parameters give
+    the same pattern at any resolution.
+    """
+
+    # Each rotated wave is cos(a + b) with a only depending on the column and
+    # b on the row, so their sum is the product of two small matrices
+    xs = np.linspace(-2 * math.pi, 2 * math.pi, height)
+    ys = np.linspace(-2 * math.pi, 2 * math.pi, width)
+    angles = np.arange(rotation_count) * math.pi * 2.0 / rotation_count
+    row_phases = np.outer(xs, np.sin(angles)) * frequency
+    column_phases = np.outer(np.cos(angles), ys) * frequency + phase
+
+    z = np.cos(row_phases).astype(np.float32) @ np.cos(column_phases).astype(
+        np.float32
+    ) - np.sin(row_phases).astype(np.float32) @ np.sin(column_phases).astype(
+        np.float32
+    )
+    return z / np.float32(rotation_count)
+
+
 def quasicrystal(height: int, width: int) -> Image:
     """
     Create a background with quasicrystal (https://en.wikipedia.org/wiki/Quasicrystal)
     """
 
-    image = Image.new("L", (width, height))
-    pixels = image.load()
+    window = texture_window(2, height, width)
+    if window is not None:
+        return Image.fromarray(window).convert("RGBA")
 
     frequency = rnd.random() * 30 + 20  # frequency
     phase = rnd.random() * 2 * math.pi  # phase
     rotation_count = rnd.randint(10, 20)  # of rotations
 
-    for kw in range(width):
-        y = float(kw) / (width - 1) * 4 * math.pi - 2 * math.pi
-        for kh in range(height):
-            x = float(kh) / (height - 1) * 4 * math.pi - 2 * math.pi
-            z = 0.0
-            for i in range(rotation_count):
-                r = math.hypot(x, y)
-                a = math.atan2(y, x) + i * math.pi * 2.0 / rotation_count
-                z += math.cos(r * math.sin(a) * frequency + phase)
-            c = int(255 - round(255 * z / rotation_count))
-            pixels[kw, kh] = c  # grayscale
-    return image.convert("RGBA")
+    texture = quasicrystal_texture(height, width, frequency, phase, rotation_count)
+    # Half of the range is white, as it always was
+    pixels = np.clip(255 - np.round(255 * texture), 0, 255).astype(np.uint8)
+    return Image.fromarray(pixels).convert("RGBA")
 
 
 def image(height: int, width: int, image_dir: str) -> Image:
     """
     Create a background with a image
     """
-    images = os.listdir(image_dir)
+    if is_atlas(image_dir):
+        return Image.fromarray(load_atlas(image_dir).window(height, width))
+
+    window = texture_window(3, height, width, image_dir)
+    if window is not None:
+        return Image.fromarray(window)
+
+    images = list_images(image_dir)
     
     if len(images) > 0:
-        pic = Image.open(
-            os.path.join(image_dir, images[rnd.randint(0, len(images) - 1)])
+        # Decoded at the smallest scale the background fits in
+        pic = load_image(
+            os.path.join(image_dir, images[rnd.randint(0, len(images) - 1)]),
+            (width, height),
         )
 
         if pic.size[0] < width:
@@ -3,70 +3,150 @@ import math
 import os
 import random as rnd
 import numpy as np
+from typing import Tuple
 
 from PIL import Image, ImageDraw, ImageFilter
 
-
-def gaussian_noise(height: int, width: int) -> Image:
+from trdg.background_generator import quasicrystal_texture
+from trdg.texture_bank import TextureBank, set_texture_bank, texture_window
+from trdg.background_atlas import is_atlas, load_atlas
+from trdg.image_cache import decode_image, list_images
+from trdg.utils import load_image
+
+
+def use_texture_bank(
+    background_type: int,
+    size: int = 8,
+    height: int = 256,
+    width: int = 2048,
+    image_dir: str = None,
+    memmap_dir: str = None,
+) -> TextureBank:
     """
-    Create a background with Gaussian noise (to mimic paper)
+    Cut the backgrounds of a type (0: Gaussian noise, 1: plain white,
+    2: quasicrystal, 3: image) out of a bank of size textures of height x
+    width made once, or of size images of image_dir decoded once. A larger
+    bank gives more variety for more memory, a size of 0 goes back to making
+    every background. Backgrounds larger than all the textures are still made
+    as before. With memmap_dir, the textures are kept there and mapped.
     """
 
-    # We create an all white image
-    image = np.ones((height, width)) * 255
+    if size <= 0:
+        set_texture_bank(background_type, image_dir, None)
+        return None
+
+    if background_type == 0:
+        names = ["noise_{}x{}_{}".format(height, width, i) for i in range(size)]
+        bank = TextureBank.create(
+            names, lambda name: _gaussian_noise_pixels(height, width), memmap_dir
+        )
+    elif background_type == 1:
+        # Every window of white is the same
+        bank = TextureBank([np.full((height, width), 255, dtype=np.uint8)])
+    elif background_type == 2:
+        names = ["quasicrystal_{}x{}_{}".format(height, width, i) for i in range(size)]
+        bank = TextureBank.create(
+            names, lambda name: _quasicrystal_pixels(height, width), memmap_dir
+        )
+    elif background_type == 3:
+        images = sorted(list_images(image_dir))
+        images = rnd.sample(images, min(size, len(images)))
+        # Held by the bank only, not by the image cache as well
+        bank = TextureBank.create(
+            images,
+            lambda name: np.asarray(
+                decode_image(os.path.join(image_dir, name)).convert("RGB")
+            ),
+            memmap_dir,
+        )
+    else:
+        raise ValueError("Invalid background type")
+
+    set_texture_bank(background_type, image_dir, bank)
+    return bank
 
-    # We add gaussian noise
-    cv2.randn(image, 235, 10)
 
-    return Image.fromarray(image).convert("RGBA")
+def _from_texture_bank(
+    background_type: int, height: int, width: int, image_dir: str = None
+) -> Image:
+    window = texture_window(background_type, height, width, image_dir)
+    if window is None:
+        return None
+    return Image.fromarray(window)
 
 
-def plain_white(height: int, width: int, gray_scale: bool) -> Image:
+def _gaussian_noise_pixels(height: int, width: int) -> np.ndarray:
+    # Straight into one byte per pixel, RGBA is only made when colored text
+    # is composited on it
+    pixels = np.empty((height, width), dtype=np.uint8)
+    cv2.randn(pixels, 235, 10)
+    return pixels
+
+
+def _quasicrystal_pixels(height: int, width: int) -> np.ndarray:
+    frequency = rnd.random() * 30 + 20  # frequency
+    phase = rnd.random() * 2 * math.pi  # phase
+    rotation_count = rnd.randint(10, 20)  # of rotations
+
+    texture = quasicrystal_texture(height, width, frequency, phase, rotation_count)
+    # Half of the range is white, as it always was
+    return np.clip(255 - np.round(255 * texture), 0, 255).astype(np.uint8)
+
+
+def gaussian_noise(height: int, width: int) -> Image:
     """
-    Create a plain white background
+    Create a grayscale background with Gaussian noise (to mimic paper)
     """
 
-    image = Image.new("L", (width, height), 255).convert("RGBA")
-    if gray_scale:
-            image = image.convert("L")
-    return image
+    banked = _from_texture_bank(0, height, width)
+    if banked is not None:
+        return banked
 
+    return Image.fromarray(_gaussian_noise_pixels(height, width))
 
-def quasicrystal(height: int, width: int) -> Image:
+
+def plain_white(height: int, width: int, gray_scale: bool) -> Image:
     """
-    Create a background with quasicrystal (https://en.wikipedia.org/wiki/Quasicrystal)
+    Create a plain white background, grayscale with gray_scale
     """
 
-    image = Image.new("L", (width, height))
-    pixels = image.load()
+    image = _from_texture_bank(1, height, width)
+    if image is None:
+        image = Image.new("L", (width, height), 255)
+    return image if gray_scale else image.convert("RGBA")
 
-    frequency = rnd.random() * 30 + 20  # frequency
-    phase = rnd.random() * 2 * math.pi  # phase
-    rotation_count = rnd.randint(10, 20)  # of rotations
 
-    for kw in range(width):
-        y = float(kw) / (width - 1) * 4 * math.pi - 2 * math.pi
-        for kh in range(height):
-            x = float(kh) / (height - 1) * 4 * math.pi - 2 * math.pi
-            z = 0.0
-            for i in range(rotation_count):
-                r = math.hypot(x, y)
-                a = math.atan2(y, x) + i * math.pi * 2.0 / rotation_count
-                z += math.cos(r * math.sin(a) * frequency + phase)
-            c = int(255 - round(255 * z / rotation_count))
-            pixels[kw, kh] = c  # grayscale
-    return image.convert("RGBA")
+def quasicrystal(height: int, width: int, gray_scale: bool = False) -> Image:
+    """
+    Create a background with quasicrystal (https://en.wikipedia.org/wiki/Quasicrystal),
+    grayscale with gray_scale
+    """
+
+    image = _from_texture_bank(2, height, width)
+    if image is None:
+        image = Image.fromarray(_quasicrystal_pixels(height, width))
+    return image if gray_scale else image.convert("RGBA")
 
 
 def image(height: int, width: int, image_dir: str, gray_scale: bool) -> Image:
     """
     Create a background with a image
     """
-    images = os.listdir(image_dir)
+    if is_atlas(image_dir):
+        window = Image.fromarray(load_atlas(image_dir).window(height, width))
+        return window.convert("L") if gray_scale else window
+
+    banked = _from_texture_bank(3, height, width, image_dir)
+    if banked is not None:
+        return banked.convert("L") if gray_scale else banked
+
+    images = list_images(image_dir)
     
     if len(images) > 0:
-        pic = Image.open(
-            os.path.join(image_dir, images[rnd.randint(0, len(images) - 1)])
+        # Decoded at the smallest scale the background fits in
+        pic = load_image(
+            os.path.join(image_dir, images[rnd.randint(0, len(images) - 1)]),
+            (width, height),
         )
 
         if pic.size[0] < width:
@@ -96,3 +176,60 @@ def image(height: int, width: int, image_dir: str, gray_scale: bool) -> Image:
         return cropped_image
     else:
         raise Exception("No images where found in the images folder!")
+
+
+def generate(
+    background_type: int, height: int, width: int, image_dir: str, gray_scale: bool
+) -> Image:
+    """
+    Create a background of a type (0: Gaussian noise, 1: plain white,
+    2: quasicrystal, 3: image), always grayscale (L) with gray_scale
+    """
+
+    if background_type == 0:
+        return gaussian_noise(height, width)
+    elif background_type == 1:
+        return plain_white(height, width, gray_scale)
+    elif background_type == 2:
+        return quasicrystal(height, width, gray_scale)
+    else:
+        return image(height, width, image_dir, gray_scale)
+
+
+def _gray_pixels(background: Image) -> np.ndarray:
+    # Palette indices and the bands of other modes aren't gray levels
+    if background.mode not in ("L", "RGB", "RGBA"):
+        background = background.convert("L" if background.mode == "LA" else "RGB")
+    return np.asarray(background)
+
+
+def mean_gray(background: Image) -> float:
+    """
+    Mean gray level, the mean of the color bands, of background
+    """
+
+    pixels = _gray_pixels(background)
+    if pixels.ndim == 3:
+        pixels = pixels[..., :3]
+    return float(pixels.mean())
+
+
+def gray_range(background: Image, min_size: Tuple[int, int]) -> Tuple[float, float]:
+    """
+    Lowest and highest mean gray level, the mean of the color bands, of the
+    backgrounds of at least min_size (width, height) that can be cut from the
+    top left corner of background
+    """
+
+    pixels = _gray_pixels(background)
+    height, width = pixels.shape[:2]
+    min_width = min(max(min_size[0], 1), width)
+    min_height = min(max(min_size[1], 1), height)
+    # Sums of every top left rectangle, by band
+    sums = cv2.integral(pixels, sdepth=cv2.CV_64F)[min_height:, min_width:]
+    if sums.ndim == 3:
+        sums = sums[..., :3].sum(axis=2) / 3
+    means = sums / np.outer(
+        np.arange(min_height, height + 1), np.arange(min_width, width + 1)
+    )
+    return float(means.min()), float(means.max())
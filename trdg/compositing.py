@@ -0,0 +1,44 @@
+"""
+Text layer composited onto its background with a single copy of the background
+"""
+
+from typing import Tuple
+
+from PIL import Image
+
+# Modes the text is composited in directly, the others are converted to after
+NATIVE_MODES = ("L", "RGB", "RGBA")
+
+
+def composite(
+    background: Image, text: Image, offset: Tuple[int, int], image_mode: str = "RGB"
+) -> Image:
+    """
+    Alpha blend the RGBA text onto background at offset and return the result
+    in image_mode. The background is left as it is: it is copied once,
+    straight into image_mode when that is L, RGB or RGBA, and the text is
+    blended in place into the copy.
+    """
+
+    mode = image_mode if image_mode in NATIVE_MODES else "RGBA"
+    # Backgrounds may share their pixels with a texture bank, they are never
+    # written to
+    if background.mode == mode:
+        image = background.copy()
+    else:
+        image = background.convert(mode)
+    image.paste(text, offset, text)
+    return image if mode == image_mode else image.convert(image_mode)
+
+
+def place_mask(
+    mask: Image, size: Tuple[int, int], offset: Tuple[int, int], mode: str = None
+) -> Image:
+    """
+    Mask of size (width, height) with mask at offset and zeros elsewhere, in
+    mode or the mode of mask
+    """
+
+    full_mask = Image.new(mode or mask.mode, size, 0)
+    full_mask.paste(mask, offset)
+    return full_mask
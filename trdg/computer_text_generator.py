@@ -1,8 +1,11 @@
 import random as rnd
+import numpy as np
 from typing import Tuple
-from PIL import Image, ImageColor, ImageDraw, ImageFilter, ImageFont
+from PIL import Image, ImageDraw, ImageFilter, ImageFont
 
-from trdg.utils import get_text_width, get_text_height
+from trdg.font_cache import get_font
+from trdg.glyph_metrics import get_glyph_metrics
+from trdg.utils import get_text_width, get_text_height, parse_colors
 
 # Thai Unicode reference: https://jrgraphix.net/r/Unicode/0E00-0E7F
 TH_TONE_MARKS = [
@@ -17,6 +20,12 @@ TH_TONE_MARKS = [
 ]
 TH_UNDER_VOWELS = ["0xe38", "0xe39", "\0xe3A"]
 TH_UPPER_VOWELS = ["0xe31", "0xe34", "0xe35", "0xe36", "0xe37"]
+# Characters laid out with no advance, as in _compute_character_width
+TH_ZERO_WIDTH_CHARS = [
+    c
+    for c in map(chr, range(0x0E00, 0x0E80))
+    if "{0:#x}".format(ord(c)) in TH_TONE_MARKS + TH_UNDER_VOWELS + TH_UPPER_VOWELS
+]
 
 
 def generate(
@@ -31,7 +40,13 @@ def generate(
     word_split: bool,
     stroke_width: int = 0,
     stroke_fill: str = "#282828",
+    with_mask: bool = True,
 ) -> Tuple:
+    """
+    Render text, returns the text image and its character mask, None without
+    with_mask
+    """
+
     if orientation == 0:
         return _generate_horizontal_text(
             text,
@@ -44,6 +59,7 @@ def generate(
             word_split,
             stroke_width,
             stroke_fill,
+            with_mask,
         )
     elif orientation == 1:
         return _generate_vertical_text(
@@ -56,6 +72,7 @@ def generate(
             fit,
             stroke_width,
             stroke_fill,
+            with_mask,
         )
     else:
         raise ValueError("Unknown orientation " + str(orientation))
@@ -82,8 +99,9 @@ def _generate_horizontal_text(
     word_split: bool,
     stroke_width: int = 0,
     stroke_fill: str = "#282828",
+    with_mask: bool = True,
 ) -> Tuple:
-    image_font = ImageFont.truetype(font=font, size=font_size)
+    image_font = get_font(font, font_size)
 
     space_width = int(get_text_width(image_font, " ") * space_width)
 
@@ -96,24 +114,35 @@ def _generate_horizontal_text(
     else:
         splitted_text = text
 
-    piece_widths = [
-        _compute_character_width(image_font, p) if p != " " else space_width
-        for p in splitted_text
-    ]
-    text_width = sum(piece_widths)
+    if word_split:
+        piece_widths = np.array([
+            _compute_character_width(image_font, p) if p != " " else space_width
+            for p in splitted_text
+        ])
+        text_height = max([get_text_height(image_font, p) for p in splitted_text])
+    else:
+        # Per-character metrics come from the font's table, only characters
+        # never seen before with this font go through FreeType
+        metrics = get_glyph_metrics(image_font, TH_ZERO_WIDTH_CHARS)
+        piece_widths = metrics.widths(text)
+        piece_widths[metrics.codes(text) == ord(" ")] = space_width
+        text_height = int(metrics.bottoms(text).max())
+
+    text_width = int(piece_widths.sum())
     if not word_split:
         text_width += character_spacing * (len(text) - 1)
-
-    text_height = max([get_text_height(image_font, p) for p in splitted_text])
+    piece_offsets = np.cumsum(piece_widths) - piece_widths
 
     txt_img = Image.new("RGBA", (text_width, text_height), (0, 0, 0, 0))
-    txt_mask = Image.new("RGB", (text_width, text_height), (0, 0, 0))
-
     txt_img_draw = ImageDraw.Draw(txt_img)
-    txt_mask_draw = ImageDraw.Draw(txt_mask, mode="RGB")
-    txt_mask_draw.fontmode = "1"
 
-    colors = [ImageColor.getrgb(c) for c in text_color.split(",")]
+    txt_mask = None
+    if with_mask:
+        txt_mask = Image.new("RGB", (text_width, text_height), (0, 0, 0))
+        txt_mask_draw = ImageDraw.Draw(txt_mask, mode="RGB")
+        txt_mask_draw.fontmode = "1"
+
+    colors = parse_colors(text_color)
     c1, c2 = colors[0], colors[-1]
 
     fill = (
@@ -122,7 +151,7 @@ def _generate_horizontal_text(
         rnd.randint(min(c1[2], c2[2]), max(c1[2], c2[2])),
     )
 
-    stroke_colors = [ImageColor.getrgb(c) for c in stroke_fill.split(",")]
+    stroke_colors = parse_colors(stroke_fill)
     stroke_c1, stroke_c2 = stroke_colors[0], stroke_colors[-1]
 
     stroke_fill = (
@@ -133,26 +162,29 @@ def _generate_horizontal_text(
 
     for i, p in enumerate(splitted_text):
         txt_img_draw.text(
-            (sum(piece_widths[0:i]) + i * character_spacing * int(not word_split), 0),
+            (int(piece_offsets[i]) + i * character_spacing * int(not word_split), 0),
             p,
             fill=fill,
             font=image_font,
             stroke_width=stroke_width,
             stroke_fill=stroke_fill,
         )
-        txt_mask_draw.text(
-            (sum(piece_widths[0:i]) + i * character_spacing * int(not word_split), 0),
-            p,
-            fill=((i + 1) // (255 * 255), (i + 1) // 255, (i + 1) % 255),
-            font=image_font,
-            stroke_width=stroke_width,
-            stroke_fill=stroke_fill,
-        )
+        if with_mask:
+            txt_mask_draw.text(
+                (int(piece_offsets[i]) + i * character_spacing * int(not word_split), 0),
+                p,
+                fill=((i + 1) // (255 * 255), (i + 1) // 255, (i + 1) % 255),
+                font=image_font,
+                stroke_width=stroke_width,
+                stroke_fill=stroke_fill,
+            )
 
     if fit:
-        return txt_img.crop(txt_img.getbbox()), txt_mask.crop(txt_img.getbbox())
-    else:
-        return txt_img, txt_mask
+        crop_box = txt_img.getbbox()
+        txt_img = txt_img.crop(crop_box)
+        if txt_mask is not None:
+            txt_mask = txt_mask.crop(crop_box)
+    return txt_img, txt_mask
 
 
 def _generate_vertical_text(
@@ -165,25 +197,29 @@ def _generate_vertical_text(
     fit: bool,
     stroke_width: int = 0,
     stroke_fill: str = "#282828",
+    with_mask: bool = True,
 ) -> Tuple:
-    image_font = ImageFont.truetype(font=font, size=font_size)
+    image_font = get_font(font, font_size)
 
     space_height = int(get_text_height(image_font, " ") * space_width)
 
-    char_heights = [
-        get_text_height(image_font, c) if c != " " else space_height for c in text
-    ]
-    text_width = max([get_text_width(image_font, c) for c in text])
-    text_height = sum(char_heights) + character_spacing * len(text)
+    metrics = get_glyph_metrics(image_font, TH_ZERO_WIDTH_CHARS)
+    char_heights = metrics.bottoms(text)
+    char_heights[metrics.codes(text) == ord(" ")] = space_height
+    text_width = int(metrics.advances(text).max())
+    text_height = int(char_heights.sum()) + character_spacing * len(text)
+    char_offsets = np.cumsum(char_heights) - char_heights
 
     txt_img = Image.new("RGBA", (text_width, text_height), (0, 0, 0, 0))
-    txt_mask = Image.new("RGBA", (text_width, text_height), (0, 0, 0, 0))
-
     txt_img_draw = ImageDraw.Draw(txt_img)
-    txt_mask_draw = ImageDraw.Draw(txt_mask)
-    txt_mask_draw.fontmode = "1"
 
-    colors = [ImageColor.getrgb(c) for c in text_color.split(",")]
+    txt_mask = None
+    if with_mask:
+        txt_mask = Image.new("RGBA", (text_width, text_height), (0, 0, 0, 0))
+        txt_mask_draw = ImageDraw.Draw(txt_mask)
+        txt_mask_draw.fontmode = "1"
+
+    colors = parse_colors(text_color)
     c1, c2 = colors[0], colors[-1]
 
     fill = (
@@ -192,7 +228,7 @@ def _generate_vertical_text(
         rnd.randint(c1[2], c2[2]),
     )
 
-    stroke_colors = [ImageColor.getrgb(c) for c in stroke_fill.split(",")]
+    stroke_colors = parse_colors(stroke_fill)
     stroke_c1, stroke_c2 = stroke_colors[0], stroke_colors[-1]
 
     stroke_fill = (
@@ -203,23 +239,26 @@ def _generate_vertical_text(
 
     for i, c in enumerate(text):
         txt_img_draw.text(
-            (0, sum(char_heights[0:i]) + i * character_spacing),
+            (0, int(char_offsets[i]) + i * character_spacing),
             c,
             fill=fill,
             font=image_font,
             stroke_width=stroke_width,
             stroke_fill=stroke_fill,
         )
-        txt_mask_draw.text(
-            (0, sum(char_heights[0:i]) + i * character_spacing),
-            c,
-            fill=((i + 1) // (255 * 255), (i + 1) // 255, (i + 1) % 255),
-            font=image_font,
-            stroke_width=stroke_width,
-            stroke_fill=stroke_fill,
-        )
+        if with_mask:
+            txt_mask_draw.text(
+                (0, int(char_offsets[i]) + i * character_spacing),
+                c,
+                fill=((i + 1) // (255 * 255), (i + 1) // 255, (i + 1) % 255),
+                font=image_font,
+                stroke_width=stroke_width,
+                stroke_fill=stroke_fill,
+            )
 
     if fit:
-        return txt_img.crop(txt_img.getbbox()), txt_mask.crop(txt_img.getbbox())
-    else:
-        return txt_img, txt_mask
+        crop_box = txt_img.getbbox()
+        txt_img = txt_img.crop(crop_box)
+        if txt_mask is not None:
+            txt_mask = txt_mask.crop(crop_box)
+    return txt_img, txt_mask
@@ -1,10 +1,23 @@
+import math
 import random as rnd
-import os
-from typing import Tuple
-from PIL import Image, ImageColor, ImageDraw, ImageFilter, ImageFont
+import numpy as np
+import unicodedata
+import warnings
+from typing import List, Tuple
+from PIL import Image, ImageDraw, ImageFilter, ImageFont
 from PIL.ImageColor import getrgb
 
-from trdg.utils import get_text_width, get_text_height
+from trdg.font_cache import get_font
+from trdg.glyph_atlas import draw_text_and_label, get_glyph_atlas
+from trdg.glyph_metrics import get_glyph_metrics
+from trdg.font_registry import get_font_registry
+from trdg.utils import (
+    get_text_width,
+    get_text_height,
+    parse_colors,
+    to_label_mask,
+    translate_extents,
+)
 
 # Thai Unicode reference: https://jrgraphix.net/r/Unicode/0E00-0E7F
 TH_TONE_MARKS = [
@@ -19,42 +32,49 @@ TH_TONE_MARKS = [
 ]
 TH_UNDER_VOWELS = ["0xe38", "0xe39", "\0xe3A"]
 TH_UPPER_VOWELS = ["0xe31", "0xe34", "0xe35", "0xe36", "0xe37"]
+# Characters laid out with no advance, as in _compute_character_width
+TH_ZERO_WIDTH_CHARS = [
+    c
+    for c in map(chr, range(0x0E00, 0x0E80))
+    if "{0:#x}".format(ord(c)) in TH_TONE_MARKS + TH_UNDER_VOWELS + TH_UPPER_VOWELS
+]
+# draw: ImageDraw.text per character, atlas: cached glyph bitmaps,
+# single_pass: one raster per piece for both the image and the mask,
+# raqm: the whole line shaped and drawn at once (horizontal text only)
+RENDERING_ENGINES = ("draw", "atlas", "single_pass", "raqm")
+# Characters that are part of the cluster of the character before them
+CLUSTER_JOINERS = {"\u200c", "\u200d"}
+# Viramas join the next consonant into the same cluster (Devanagari, Bengali, ...)
+VIRAMAS = {"\u094d", "\u09cd", "\u0a4d", "\u0acd", "\u0b4d", "\u0bcd", "\u0c4d", "\u0ccd", "\u0d4d"}
 GRAYSCALE_COLORS = [
     "#000000", "#141414", "#282828", "#3C3C3C", "#505050", "#646464", 
     "#787878", "#8C8C8C", "#A0A0A0", "#B4B4B4", "#C8C8C8", "#DCDCDC", 
     "#F0F0F0", "#FFFFFF"
 ]
-def _get_valid_font_from_directory(font_directory: str, text: str, min_font_size: int, max_font_size: int) -> ImageFont:
-    # List all font files in the directory
-    font_files = [f for f in os.listdir(font_directory) if f.endswith(".ttf")]
-    
-    # Try random fonts until one can display the text
-    # while True:
-        # Randomly choose a font file from the directory
-    font_file = rnd.choice(font_files)
-    font_path = os.path.join(font_directory, font_file)
+# Lengths of characters in lines of text, relative to the height of the line,
+# larger than they are in most fonts: East Asian wide characters, the others
+# in horizontal text and the others in vertical text, stacked one per line
+WIDE_CHARACTER_LENGTH = 1.2
+CHARACTER_LENGTH = 0.8
+STACKED_CHARACTER_LENGTH = 2.0
+# Smallest difference between the mean gray levels of the text and of its
+# background for the text to be kept
+MIN_CONTRAST = 15
+# Gray levels resampling the text can move its mean by, Lanczos overshoots
+# at the edges of the glyphs
+RESAMPLING_MARGIN = 8
+def _get_valid_font_from_directory(font_directory: str, text: str, min_font_size: int, max_font_size: int, layout_engine: ImageFont.Layout = None) -> ImageFont:
+    # The directory is only scanned the first time it is used in this process
+    registry = get_font_registry(font_directory)
+
+    # Only pick among the fonts that have a glyph for every character, falling
+    # back to all of them when none does so that we still produce a sample
+    font_files = registry.fonts_for_text(text) or registry.fonts
+
+    font_path = rnd.choice(font_files)
     font_size = rnd.randint(min_font_size, max_font_size)
-    print(font_size)
-    image_font = ImageFont.truetype(font_path, 20)
+    image_font = get_font(font_path, font_size, layout_engine)
     return image_font, font_size
-    # # Randomly select a font size between min_font_size and max_font_size
-    # text_width, text_height = image_font.getsize(text)
-    # if text_width > 0 and text_height > 0:
-    #     return image_font, font_size  # Return the valid font
-    # try:
-        #     # Load the font with the random size
-        #     image_font = ImageFont.truetype(font_path, font_size)
-            
-        #     # Create a dummy image to check if the font can render the text
-        #     img = Image.new("RGB", (100, 100))
-        #     draw = ImageDraw.Draw(img)
-        #     text_width, text_height = draw.textsize(text, font=image_font)
-            
-        #     # Check if the font can render the text without errors
-        #     if text_width > 0 and text_height > 0:
-        #         return image_font, font_size  # Return the valid font
-        # except Exception:
-        #     pass  # If the font cannot render the text, try another font
 
 def generate(
     text: str,
@@ -71,8 +91,57 @@ def generate(
     word_split: bool,
     stroke_width: int = 0,
     stroke_fill: str = "#282828",
+    rendering_engine: str = "draw",
+    return_bboxes: bool = False,
+    with_mask: bool = True,
+    background_gray: Tuple[float, float] = None,
+    single_channel: bool = False,
 ) -> Tuple:
-    if orientation == 0:
+    """
+    Render text, returns the text image, its mask of character labels (a 16
+    bits image where character i is i + 1, None without with_mask) and the
+    font size. With return_bboxes, the pixel extents of every piece computed
+    from the layout come fourth, None when the layout can't tell them.
+    background_gray is the range of mean gray levels of the background the
+    text will be put on, its colors are then picked to stand out from it.
+    The text image is LA with gray_scale or single_channel, RGBA otherwise,
+    single_channel keeps the text colors and draws their gray levels.
+    """
+
+    if rendering_engine not in RENDERING_ENGINES:
+        raise ValueError("Unknown rendering engine " + str(rendering_engine))
+
+    if orientation == 0 and rendering_engine == "raqm":
+        ignored = [
+            name
+            for name, value, default in (
+                ("random_spacing", random_spacing, False),
+                ("space_width", space_width, 1.0),
+                ("character_spacing", character_spacing, 0),
+                ("word_split", word_split, False),
+            )
+            if value != default
+        ]
+        if ignored:
+            warnings.warn(
+                "The raqm engine shapes the whole line, it ignores "
+                + ", ".join(ignored)
+            )
+        return _generate_shaped_text(
+            text,
+            fonts,
+            gray_scale,
+            min_font_size,
+            max_font_size,
+            fit,
+            stroke_width,
+            stroke_fill,
+            return_bboxes,
+            with_mask,
+            background_gray,
+            single_channel,
+        )
+    elif orientation == 0:
         return _generate_horizontal_text(
             text,
             fonts,
@@ -87,6 +156,11 @@ def generate(
             word_split,
             stroke_width,
             stroke_fill,
+            rendering_engine,
+            return_bboxes,
+            with_mask,
+            background_gray,
+            single_channel,
         )
     elif orientation == 1:
         return _generate_vertical_text(
@@ -102,11 +176,33 @@ def generate(
             fit,
             stroke_width,
             stroke_fill,
+            rendering_engine,
+            return_bboxes,
+            with_mask,
+            background_gray,
+            single_channel,
         )
     else:
         raise ValueError("Unknown orientation " + str(orientation))
 
 
+def expected_length(text: str, height: int, orientation: int = 0) -> int:
+    """
+    Length of text rendered and resized to a line of height pixels (its width
+    when it is vertical), more than it takes with most fonts
+    """
+
+    length = 0.0
+    for c in text:
+        if unicodedata.east_asian_width(c) in ("W", "F"):
+            length += WIDE_CHARACTER_LENGTH
+        elif orientation == 1:
+            length += STACKED_CHARACTER_LENGTH
+        else:
+            length += CHARACTER_LENGTH
+    return int(math.ceil(length * height))
+
+
 def _compute_character_width(image_font: ImageFont, character: str) -> int:
     if len(character) == 1 and (
         "{0:#x}".format(ord(character))
@@ -117,80 +213,113 @@ def _compute_character_width(image_font: ImageFont, character: str) -> int:
     return round(image_font.getlength(character))
 
 
-def _generate_horizontal_text(
-    text: str,
-    fonts: str,
-    gray_scale: bool,
-    min_font_size: int,
-    max_font_size: int,
-    random_spacing: bool,
-    max_random_spacing: int,
-    space_width: int,
-    character_spacing: int,
-    fit: bool,
-    word_split: bool,
-    stroke_width: int = 0,
-    stroke_fill: str = "#282828",
-) -> Tuple:
-    image_font, font_size = _get_valid_font_from_directory(fonts, text, min_font_size, max_font_size)
+def _gray_level(color: Tuple) -> float:
+    return sum(color[:3]) / 3
 
-    space_width = int(get_text_width(image_font, " ") * space_width)
 
-    if word_split:
-        splitted_text = []
-        for w in text.split(" "):
-            splitted_text.append(w)
-            splitted_text.append(" ")
-        splitted_text.pop()
-    else:
-        splitted_text = text
+def _text_image(size: Tuple[int, int], gray_scale: bool) -> Image:
+    """
+    Transparent image the text is drawn on, LA for grayscale text
+    """
+
+    return Image.new("LA" if gray_scale else "RGBA", size, 0)
+
+
+def _draw_color(color: Tuple, image: Image) -> Tuple:
+    # ImageDraw only takes gray levels for LA images, grayscale text colors
+    # have equal channels
+    if image.mode == "LA":
+        return (round(_gray_level(color)), 255)
+    return color
+
+
+def _gray_color(color: Tuple) -> Tuple:
+    """
+    Gray of the level the text colors are picked by, for single channel text
+    """
+
+    level = round(_gray_level(color))
+    return (level, level, level)
+
+
+def _contrast_limits(background_gray: Tuple[float, float]) -> Tuple[float, float]:
+    """
+    Brightest gray level darker than the background and darkest one brighter
+    than it by MIN_CONTRAST, keeping away from the threshold what the
+    resampling of the text may move it
+    """
+
+    low, high = background_gray
+    margin = MIN_CONTRAST + RESAMPLING_MARGIN
+    return low - margin, high + margin
 
-    piece_widths = [
-        _compute_character_width(image_font, p) + 
-        (rnd.randint(0, max_random_spacing) if random_spacing and p != " " else 0)
-        if p != " " else space_width
-        for p in splitted_text
-    ]
-    text_width = sum(piece_widths)
-    if not word_split:
-        text_width += character_spacing * (len(text) - 1)
 
-    text_height = max([get_text_height(image_font, p) for p in splitted_text])
+def _contrast_side(color: Tuple, limits: Tuple[float, float]) -> int:
+    """
+    -1 when color is dark enough, 1 when it is bright enough, 0 otherwise
+    """
 
-    txt_img = Image.new("RGBA", (text_width, text_height), (0, 0, 0, 0))
-    txt_mask = Image.new("RGB", (text_width, text_height), (0, 0, 0))
+    level = _gray_level(color)
+    if level <= limits[0]:
+        return -1
+    if level >= limits[1]:
+        return 1
+    return 0
 
-    txt_img_draw = ImageDraw.Draw(txt_img)
-    txt_mask_draw = ImageDraw.Draw(txt_mask, mode="RGB")
-    txt_mask_draw.fontmode = "1"
 
-    # colors = [ImageColor.getrgb(c) for c in text_color.split(",")]
-    # c1, c2 = colors[0], colors[-1]
+def _towards_side(color: Tuple, limits: Tuple[float, float], side: int) -> Tuple:
+    """
+    Color darkened (side -1) or lightened (side 1) just enough to stand out,
+    keeping the ratios of its channels to black or white
+    """
 
+    if _contrast_side(color, limits) == side:
+        return color
+    level = _gray_level(color)
+    if side < 0:
+        return tuple(int(c * limits[0] / level) for c in color[:3])
+    return tuple(
+        255 - int((255 - c) * (255 - limits[1]) / (255 - level)) for c in color[:3]
+    )
 
-    # fill = (
-    #     rnd.randint(min(c1[0], c2[0]), max(c1[0], c2[0])),
-    #     rnd.randint(min(c1[1], c2[1]), max(c1[1], c2[1])),
-    #     rnd.randint(min(c1[2], c2[2]), max(c1[2], c2[2])),
-    # )
-    # stroke_colors = [ImageColor.getrgb(c) for c in stroke_fill.split(",")]
-    #     stroke_c1, stroke_c2 = stroke_colors[0], stroke_colors[-1]
 
-    #     stroke_fill = (
-    #         rnd.randint(min(stroke_c1[0], stroke_c2[0]), max(stroke_c1[0], stroke_c2[0])),
-    #         rnd.randint(min(stroke_c1[1], stroke_c2[1]), max(stroke_c1[1], stroke_c2[1])),
-    #         rnd.randint(min(stroke_c1[2], stroke_c2[2]), max(stroke_c1[2], stroke_c2[2])),
-    #     )
+def _pick_colors(
+    gray_scale: bool,
+    stroke_width: int,
+    stroke_fill: str,
+    max_gray_stroke_width: int,
+    background_gray: Tuple[float, float] = None,
+) -> Tuple:
+    """
+    Pick the text fill and stroke colors, grayscale text always gets a stroke.
+    With background_gray, the range of mean gray levels of the background,
+    both colors are on the same side of it by at least MIN_CONTRAST whenever
+    the range leaves room for it.
+    """
+
+    limits = None
+    if background_gray is not None:
+        limits = _contrast_limits(background_gray)
+        sides = [side for side, room in ((-1, limits[0] >= 0), (1, limits[1] <= 255)) if room]
+        if not sides:
+            limits = None
+
+    if gray_scale and limits is not None:
+        colors = [getrgb(c) for c in GRAYSCALE_COLORS]
+        fill = rnd.choice([c for c in colors if _contrast_side(c, limits) != 0])
+        side = _contrast_side(fill, limits)
+        stroke_width = rnd.randint(1, max_gray_stroke_width)
+        stroke_fill = rnd.choice([c for c in colors if _contrast_side(c, limits) == side])
+        return fill, stroke_width, stroke_fill
 
     if gray_scale:
         grayscale_color = rnd.choice(GRAYSCALE_COLORS)
         fill = getrgb(grayscale_color)
     else:
         text_color = "#000000,#FFFFFF"
-        colors = [ImageColor.getrgb(c) for c in text_color.split(",")]
+        colors = parse_colors(text_color)
         c1, c2 = colors[0], colors[-1]
 
-
         fill = (
             rnd.randint(min(c1[0], c2[0]), max(c1[0], c2[0])),
             rnd.randint(min(c1[1], c2[1]), max(c1[1], c2[1])),
@@ -198,10 +327,10 @@ def _generate_horizontal_text(
         )
     if gray_scale:
         grayscale_color = rnd.choice(GRAYSCALE_COLORS)
-        stroke_width = rnd.randint(1, 2)
+        stroke_width = rnd.randint(1, max_gray_stroke_width)
         stroke_fill = getrgb(grayscale_color)
     else:
-        stroke_colors = [ImageColor.getrgb(c) for c in stroke_fill.split(",")]
+        stroke_colors = parse_colors(stroke_fill)
         stroke_c1, stroke_c2 = stroke_colors[0], stroke_colors[-1]
 
         stroke_fill = (
@@ -210,127 +339,523 @@ def _generate_horizontal_text(
             rnd.randint(min(stroke_c1[2], stroke_c2[2]), max(stroke_c1[2], stroke_c2[2])),
         )
 
-    for i, p in enumerate(splitted_text):
-        txt_img_draw.text(
-            (sum(piece_widths[0:i]) + i * character_spacing * int(not word_split), 0),
-            p,
-            fill=fill,
-            font=image_font,
-            stroke_width=stroke_width,
-            stroke_fill=stroke_fill,
+    if limits is not None:
+        # A stroke that already stands out decides the side, otherwise the
+        # fill does, or the nearest side with room when neither does
+        side = _contrast_side(stroke_fill, limits) if stroke_width > 0 else 0
+        if side == 0:
+            side = _contrast_side(fill, limits)
+        if side == 0 or side not in sides:
+            level = _gray_level(fill)
+            side = min(sides, key=lambda s: abs(level - limits[(s + 1) // 2]))
+        fill = _towards_side(fill, limits, side)
+        if stroke_width > 0:
+            stroke_fill = _towards_side(stroke_fill, limits, side)
+
+    return fill, stroke_width, stroke_fill
+
+
+def _split_clusters(text: str) -> List[int]:
+    """
+    Start index of every grapheme cluster of text: a base character with the
+    combining marks that follow it, and consonants joined by a virama
+    """
+
+    starts = []
+    for i, c in enumerate(text):
+        if (
+            i > 0
+            and (
+                unicodedata.category(c).startswith("M")
+                or c in CLUSTER_JOINERS
+                or text[i - 1] in VIRAMAS
+                or text[i - 1] in CLUSTER_JOINERS
+            )
+        ):
+            continue
+        starts.append(i)
+    return starts
+
+
+def split_clusters(text: str) -> List[str]:
+    """
+    Grapheme clusters of text, the pieces the raqm engine labels in its mask
+    """
+
+    starts = _split_clusters(text)
+    return [text[start:end] for start, end in zip(starts, starts[1:] + [len(text)])]
+
+
+def _cluster_offsets(
+    image_font: ImageFont, text: str, starts: List[int], direction: str = None
+) -> np.ndarray:
+    """
+    Horizontal offset of every cluster of a shaped line. Pillow doesn't give
+    the glyph positions of the layout, so every cluster is measured once on
+    its own and the widths are accumulated, then scaled to the length of the
+    whole line. Kerning and contextual forms across cluster boundaries are
+    spread over the line rather than placed exactly.
+    """
+
+    ends = starts[1:] + [len(text)]
+    widths = np.array(
+        [
+            image_font.getlength(text[start:end], direction=direction)
+            for start, end in zip(starts, ends)
+        ],
+        dtype=np.float64,
+    )
+    offsets = np.cumsum(widths) - widths
+    total = widths.sum()
+    if total > 0:
+        offsets *= image_font.getlength(text, direction=direction) / total
+    return np.round(offsets).astype(np.int64)
+
+
+def _ink_extents(
+    image_font: ImageFont,
+    pieces: List[str],
+    positions: List[Tuple[int, int]],
+    stroke_width: int,
+    size: Tuple[int, int],
+    rendering_engine: str = "draw",
+) -> List:
+    """
+    Inclusive pixel extents (min x, min y, max x, max y) of the ink of every
+    piece drawn at its position, None for the pieces without any, like spaces.
+    The ink is that of the rasterized glyphs, their outline boxes are larger,
+    in the font mode the mask of the engine is drawn in. Only the single pass
+    mask labels the stroke, the others draw it with label 0.
+    """
+
+    fontmode = "L" if rendering_engine == "single_pass" else "1"
+    if rendering_engine != "single_pass":
+        stroke_width = 0
+    atlas = get_glyph_atlas(image_font)
+    width, height = size
+    extents = []
+    for piece, (x, y) in zip(pieces, positions):
+        box = atlas.ink_box(piece, stroke_width, fontmode)
+        if box is None:
+            extents.append(None)
+            continue
+        left, top, right, bottom = box
+        x0 = max(x + left, 0)
+        y0 = max(y + top, 0)
+        x1 = min(x + right - 1, width - 1)
+        y1 = min(y + bottom - 1, height - 1)
+        extents.append(
+            (int(x0), int(y0), int(x1), int(y1)) if x0 <= x1 and y0 <= y1 else None
         )
-        txt_mask_draw.text(
-            (sum(piece_widths[0:i]) + i * character_spacing * int(not word_split), 0),
+    return extents
+
+
+def _finish(
+    txt_img: Image,
+    txt_mask: Image,
+    font_size: int,
+    fit: bool,
+    bboxes: List,
+    return_bboxes: bool,
+) -> Tuple:
+    if fit:
+        crop_box = txt_img.getbbox()
+        txt_img = txt_img.crop(crop_box)
+        if txt_mask is not None:
+            txt_mask = txt_mask.crop(crop_box)
+        if bboxes is not None and crop_box is not None:
+            bboxes = translate_extents(
+                bboxes, (-crop_box[0], -crop_box[1]), txt_img.size
+            )
+    if return_bboxes:
+        return txt_img, txt_mask, font_size, bboxes
+    return txt_img, txt_mask, font_size
+
+
+def _generate_shaped_text(
+    text: str,
+    fonts: str,
+    gray_scale: bool,
+    min_font_size: int,
+    max_font_size: int,
+    fit: bool,
+    stroke_width: int = 0,
+    stroke_fill: str = "#282828",
+    return_bboxes: bool = False,
+    with_mask: bool = True,
+    background_gray: Tuple[float, float] = None,
+    single_channel: bool = False,
+) -> Tuple:
+    """
+    Shape and draw the whole line in one call so that ligatures and complex
+    scripts render correctly. Character and random spacing don't apply since
+    the line isn't split. The mask labels grapheme clusters instead of
+    characters, using the horizontal offsets of the clusters in the line.
+    """
+
+    image_font, font_size = _get_valid_font_from_directory(
+        fonts, text, min_font_size, max_font_size, ImageFont.Layout.RAQM
+    )
+    # Text reaching us is already in visual order, RTL strings are reordered
+    # with python-bidi, so it must not be reordered a second time
+    direction = "ltr" if image_font.layout_engine == ImageFont.Layout.RAQM else None
+
+    text_width = round(image_font.getlength(text, direction=direction))
+    text_height = image_font.getbbox(text, direction=direction)[3]
+
+    fill, stroke_width, stroke_fill = _pick_colors(
+        gray_scale,
+        stroke_width,
+        stroke_fill,
+        max_gray_stroke_width=2,
+        background_gray=background_gray,
+    )
+    if single_channel and not gray_scale:
+        fill, stroke_fill = _gray_color(fill), _gray_color(stroke_fill)
+
+    txt_img = _text_image((text_width, text_height), gray_scale or single_channel)
+    ImageDraw.Draw(txt_img).text(
+        (0, 0),
+        text,
+        fill=_draw_color(fill, txt_img),
+        font=image_font,
+        direction=direction,
+        stroke_width=stroke_width,
+        stroke_fill=_draw_color(stroke_fill, txt_img),
+    )
+
+    txt_mask = None
+    if with_mask:
+        cluster_offsets = _cluster_offsets(
+            image_font, text, _split_clusters(text), direction
+        )
+        # Each column belongs to the cluster whose offset is the closest on its left
+        labels = np.searchsorted(cluster_offsets, np.arange(text_width), side="right")
+        mask_arr = np.zeros((text_height, text_width), dtype=np.uint16)
+        covered = np.array(txt_img)[..., -1] > 0
+        mask_arr[covered] = np.broadcast_to(labels, mask_arr.shape)[covered]
+        txt_mask = Image.fromarray(mask_arr)
+
+    # Glyphs of a shaped line don't map to characters, boxes come from the mask
+    return _finish(txt_img, txt_mask, font_size, fit, None, return_bboxes)
+
+
+def _draw_text_from_atlas(
+    image_font: ImageFont,
+    text: str,
+    positions: List[Tuple[int, int]],
+    txt_img: Image,
+    fill: Tuple,
+    stroke_width: int,
+    stroke_fill: Tuple,
+    with_mask: bool = True,
+) -> Tuple:
+    """
+    Same as drawing every character with ImageDraw.text, but from glyph
+    bitmaps rasterized only once per font
+    """
+
+    atlas = get_glyph_atlas(image_font)
+    img_arr = np.array(txt_img)
+    mask_arr = np.zeros(img_arr.shape[:2], dtype=np.uint16) if with_mask else None
+
+    for i, (c, xy) in enumerate(zip(text, positions)):
+        atlas.draw(img_arr, xy, c, fill, stroke_width, stroke_fill)
+        if with_mask:
+            # The stroke clears the labels it covers, as it does in a color mask
+            atlas.draw(mask_arr, xy, c, i + 1, stroke_width, 0, fontmode="1")
+
+    return (
+        Image.fromarray(img_arr),
+        Image.fromarray(mask_arr) if with_mask else None,
+    )
+
+
+def _draw_text_single_pass(
+    image_font: ImageFont,
+    pieces: List[str],
+    positions: List[Tuple[int, int]],
+    txt_img: Image,
+    fill: Tuple,
+    stroke_width: int,
+    stroke_fill: Tuple,
+    with_mask: bool = True,
+) -> Tuple:
+    """
+    Rasterize each piece once and write both the text image and its character
+    label mask from that raster. The mask follows the anti-aliased coverage of
+    the image, stroke included, instead of a separate bilevel rendering.
+    """
+
+    img_arr = np.array(txt_img)
+    mask_arr = np.zeros(img_arr.shape[:2], dtype=np.uint16) if with_mask else None
+
+    for i, (p, xy) in enumerate(zip(pieces, positions)):
+        draw_text_and_label(
+            img_arr,
+            mask_arr,
+            xy,
             p,
-            fill=((i + 1) // (255 * 255), (i + 1) // 255, (i + 1) % 255),
-            font=image_font,
-            stroke_width=stroke_width,
-            stroke_fill=stroke_fill,
+            image_font,
+            fill,
+            i + 1,
+            stroke_width,
+            stroke_fill,
         )
 
-    if fit:
-        return txt_img.crop(txt_img.getbbox()), txt_mask.crop(txt_img.getbbox()), font_size
-    else:
-        return txt_img, txt_mask, font_size
+    return (
+        Image.fromarray(img_arr),
+        Image.fromarray(mask_arr) if with_mask else None,
+    )
 
 
-def _generate_vertical_text(
+def _generate_horizontal_text(
     text: str,
     fonts: str,
     gray_scale: bool,
     min_font_size: int,
     max_font_size: int,
     random_spacing: bool,
-    max_random_spacing: bool,
+    max_random_spacing: int,
     space_width: int,
     character_spacing: int,
     fit: bool,
+    word_split: bool,
     stroke_width: int = 0,
     stroke_fill: str = "#282828",
+    rendering_engine: str = "draw",
+    return_bboxes: bool = False,
+    with_mask: bool = True,
+    background_gray: Tuple[float, float] = None,
+    single_channel: bool = False,
 ) -> Tuple:
     image_font, font_size = _get_valid_font_from_directory(fonts, text, min_font_size, max_font_size)
 
-    space_height = int(get_text_height(image_font, " ") * space_width)
-
-    char_heights = [
-        get_text_height(image_font, c) + (rnd.randint(0, max_random_spacing) if random_spacing and c != " " else 0)
-        if c != " " else space_height
-        for c in text
-    ]
-    text_width = max([get_text_width(image_font, c) for c in text])
-    text_height = sum(char_heights) + character_spacing * len(text)
-
-    txt_img = Image.new("RGBA", (text_width, text_height), (0, 0, 0, 0))
-    txt_mask = Image.new("RGBA", (text_width, text_height), (0, 0, 0, 0))
-
-    txt_img_draw = ImageDraw.Draw(txt_img)
-    txt_mask_draw = ImageDraw.Draw(txt_mask)
-    txt_mask_draw.fontmode = "1"
+    space_width = int(get_text_width(image_font, " ") * space_width)
 
-    # colors = [ImageColor.getrgb(c) for c in text_color.split(",")]
-    # c1, c2 = colors[0], colors[-1]
+    if word_split:
+        splitted_text = []
+        for w in text.split(" "):
+            splitted_text.append(w)
+            splitted_text.append(" ")
+        splitted_text.pop()
+    else:
+        splitted_text = text
 
-    # fill = (
-    #     rnd.randint(c1[0], c2[0]),
-    #     rnd.randint(c1[1], c2[1]),
-    #     rnd.randint(c1[2], c2[2]),
-    # )
-    if gray_scale:
-        grayscale_color = rnd.choice(GRAYSCALE_COLORS)
-        fill = getrgb(grayscale_color)
+    if word_split:
+        piece_widths = np.array([
+            _compute_character_width(image_font, p) + 
+            (rnd.randint(0, max_random_spacing) if random_spacing and p != " " else 0)
+            if p != " " else space_width
+            for p in splitted_text
+        ])
+        text_height = max([get_text_height(image_font, p) for p in splitted_text])
     else:
-        text_color = "#000000,#FFFFFF"
-        colors = [ImageColor.getrgb(c) for c in text_color.split(",")]
-        c1, c2 = colors[0], colors[-1]
+        # Per-character metrics come from the font's table, only characters
+        # never seen before with this font go through FreeType
+        metrics = get_glyph_metrics(image_font, TH_ZERO_WIDTH_CHARS)
+        is_space = metrics.codes(text) == ord(" ")
+        piece_widths = metrics.widths(text)
+        if random_spacing:
+            piece_widths += [
+                rnd.randint(0, max_random_spacing) if p != " " else 0 for p in text
+            ]
+        piece_widths[is_space] = space_width
+        text_height = int(metrics.bottoms(text).max())
+
+    text_width = int(piece_widths.sum())
+    if not word_split:
+        text_width += character_spacing * (len(text) - 1)
+    piece_offsets = np.cumsum(piece_widths) - piece_widths
+
+    txt_img = _text_image((text_width, text_height), gray_scale or single_channel)
+
+    fill, stroke_width, stroke_fill = _pick_colors(
+        gray_scale,
+        stroke_width,
+        stroke_fill,
+        max_gray_stroke_width=2,
+        background_gray=background_gray,
+    )
+    if single_channel and not gray_scale:
+        fill, stroke_fill = _gray_color(fill), _gray_color(stroke_fill)
+
+    positions = [
+        (int(piece_offsets[i]) + i * character_spacing * int(not word_split), 0)
+        for i in range(len(splitted_text))
+    ]
 
-        fill = (
-            rnd.randint(c1[0], c2[0]),
-            rnd.randint(c1[1], c2[1]),
-            rnd.randint(c1[2], c2[2]),
+    # Glyph bitmaps can only be reused when every piece is a single character
+    if rendering_engine == "atlas" and not word_split:
+        txt_img, txt_mask = _draw_text_from_atlas(
+            image_font,
+            text,
+            positions,
+            txt_img,
+            fill,
+            stroke_width,
+            stroke_fill,
+            with_mask,
+        )
+    elif rendering_engine == "single_pass":
+        txt_img, txt_mask = _draw_text_single_pass(
+            image_font,
+            splitted_text,
+            positions,
+            txt_img,
+            fill,
+            stroke_width,
+            stroke_fill,
+            with_mask,
+        )
+    else:
+        txt_img_draw = ImageDraw.Draw(txt_img)
+        for i, p in enumerate(splitted_text):
+            txt_img_draw.text(
+                positions[i],
+                p,
+                fill=_draw_color(fill, txt_img),
+                font=image_font,
+                stroke_width=stroke_width,
+                stroke_fill=_draw_color(stroke_fill, txt_img),
+            )
+
+        txt_mask = None
+        if with_mask:
+            # The mask is drawn in colors then decoded to labels
+            txt_mask = Image.new("RGB", (text_width, text_height), (0, 0, 0))
+            txt_mask_draw = ImageDraw.Draw(txt_mask, mode="RGB")
+            txt_mask_draw.fontmode = "1"
+            for i, p in enumerate(splitted_text):
+                txt_mask_draw.text(
+                    positions[i],
+                    p,
+                    fill=((i + 1) // (255 * 255), (i + 1) // 255, (i + 1) % 255),
+                    font=image_font,
+                    stroke_width=stroke_width,
+                    stroke_fill=(0, 0, 0),
+                )
+            txt_mask = to_label_mask(txt_mask)
+
+    bboxes = None
+    if return_bboxes:
+        bboxes = _ink_extents(
+            image_font,
+            splitted_text,
+            positions,
+            stroke_width,
+            txt_img.size,
+            rendering_engine,
         )
 
+    return _finish(txt_img, txt_mask, font_size, fit, bboxes, return_bboxes)
 
-    # stroke_colors = [ImageColor.getrgb(c) for c in stroke_fill.split(",")]
-    # stroke_c1, stroke_c2 = stroke_colors[0], stroke_colors[-1]
 
-    # stroke_fill = (
-    #     rnd.randint(stroke_c1[0], stroke_c2[0]),
-    #     rnd.randint(stroke_c1[1], stroke_c2[1]),
-    #     rnd.randint(stroke_c1[2], stroke_c2[2]),
-    # )
-    if gray_scale:
-        grayscale_color = rnd.choice(GRAYSCALE_COLORS)
-        stroke_width = rnd.randint(1, 3)
-        stroke_fill = getrgb(grayscale_color)
-    else:
-        stroke_colors = [ImageColor.getrgb(c) for c in stroke_fill.split(",")]
-        stroke_c1, stroke_c2 = stroke_colors[0], stroke_colors[-1]
+def _generate_vertical_text(
+    text: str,
+    fonts: str,
+    gray_scale: bool,
+    min_font_size: int,
+    max_font_size: int,
+    random_spacing: bool,
+    max_random_spacing: bool,
+    space_width: int,
+    character_spacing: int,
+    fit: bool,
+    stroke_width: int = 0,
+    stroke_fill: str = "#282828",
+    rendering_engine: str = "draw",
+    return_bboxes: bool = False,
+    with_mask: bool = True,
+    background_gray: Tuple[float, float] = None,
+    single_channel: bool = False,
+) -> Tuple:
+    image_font, font_size = _get_valid_font_from_directory(fonts, text, min_font_size, max_font_size)
 
-        stroke_fill = (
-            rnd.randint(min(stroke_c1[0], stroke_c2[0]), max(stroke_c1[0], stroke_c2[0])),
-            rnd.randint(min(stroke_c1[1], stroke_c2[1]), max(stroke_c1[1], stroke_c2[1])),
-            rnd.randint(min(stroke_c1[2], stroke_c2[2]), max(stroke_c1[2], stroke_c2[2])),
-        )
+    space_height = int(get_text_height(image_font, " ") * space_width)
 
-    for i, c in enumerate(text):
-        txt_img_draw.text(
-            (0, sum(char_heights[0:i]) + i * character_spacing),
-            c,
-            fill=fill,
-            font=image_font,
-            stroke_width=stroke_width,
-            stroke_fill=stroke_fill,
+    metrics = get_glyph_metrics(image_font, TH_ZERO_WIDTH_CHARS)
+    char_heights = metrics.bottoms(text)
+    if random_spacing:
+        char_heights += [
+            rnd.randint(0, max_random_spacing) if c != " " else 0 for c in text
+        ]
+    char_heights[metrics.codes(text) == ord(" ")] = space_height
+    text_width = int(metrics.advances(text).max())
+    text_height = int(char_heights.sum()) + character_spacing * len(text)
+    char_offsets = np.cumsum(char_heights) - char_heights
+
+    txt_img = _text_image((text_width, text_height), gray_scale or single_channel)
+
+    fill, stroke_width, stroke_fill = _pick_colors(
+        gray_scale,
+        stroke_width,
+        stroke_fill,
+        max_gray_stroke_width=3,
+        background_gray=background_gray,
+    )
+    if single_channel and not gray_scale:
+        fill, stroke_fill = _gray_color(fill), _gray_color(stroke_fill)
+
+    positions = [
+        (0, int(char_offsets[i]) + i * character_spacing) for i in range(len(text))
+    ]
+
+    if rendering_engine == "atlas":
+        txt_img, txt_mask = _draw_text_from_atlas(
+            image_font,
+            text,
+            positions,
+            txt_img,
+            fill,
+            stroke_width,
+            stroke_fill,
+            with_mask,
         )
-        txt_mask_draw.text(
-            (0, sum(char_heights[0:i]) + i * character_spacing),
-            c,
-            fill=((i + 1) // (255 * 255), (i + 1) // 255, (i + 1) % 255),
-            font=image_font,
-            stroke_width=stroke_width,
-            stroke_fill=stroke_fill,
+    elif rendering_engine == "single_pass":
+        txt_img, txt_mask = _draw_text_single_pass(
+            image_font,
+            text,
+            positions,
+            txt_img,
+            fill,
+            stroke_width,
+            stroke_fill,
+            with_mask,
         )
-
-    if fit:
-        return txt_img.crop(txt_img.getbbox()), txt_mask.crop(txt_img.getbbox()), font_size
     else:
-        return txt_img, txt_mask, font_size
+        txt_img_draw = ImageDraw.Draw(txt_img)
+        for i, c in enumerate(text):
+            txt_img_draw.text(
+                positions[i],
+                c,
+                fill=_draw_color(fill, txt_img),
+                font=image_font,
+                stroke_width=stroke_width,
+                stroke_fill=_draw_color(stroke_fill, txt_img),
+            )
+
+        txt_mask = None
+        if with_mask:
+            # The mask is drawn in colors then decoded to labels
+            txt_mask = Image.new("RGBA", (text_width, text_height), (0, 0, 0, 0))
+            txt_mask_draw = ImageDraw.Draw(txt_mask)
+            txt_mask_draw.fontmode = "1"
+            for i, c in enumerate(text):
+                txt_mask_draw.text(
+                    positions[i],
+                    c,
+                    fill=((i + 1) // (255 * 255), (i + 1) // 255, (i + 1) % 255),
+                    font=image_font,
+                    stroke_width=stroke_width,
+                    stroke_fill=(0, 0, 0),
+                )
+            txt_mask = to_label_mask(txt_mask)
+
+    bboxes = None
+    if return_bboxes:
+        bboxes = _ink_extents(
+            image_font, text, positions, stroke_width, txt_img.size, rendering_engine
+        )
+
+    return _finish(txt_img, txt_mask, font_size, fit, bboxes, return_bboxes)
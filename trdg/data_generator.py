@@ -1,10 +1,14 @@
 import os
 import random as rnd
 
+import numpy as np
 from PIL import Image, ImageFilter, ImageStat
 
 from trdg import computer_text_generator, background_generator, distorsion_generator
-from trdg.utils import mask_to_bboxes, make_filename_valid
+from trdg.compositing import composite, place_mask
+from trdg.generation_config import GenerationConfig
+from trdg.sample import Sample, SampleRejected
+from trdg.utils import make_filename_valid
 
 try:
     from trdg import handwritten_text_generator
@@ -21,6 +25,61 @@ class FakeTextDataGenerator(object):
 
         cls.generate(*t)
 
+    @classmethod
+    def generate_from_config(
+        cls,
+        index: int,
+        text: str,
+        font: str,
+        config: GenerationConfig,
+        seed: int = None,
+        raise_rejections: bool = False,
+        return_sample: bool = False,
+    ) -> Image:
+        """
+        Same as generate, but takes the parameters shared by all samples as a
+        GenerationConfig. A seed makes the sample reproducible.
+        """
+
+        if seed is not None:
+            rnd.seed(seed)
+            np.random.seed(seed)
+
+        return cls.generate(
+            index,
+            text,
+            font,
+            config.out_dir,
+            config.size,
+            config.extension,
+            config.skewing_angle,
+            config.random_skew,
+            config.blur,
+            config.random_blur,
+            config.background_type,
+            config.distorsion_type,
+            config.distorsion_orientation,
+            config.is_handwritten,
+            config.name_format,
+            config.width,
+            config.alignment,
+            config.text_color,
+            config.orientation,
+            config.space_width,
+            config.character_spacing,
+            config.margins,
+            config.fit,
+            config.output_mask,
+            config.word_split,
+            config.image_dir,
+            config.stroke_width,
+            config.stroke_fill,
+            config.image_mode,
+            config.output_bboxes,
+            raise_rejections,
+            return_sample,
+        )
+
     @classmethod
     def generate(
         cls,
@@ -54,13 +113,26 @@ class FakeTextDataGenerator(object):
         stroke_fill: str = "#282828",
         image_mode: str = "RGB",
         output_bboxes: int = 0,
+        raise_rejections: bool = False,
+        return_sample: bool = False,
     ) -> Image:
+        """
+        Generate the sample of text, saved in out_dir when there is one and
+        returned otherwise, as the image or (image, mask) with output_mask.
+        With return_sample, the Sample is returned in every case instead, with
+        its mask, its bounding boxes computed when asked for. A rejected sample, with too little contrast, gives
+        None or raises SampleRejected with raise_rejections.
+        """
+
         image = None
 
         margin_top, margin_left, margin_bottom, margin_right = margins
         horizontal_margin = margin_left + margin_right
         vertical_margin = margin_top + margin_bottom
 
+        # The mask is only rendered and transformed when an output is made of it
+        with_mask = output_mask == 1 or output_bboxes in (1, 2) or return_sample
+
         ##########################
         # Create picture of text #
         ##########################
@@ -81,6 +153,7 @@ class FakeTextDataGenerator(object):
                 word_split,
                 stroke_width,
                 stroke_fill,
+                with_mask,
             )
         random_angle = rnd.randint(0 - skewing_angle, skewing_angle)
 
@@ -88,9 +161,11 @@ class FakeTextDataGenerator(object):
             skewing_angle if not random_skew else random_angle, expand=1
         )
 
-        rotated_mask = mask.rotate(
-            skewing_angle if not random_skew else random_angle, expand=1
-        )
+        rotated_mask = None
+        if with_mask:
+            rotated_mask = mask.rotate(
+                skewing_angle if not random_skew else random_angle, expand=1
+            )
 
         #############################
         # Apply distortion to image #
@@ -133,9 +208,11 @@ class FakeTextDataGenerator(object):
             resized_img = distorted_img.resize(
                 (new_width, size - vertical_margin), Image.Resampling.LANCZOS
             )
-            resized_mask = distorted_mask.resize(
-                (new_width, size - vertical_margin), Image.Resampling.NEAREST
-            )
+            resized_mask = None
+            if with_mask:
+                resized_mask = distorted_mask.resize(
+                    (new_width, size - vertical_margin), Image.Resampling.NEAREST
+                )
             background_width = width if width > 0 else new_width + horizontal_margin
             background_height = size
         # Vertical text
@@ -147,9 +224,11 @@ class FakeTextDataGenerator(object):
             resized_img = distorted_img.resize(
                 (size - horizontal_margin, new_height), Image.Resampling.LANCZOS
             )
-            resized_mask = distorted_mask.resize(
-                (size - horizontal_margin, new_height), Image.Resampling.NEAREST
-            )
+            resized_mask = None
+            if with_mask:
+                resized_mask = distorted_mask.resize(
+                    (size - horizontal_margin, new_height), Image.Resampling.NEAREST
+                )
             background_width = size
             background_height = new_height + vertical_margin
         else:
@@ -174,19 +253,21 @@ class FakeTextDataGenerator(object):
             background_img = background_generator.image(
                 background_height, background_width, image_dir
             )
-        background_mask = Image.new(
-            "RGB", (background_width, background_height), (0, 0, 0)
-        )
 
         ##############################################################
         # Comparing average pixel value of text and background image #
         ##############################################################
+        rejection = None
         try:
-            resized_img_st = ImageStat.Stat(resized_img, resized_mask.split()[2])
+            resized_img_st = ImageStat.Stat(resized_img, resized_img.getchannel("A"))
             background_img_st = ImageStat.Stat(background_img)
 
             resized_img_px_mean = sum(resized_img_st.mean[:2]) / 3
-            background_img_px_mean = sum(background_img_st.mean) / 3
+            if background_img.mode == "L":
+                # A single channel is already the gray level
+                background_img_px_mean = background_img_st.mean[0]
+            else:
+                background_img_px_mean = sum(background_img_st.mean) / 3
 
             if abs(resized_img_px_mean - background_img_px_mean) < 15:
                 print("value of mean pixel is too similar. Ignore this image")
@@ -194,8 +275,12 @@ class FakeTextDataGenerator(object):
                 print("resized_img_st \n {}".format(resized_img_st.mean))
                 print("background_img_st \n {}".format(background_img_st.mean))
 
-                return
+                rejection = "low contrast"
         except Exception as err:
+            rejection = "{} in the contrast check".format(type(err).__name__)
+        if rejection is not None:
+            if raise_rejections:
+                raise SampleRejected(rejection)
             return
 
         #############################
@@ -205,45 +290,37 @@ class FakeTextDataGenerator(object):
         new_text_width, _ = resized_img.size
 
         if alignment == 0 or width == -1:
-            background_img.paste(resized_img, (margin_left, margin_top), resized_img)
-            background_mask.paste(resized_mask, (margin_left, margin_top))
+            text_offset = (margin_left, margin_top)
         elif alignment == 1:
-            background_img.paste(
-                resized_img,
-                (int(background_width / 2 - new_text_width / 2), margin_top),
-                resized_img,
-            )
-            background_mask.paste(
-                resized_mask,
-                (int(background_width / 2 - new_text_width / 2), margin_top),
-            )
+            text_offset = (int(background_width / 2 - new_text_width / 2), margin_top)
         else:
-            background_img.paste(
-                resized_img,
-                (background_width - new_text_width - margin_right, margin_top),
-                resized_img,
-            )
-            background_mask.paste(
-                resized_mask,
-                (background_width - new_text_width - margin_right, margin_top),
-            )
+            text_offset = (background_width - new_text_width - margin_right, margin_top)
 
-        ############################################
-        # Change image mode (RGB, grayscale, etc.) #
-        ############################################
+        ######################################################
+        # Composite in the image mode (RGB, grayscale, etc.) #
+        ######################################################
 
-        background_img = background_img.convert(image_mode)
-        background_mask = background_mask.convert(image_mode)
+        final_image = composite(background_img, resized_img, text_offset, image_mode)
+        final_mask = None
+        if with_mask:
+            final_mask = place_mask(
+                resized_mask, (background_width, background_height), text_offset, "RGB"
+            )
+            if final_mask.mode != image_mode:
+                final_mask = final_mask.convert(image_mode)
 
         #######################
         # Apply gaussian blur #
         #######################
 
-        gaussian_filter = ImageFilter.GaussianBlur(
-            radius=blur if not random_blur else rnd.random() * blur
-        )
-        final_image = background_img.filter(gaussian_filter)
-        final_mask = background_mask.filter(gaussian_filter)
+        radius = blur if not random_blur else rnd.random() * blur
+        # A blur of radius 0 leaves the images as they are
+        if radius > 0:
+            gaussian_filter = ImageFilter.GaussianBlur(radius=radius)
+            final_image = final_image.filter(gaussian_filter)
+            if with_mask:
+                final_mask = final_mask.filter(gaussian_filter)
+        sample = Sample(final_image, final_mask)
 
         #####################################
         # Generate name for resulting image #
@@ -273,18 +350,20 @@ class FakeTextDataGenerator(object):
             if output_mask == 1:
                 final_mask.save(os.path.join(out_dir, mask_name))
             if output_bboxes == 1:
-                bboxes = mask_to_bboxes(final_mask)
+                bboxes = sample.bboxes()
                 with open(os.path.join(out_dir, box_name), "w") as f:
                     for bbox in bboxes:
                         f.write(" ".join([str(v) for v in bbox]) + "\n")
             if output_bboxes == 2:
-                bboxes = mask_to_bboxes(final_mask, tess=True)
+                bboxes = sample.bboxes(tess=True)
                 with open(os.path.join(out_dir, tess_box_name), "w") as f:
                     for bbox, char in zip(bboxes, text):
                         f.write(
                             " ".join([char] + [str(v) for v in bbox] + ["0"]) + "\n"
                         )
-        else:
+        if return_sample:
+            return sample
+        if out_dir is None:
             if output_mask == 1:
                 return final_image, final_mask
             return final_image
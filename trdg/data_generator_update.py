@@ -3,8 +3,20 @@ import random as rnd
 
 from PIL import Image, ImageFilter, ImageStat
 
-from trdg import computer_text_generator_update, background_generator_update, distorsion_generator
-from trdg.utils import mask_to_bboxes, make_filename_valid
+from trdg import (
+    background_generator_update,
+    computer_text_generator_update,
+    distorsion_generator,
+    geometry,
+)
+from trdg.compositing import composite, place_mask
+from trdg.sample import Sample, SampleRejected
+from trdg.utils import (
+    make_filename_valid,
+    resize_extents,
+    to_label_mask,
+    translate_extents,
+)
 
 try:
     from trdg import handwritten_text_generator
@@ -58,27 +70,101 @@ class FakeTextDataGenerator(object):
         stroke_fill: str = "#282828",
         image_mode: str = "RGB",
         output_bboxes: int = 0,
+        rendering_engine: str = "draw",
+        raise_rejections: bool = False,
+        return_sample: bool = False,
     ) -> Image:
+        """
+        Generate the sample of text, saved in out_dir when there is one and
+        returned otherwise, as the image or (image, mask) with output_mask.
+        With return_sample, the Sample is returned in every case instead, with
+        its mask, its bounding boxes computed when asked for. A rejected sample, whose text doesn't stand out from
+        its background, gives None or raises SampleRejected with
+        raise_rejections.
+        """
+
         image = None
+        # Pixel extents of the characters known from the layout, when we can
+        # follow them through the transforms, otherwise boxes come from the mask
+        extents = None
+
+        # The mask is only rendered and transformed when an output needs it,
+        # bounding boxes only need it when the layout can't give them
+        layout_bboxes = (
+            not is_handwritten
+            and skewing_angle == 0
+            and distorsion_type == 0
+            and rendering_engine != "raqm"
+        )
+        # An API caller asking for the sample gets both
+        with_bboxes = output_bboxes in (1, 2) or return_sample
+        with_mask = (
+            output_mask == 1 or return_sample or (with_bboxes and not layout_bboxes)
+        )
+        # Grayscale samples are rendered, transformed and composited in L and LA
+        single_channel = gray_scale or image_mode == "L"
 
         margin_top, margin_left, margin_bottom, margin_right = margins
         horizontal_margin = margin_left + margin_right
         vertical_margin = margin_top + margin_bottom
 
+        if is_handwritten and orientation == 1:
+            raise ValueError("Vertical handwritten text is unavailable")
+
+        #############################
+        # Generate background image #
+        #############################
+        # Made before the text, as large as the text is expected to need, so
+        # that the text colors can be picked to stand out from it. The
+        # background of the text is then cut from its top left corner. The
+        # font size, the height of horizontal text, is picked here for it.
+        size = rnd.randint(min_font_size, max_font_size)
+        if orientation == 0 and width > 0:
+            sample_size = min_size = (width, size)
+        elif orientation == 0:
+            sample_size = (
+                computer_text_generator_update.expected_length(
+                    text, size - vertical_margin
+                )
+                + horizontal_margin,
+                size,
+            )
+            min_size = (horizontal_margin + 1, size)
+        else:
+            sample_size = (
+                size,
+                computer_text_generator_update.expected_length(
+                    text, size - horizontal_margin, orientation
+                )
+                + vertical_margin,
+            )
+            min_size = (size, vertical_margin + 1)
+        background_img = background_generator_update.generate(
+            background_type,
+            sample_size[1],
+            sample_size[0],
+            image_dir,
+            single_channel,
+        )
+        background_gray = background_generator_update.gray_range(
+            background_img, min_size
+        )
+
         ##########################
         # Create picture of text #
         ##########################
         if is_handwritten:
-            if orientation == 1:
-                raise ValueError("Vertical handwritten text is unavailable")
             image, mask = handwritten_text_generator.generate(text, text_color)
+            mask = to_label_mask(mask) if with_mask else None
         else:
-            image, mask, size = computer_text_generator_update.generate(
+            # Extents are only worked out when boxes are written
+            return_bboxes = with_bboxes and layout_bboxes
+            text_outputs = computer_text_generator_update.generate(
                 text,
                 fonts,
                 gray_scale,
-                min_font_size,
-                max_font_size,
+                size,
+                size,
                 orientation,
                 random_spacing,
                 max_random_spacing,
@@ -88,44 +174,61 @@ class FakeTextDataGenerator(object):
                 word_split,
                 stroke_width,
                 stroke_fill,
+                rendering_engine,
+                return_bboxes=return_bboxes,
+                with_mask=with_mask,
+                background_gray=background_gray,
+                single_channel=single_channel,
             )
+            image, mask, size = text_outputs[:3]
+            if return_bboxes:
+                extents = text_outputs[3]
         random_angle = rnd.randint(0 - skewing_angle, skewing_angle)
+        angle = skewing_angle if not random_skew else random_angle
 
-        rotated_img = image.rotate(
-            skewing_angle if not random_skew else random_angle, expand=1
-        )
+        # Rotations and distortions move pixels in ways we don't track
+        if angle != 0 or distorsion_type != 0:
+            extents = None
 
-        rotated_mask = mask.rotate(
-            skewing_angle if not random_skew else random_angle, expand=1
-        )
+        vertical = distorsion_orientation == 0 or distorsion_orientation == 2
+        horizontal = distorsion_orientation == 1 or distorsion_orientation == 2
 
-        #############################
-        # Apply distortion to image #
-        #############################
-        if distorsion_type == 0:
-            distorted_img = rotated_img  # Mind = blown
-            distorted_mask = rotated_mask
-        elif distorsion_type == 1:
-            distorted_img, distorted_mask = distorsion_generator.sin(
-                rotated_img,
-                rotated_mask,
-                vertical=(distorsion_orientation == 0 or distorsion_orientation == 2),
-                horizontal=(distorsion_orientation == 1 or distorsion_orientation == 2),
-            )
-        elif distorsion_type == 2:
-            distorted_img, distorted_mask = distorsion_generator.cos(
-                rotated_img,
-                rotated_mask,
-                vertical=(distorsion_orientation == 0 or distorsion_orientation == 2),
-                horizontal=(distorsion_orientation == 1 or distorsion_orientation == 2),
+        if not is_handwritten and max(image.size) < geometry.MAX_SOURCE_SIZE:
+            ###################################################
+            # Compose rotation and distortion with the resize #
+            ###################################################
+            matrix, rotated_size = geometry.rotation(image.size, angle)
+            field = distorsion_generator.displacement_field(
+                distorsion_type, rotated_size, vertical, horizontal
             )
+            distorted_img, distorted_mask = image, mask
+            distorted_size = field.size if field is not None else rotated_size
         else:
-            distorted_img, distorted_mask = distorsion_generator.random(
-                rotated_img,
-                rotated_mask,
-                vertical=(distorsion_orientation == 0 or distorsion_orientation == 2),
-                horizontal=(distorsion_orientation == 1 or distorsion_orientation == 2),
-            )
+            matrix = field = None
+
+            rotated_img = image.rotate(angle, expand=1)
+
+            rotated_mask = mask.rotate(angle, expand=1) if with_mask else None
+
+            #############################
+            # Apply distortion to image #
+            #############################
+            if distorsion_type == 0:
+                distorted_img = rotated_img  # Mind = blown
+                distorted_mask = rotated_mask
+            elif distorsion_type == 1:
+                distorted_img, distorted_mask = distorsion_generator.sin(
+                    rotated_img, rotated_mask, vertical=vertical, horizontal=horizontal
+                )
+            elif distorsion_type == 2:
+                distorted_img, distorted_mask = distorsion_generator.cos(
+                    rotated_img, rotated_mask, vertical=vertical, horizontal=horizontal
+                )
+            else:
+                distorted_img, distorted_mask = distorsion_generator.random(
+                    rotated_img, rotated_mask, vertical=vertical, horizontal=horizontal
+                )
+            distorted_size = distorted_img.size
 
         ##################################
         # Resize image to desired format #
@@ -134,75 +237,81 @@ class FakeTextDataGenerator(object):
         # Horizontal text
         if orientation == 0:
             new_width = int(
-                distorted_img.size[0]
-                * (float(size - vertical_margin) / float(distorted_img.size[1]))
-            )
-            resized_img = distorted_img.resize(
-                (new_width, size - vertical_margin), Image.Resampling.LANCZOS
-            )
-            resized_mask = distorted_mask.resize(
-                (new_width, size - vertical_margin), Image.Resampling.NEAREST
+                distorted_size[0]
+                * (float(size - vertical_margin) / float(distorted_size[1]))
             )
+            new_size = (new_width, size - vertical_margin)
             background_width = width if width > 0 else new_width + horizontal_margin
             background_height = size
         # Vertical text
         elif orientation == 1:
             new_height = int(
-                float(distorted_img.size[1])
-                * (float(size - horizontal_margin) / float(distorted_img.size[0]))
-            )
-            resized_img = distorted_img.resize(
-                (size - horizontal_margin, new_height), Image.Resampling.LANCZOS
-            )
-            resized_mask = distorted_mask.resize(
-                (size - horizontal_margin, new_height), Image.Resampling.NEAREST
+                float(distorted_size[1])
+                * (float(size - horizontal_margin) / float(distorted_size[0]))
             )
+            new_size = (size - horizontal_margin, new_height)
             background_width = size
             background_height = new_height + vertical_margin
         else:
             raise ValueError("Invalid orientation")
 
-        #############################
-        # Generate background image #
-        #############################
-        if background_type == 0:
-            background_img = background_generator_update.gaussian_noise(
-                background_height, background_width
-            )
-        elif background_type == 1:
-            background_img = background_generator_update.plain_white(
-                background_height, background_width, gray_scale
-            )
-        elif background_type == 2:
-            background_img = background_generator_update.quasicrystal(
-                background_height, background_width
-            )
-        else:
-            background_img = background_generator_update.image(
-                background_height, background_width, image_dir, gray_scale
-            )
-        background_mask = Image.new(
-            "RGB", (background_width, background_height), (0, 0, 0)
+        resized_img, resized_mask = geometry.warp(
+            distorted_img, distorted_mask, matrix, field, distorted_size, new_size
         )
 
+        if extents is not None:
+            extents = resize_extents(extents, distorted_size, resized_img.size)
+
+        ##############################
+        # Cut background to its size #
+        ##############################
+        if background_img.size != (background_width, background_height):
+            if (
+                background_img.size[0] >= background_width
+                and background_img.size[1] >= background_height
+            ):
+                background_img = background_img.crop(
+                    (0, 0, background_width, background_height)
+                )
+            else:
+                # Longer text than expected, its colors may not stand out
+                # from a new background
+                background_img = background_generator_update.generate(
+                    background_type,
+                    background_height,
+                    background_width,
+                    image_dir,
+                    single_channel,
+                )
+
         ##############################################################
         # Comparing average pixel value of text and background image #
         ##############################################################
-        try:
-            resized_img_st = ImageStat.Stat(resized_img, resized_mask.split()[2])
-            background_img_st = ImageStat.Stat(background_img)
-
-            resized_img_px_mean = sum(resized_img_st.mean[:2]) / 3
-            background_img_px_mean = sum(background_img_st.mean) / 3
-
-            if abs(resized_img_px_mean - background_img_px_mean) < 15:
-                print("value of mean pixel is too similar. Ignore this image")
-
-                print("resized_img_st \n {}".format(resized_img_st.mean))
-                print("background_img_st \n {}".format(background_img_st.mean))
-
-                return
-        except Exception as err:
+        # Text pixels weigh as much as they cover, nearly transparent ones
+        # have imprecise colors after resampling
+        resized_img_st = ImageStat.Stat(
+            resized_img.convert("La" if resized_img.mode == "LA" else "RGBa")
+        )
+        rejection = None
+        if resized_img_st.sum[-1] == 0:
+            rejection = "no visible text"
+        else:
+            # Gray levels as background_generator_update.gray_range computes them
+            color_sums = resized_img_st.sum[:-1]
+            resized_img_px_mean = (
+                sum(color_sums) / len(color_sums) * 255 / resized_img_st.sum[-1]
+            )
+            background_img_px_mean = background_generator_update.mean_gray(
+                background_img
+            )
+            if (
+                abs(resized_img_px_mean - background_img_px_mean)
+                < computer_text_generator_update.MIN_CONTRAST
+            ):
+                rejection = "low contrast"
+        if rejection is not None:
+            if raise_rejections:
+                raise SampleRejected(rejection)
             return
 
         #############################
@@ -212,45 +321,48 @@ class FakeTextDataGenerator(object):
         new_text_width, _ = resized_img.size
 
         if alignment == 0 or width == -1:
-            background_img.paste(resized_img, (margin_left, margin_top), resized_img)
-            background_mask.paste(resized_mask, (margin_left, margin_top))
+            text_x = margin_left
         elif alignment == 1:
-            background_img.paste(
-                resized_img,
-                (int(background_width / 2 - new_text_width / 2), margin_top),
-                resized_img,
-            )
-            background_mask.paste(
-                resized_mask,
-                (int(background_width / 2 - new_text_width / 2), margin_top),
-            )
+            text_x = int(background_width / 2 - new_text_width / 2)
         else:
-            background_img.paste(
-                resized_img,
-                (background_width - new_text_width - margin_right, margin_top),
-                resized_img,
-            )
-            background_mask.paste(
-                resized_mask,
-                (background_width - new_text_width - margin_right, margin_top),
+            text_x = background_width - new_text_width - margin_right
+
+        if extents is not None:
+            extents = translate_extents(
+                extents, (text_x, margin_top), (background_width, background_height)
             )
 
-        ############################################
-        # Change image mode (RGB, grayscale, etc.) #
-        ############################################
+        ######################################################
+        # Composite in the image mode (RGB, grayscale, etc.) #
+        ######################################################
 
-        background_img = background_img.convert(image_mode)
-        background_mask = background_mask.convert(image_mode)
+        # Grayscale samples are composited and blurred in L, and only
+        # converted to the image mode once done
+        final_image = composite(
+            background_img,
+            resized_img,
+            (text_x, margin_top),
+            "L" if single_channel else image_mode,
+        )
+        # Character labels, only ever moved with nearest neighbor operations
+        final_mask = None
+        if with_mask:
+            final_mask = place_mask(
+                resized_mask, (background_width, background_height), (text_x, margin_top)
+            )
 
         #######################
         # Apply gaussian blur #
         #######################
 
-        gaussian_filter = ImageFilter.GaussianBlur(
-            radius=blur if not random_blur else rnd.random() * blur
-        )
-        final_image = background_img.filter(gaussian_filter)
-        final_mask = background_mask.filter(gaussian_filter)
+        radius = blur if not random_blur else rnd.random() * blur
+        # A blur of radius 0 leaves the image as it is. Blurring the mask
+        # would mix the labels of neighboring characters.
+        if radius > 0:
+            final_image = final_image.filter(ImageFilter.GaussianBlur(radius=radius))
+        if final_image.mode != image_mode:
+            final_image = final_image.convert(image_mode)
+        sample = Sample(final_image, final_mask, extents)
 
         #####################################
         # Generate name for resulting image #
@@ -280,18 +392,29 @@ class FakeTextDataGenerator(object):
             if output_mask == 1:
                 final_mask.save(os.path.join(out_dir, mask_name))
             if output_bboxes == 1:
-                bboxes = mask_to_bboxes(final_mask)
+                bboxes = sample.bboxes()
                 with open(os.path.join(out_dir, box_name), "w") as f:
                     for bbox in bboxes:
                         f.write(" ".join([str(v) for v in bbox]) + "\n")
             if output_bboxes == 2:
-                bboxes = mask_to_bboxes(final_mask, tess=True)
+                bboxes = sample.bboxes(tess=True)
+                # A shaped line is labelled by grapheme clusters, not characters
+                if (
+                    not is_handwritten
+                    and orientation == 0
+                    and rendering_engine == "raqm"
+                ):
+                    pieces = computer_text_generator_update.split_clusters(text)
+                else:
+                    pieces = text
                 with open(os.path.join(out_dir, tess_box_name), "w") as f:
-                    for bbox, char in zip(bboxes, text):
+                    for bbox, char in zip(bboxes, pieces):
                         f.write(
                             " ".join([char] + [str(v) for v in bbox] + ["0"]) + "\n"
                         )
-        else:
+        if return_sample:
+            return sample
+        if out_dir is None:
             if output_mask == 1:
                 return final_image, final_mask
             return final_image
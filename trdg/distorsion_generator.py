@@ -1,103 +1,160 @@
 import cv2
-import math
 import os
-import random as rnd
 import numpy as np
-from typing import Tuple
+from typing import Callable, Tuple
 
 from PIL import Image
 
 
+class DisplacementField(object):
+    """
+    Column and row shifts of a distortion, from the distorted image back to
+    the image it was made from. func maps an array of column or row indices
+    to their integer offsets.
+    """
+
+    __slots__ = (
+        "size",
+        "source_size",
+        "vertical",
+        "horizontal",
+        "_column_shifts",
+        "_row_shifts",
+        "_row_count",
+    )
+
+    def __init__(
+        self,
+        source_size: Tuple[int, int],
+        vertical: bool,
+        horizontal: bool,
+        max_offset: int,
+        func: Callable,
+    ):
+        width, height = source_size
+
+        vertical_offsets = func(np.arange(width))
+        # Rows past the ones with an offset are left empty when both axes move
+        row_count = height + (
+            (vertical_offsets.max() - min(vertical_offsets.min(), 0)) if vertical else 0
+        )
+        horizontal_offsets = func(np.arange(row_count))
+
+        self.source_size = source_size
+        self.size = (
+            width + (2 * max_offset if horizontal else 0),
+            height + (2 * max_offset if vertical else 0),
+        )
+        self.vertical = vertical
+        self.horizontal = horizontal
+        self._column_shifts = (max_offset + vertical_offsets).astype(np.int32)
+        self._row_shifts = np.zeros(self.size[1], dtype=np.int32)
+        self._row_shifts[:row_count] = max_offset + horizontal_offsets
+        self._row_count = row_count
+
+    def source(self, xs: np.ndarray, ys: np.ndarray) -> Tuple:
+        """
+        Source coordinates of distorted image coordinates, whole pixels or
+        not, and whether they fall in the source image. The row is shifted
+        back first, then the column.
+        """
+
+        # Coordinates are truncated to index the shifts, those it rounds up
+        # are negative and already invalid
+        width, height = self.source_size
+        valid = True
+        if self.horizontal:
+            valid = (ys >= 0) & (ys < self._row_count)
+            rows = np.clip(ys.astype(np.intp), 0, self.size[1] - 1)
+            xs = xs - self._row_shifts[rows]
+        valid = valid & (xs >= 0) & (xs < width)
+        if self.vertical:
+            columns = np.clip(xs.astype(np.intp), 0, width - 1)
+            ys = ys - self._column_shifts[columns]
+        valid = valid & (ys >= 0) & (ys < height)
+        return xs, ys, valid
+
+
 def _apply_func_distorsion(
     image: Image, mask: Image, vertical: bool, horizontal: bool, max_offset: int, func
 ) -> Tuple:
     """
-    Apply a distortion to an image
+    Apply a distortion to an image. func maps an array of column or row
+    indices to their integer offsets.
     """
 
     # Nothing to do!
     if not vertical and not horizontal:
         return image, mask
 
-    # FIXME: From looking at the code I think both are already RGBA
-    rgb_image = image.convert("RGBA")
-    rgb_mask = mask.convert("RGB")
-
-    img_arr = np.array(rgb_image)
-    mask_arr = np.array(rgb_mask)
-
-    vertical_offsets = [func(i) for i in range(img_arr.shape[1])]
-    horizontal_offsets = [
-        func(i)
-        for i in range(
-            img_arr.shape[0]
-            + (
-                (max(vertical_offsets) - min(min(vertical_offsets), 0))
-                if vertical
-                else 0
-            )
-        )
-    ]
+    # Grayscale text stays LA, everything else is moved as RGBA
+    mode = "LA" if image.mode == "LA" else "RGBA"
+    img_arr = np.asarray(image.convert(mode))
+    # Label masks are moved as they are, color masks as RGB. The mask is
+    # optional, None when the caller doesn't need one.
+    mask_arr = None
+    if mask is not None:
+        mask_arr = np.asarray(mask if mask.mode == "I;16" else mask.convert("RGB"))
+
+    height, width = img_arr.shape[:2]
+    field = DisplacementField((width, height), vertical, horizontal, max_offset, func)
+    new_width, new_height = field.size
+
+    # Every pixel of the result is read from one source pixel, those without
+    # a source read an extra empty pixel
+    src_cols, src_rows, valid = field.source(
+        np.arange(new_width, dtype=np.int32)[None, :],
+        np.arange(new_height, dtype=np.int32)[:, None],
+    )
+    src = np.where(valid, src_rows * width + src_cols, height * width)
 
-    new_img_arr = np.zeros(
-        (
-            img_arr.shape[0] + (2 * max_offset if vertical else 0),
-            img_arr.shape[1] + (2 * max_offset if horizontal else 0),
-            4,
-        )
+    def remap(arr):
+        flat = arr.reshape((height * width, -1) if arr.ndim == 3 else -1)
+        flat = np.concatenate((flat, np.zeros_like(flat[:1])))
+        return Image.fromarray(np.take(flat, src, axis=0))
+
+    return (
+        remap(img_arr).convert(mode),
+        remap(mask_arr) if mask_arr is not None else None,
     )
 
-    new_img_arr_copy = np.copy(new_img_arr)
 
-    new_mask_arr = np.zeros(
-        (
-            # I keep img_arr to maximise the chance of
-            # a breakage if img and mask don't match
-            img_arr.shape[0] + (2 * max_offset if vertical else 0),
-            img_arr.shape[1] + (2 * max_offset if horizontal else 0),
-            3,
+def _distorsion_func(distorsion_type: int, height: int) -> Tuple[int, Callable]:
+    """
+    Max offset and offset function of a distortion type (1: sine, 2: cosine,
+    3: random) for an image of the given height
+    """
+
+    if distorsion_type == 1:
+        max_offset = int(height**0.5)
+        return max_offset, (
+            lambda x: (np.sin(np.radians(x)) * max_offset).astype(int)
         )
-    )
+    if distorsion_type == 2:
+        max_offset = int(height**0.5)
+        return max_offset, (
+            lambda x: (np.cos(np.radians(x)) * max_offset).astype(int)
+        )
+    if distorsion_type == 3:
+        max_offset = int(height**0.4)
+        return max_offset, (
+            lambda x: np.random.randint(0, max_offset + 1, size=len(x))
+        )
+    raise ValueError("Invalid distorsion type")
 
-    new_mask_arr_copy = np.copy(new_mask_arr)
-
-    if vertical:
-        column_height = img_arr.shape[0]
-        for i, o in enumerate(vertical_offsets):
-            column_pos = (i + max_offset) if horizontal else i
-            new_img_arr[
-                max_offset + o : column_height + max_offset + o, column_pos, :
-            ] = img_arr[:, i, :]
-            new_mask_arr[
-                max_offset + o : column_height + max_offset + o, column_pos, :
-            ] = mask_arr[:, i, :]
-
-    if horizontal:
-        row_width = img_arr.shape[1]
-        for i, o in enumerate(horizontal_offsets):
-            if vertical:
-                new_img_arr_copy[
-                    i, max_offset + o : row_width + max_offset + o, :
-                ] = new_img_arr[i, max_offset : row_width + max_offset, :]
-                new_mask_arr_copy[
-                    i, max_offset + o : row_width + max_offset + o, :
-                ] = new_mask_arr[i, max_offset : row_width + max_offset, :]
-            else:
-                new_img_arr[
-                    i, max_offset + o : row_width + max_offset + o, :
-                ] = img_arr[i, :, :]
-                new_mask_arr[
-                    i, max_offset + o : row_width + max_offset + o, :
-                ] = mask_arr[i, :, :]
 
-    return (
-        Image.fromarray(
-            np.uint8(new_img_arr_copy if horizontal and vertical else new_img_arr)
-        ).convert("RGBA"),
-        Image.fromarray(
-            np.uint8(new_mask_arr_copy if horizontal and vertical else new_mask_arr)
-        ).convert("RGB"),
-    )
+def displacement_field(
+    distorsion_type: int, size: Tuple[int, int], vertical: bool, horizontal: bool
+) -> DisplacementField:
+    """
+    Displacement field of a distortion type for an image of the given size,
+    None when nothing moves
+    """
+
+    if distorsion_type == 0 or not (vertical or horizontal):
+        return None
+    max_offset, func = _distorsion_func(distorsion_type, size[1])
+    return DisplacementField(size, vertical, horizontal, max_offset, func)
 
 
 def sin(
@@ -107,15 +164,8 @@ def sin(
     Apply a sine distortion on one or both of the specified axis
     """
 
-    max_offset = int(image.height**0.5)
-
     return _apply_func_distorsion(
-        image,
-        mask,
-        vertical,
-        horizontal,
-        max_offset,
-        (lambda x: int(math.sin(math.radians(x)) * max_offset)),
+        image, mask, vertical, horizontal, *_distorsion_func(1, image.height)
     )
 
 
@@ -126,15 +176,8 @@ def cos(
     Apply a cosine distortion on one or both of the specified axis
     """
 
-    max_offset = int(image.height**0.5)
-
     return _apply_func_distorsion(
-        image,
-        mask,
-        vertical,
-        horizontal,
-        max_offset,
-        (lambda x: int(math.cos(math.radians(x)) * max_offset)),
+        image, mask, vertical, horizontal, *_distorsion_func(2, image.height)
     )
 
 
@@ -145,13 +188,6 @@ def random(
     Apply a random distortion on one or both of the specified axis
     """
 
-    max_offset = int(image.height**0.4)
-
     return _apply_func_distorsion(
-        image,
-        mask,
-        vertical,
-        horizontal,
-        max_offset,
-        (lambda x: rnd.randint(0, max_offset)),
+        image, mask, vertical, horizontal, *_distorsion_func(3, image.height)
     )
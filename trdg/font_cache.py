@@ -0,0 +1,136 @@
+"""
+Process-wide cache of loaded fonts
+"""
+
+from collections import OrderedDict
+from io import BytesIO
+from typing import Dict, Tuple
+
+from PIL import ImageFont, features
+
+# Same default as ImageFont.truetype
+DEFAULT_LAYOUT_ENGINE = (
+    ImageFont.Layout.RAQM if features.check("raqm") else ImageFont.Layout.BASIC
+)
+
+
+class FontCache(object):
+    """
+    LRU cache of FreeTypeFont objects keyed by (font path, size, layout engine).
+
+    The font file is read from disk once per path, every other size of the same
+    font is derived from the in-memory face with font_variant. The cache is
+    bounded both by its number of entries and by the number of font file bytes
+    it keeps alive.
+    """
+
+    def __init__(self, max_entries: int = 256, max_bytes: int = 512 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._fonts = OrderedDict()
+        # path -> [font file size in bytes, number of cached sizes]
+        self._paths = {}
+        self._nbytes = 0
+
+    def __len__(self) -> int:
+        return len(self._fonts)
+
+    @property
+    def nbytes(self) -> int:
+        """Number of font file bytes held by the cache"""
+        return self._nbytes
+
+    def get(
+        self, path: str, size: int, layout_engine: ImageFont.Layout = None
+    ) -> ImageFont.FreeTypeFont:
+        """
+        Return the font at path rendered at size, loading it if necessary
+        """
+
+        if layout_engine is None:
+            layout_engine = DEFAULT_LAYOUT_ENGINE
+        key = (path, size, layout_engine)
+        image_font = self._fonts.get(key)
+        if image_font is not None:
+            self.hits += 1
+            self._fonts.move_to_end(key)
+            return image_font
+
+        self.misses += 1
+        image_font = self._load(path, size, layout_engine)
+        self._fonts[key] = image_font
+        if path in self._paths:
+            self._paths[path][1] += 1
+        else:
+            font_bytes = len(image_font.font_bytes)
+            self._paths[path] = [font_bytes, 1]
+            self._nbytes += font_bytes
+        self._evict(key)
+
+        return image_font
+
+    def clear(self) -> None:
+        self._fonts.clear()
+        self._paths.clear()
+        self._nbytes = 0
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "entries": len(self._fonts),
+            "bytes": self._nbytes,
+        }
+
+    def _load(
+        self, path: str, size: int, layout_engine: ImageFont.Layout
+    ) -> ImageFont.FreeTypeFont:
+        # Any cached size of the same font already holds the file in memory
+        for (cached_path, _, cached_layout), cached_font in reversed(
+            self._fonts.items()
+        ):
+            if cached_path != path:
+                continue
+            if cached_layout == layout_engine:
+                return cached_font.font_variant(size=size)
+            # font_variant can't switch back to BASIC, which is 0
+            return ImageFont.truetype(
+                BytesIO(cached_font.font_bytes), size, layout_engine=layout_engine
+            )
+
+        with open(path, "rb") as f:
+            return ImageFont.truetype(f, size, layout_engine=layout_engine)
+
+    def _evict(self, keep: Tuple) -> None:
+        while len(self._fonts) > 1 and (
+            len(self._fonts) > self.max_entries or self._nbytes > self.max_bytes
+        ):
+            key = next(iter(self._fonts))
+            if key == keep:
+                break
+            del self._fonts[key]
+            path = key[0]
+            self._paths[path][1] -= 1
+            if self._paths[path][1] == 0:
+                self._nbytes -= self._paths.pop(path)[0]
+
+
+_font_cache = FontCache()
+
+
+def get_font(
+    path: str, size: int, layout_engine: ImageFont.Layout = None
+) -> ImageFont.FreeTypeFont:
+    """
+    Get a font from the process-wide font cache
+    """
+    return _font_cache.get(path, size, layout_engine)
+
+
+def font_cache_stats() -> Dict[str, int]:
+    """
+    Hit/miss counters and occupancy of the process-wide font cache
+    """
+    return _font_cache.stats()
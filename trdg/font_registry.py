@@ -0,0 +1,201 @@
+"""
+Font directory registry backed by an on-disk manifest
+"""
+
+import hashlib
+import json
+import os
+import struct
+from io import BytesIO
+from typing import Dict, List, Optional
+
+from PIL import ImageFont
+
+from trdg.glyph_coverage import GlyphCoverageIndex, read_cmap
+
+FONT_EXTENSIONS = (".ttf", ".otf", ".ttc")
+MANIFEST_VERSION = 2
+# Sizes a font is loaded at when it is validated. Outline fonts load at all of
+# them, bitmap-only fonts only at their embedded strike sizes.
+PROBE_SIZES = (8, 12, 16, 20, 24, 32, 48, 64, 96, 128)
+
+
+def _default_manifest_path(font_dir: str) -> str:
+    cache_dir = os.environ.get(
+        "XDG_CACHE_HOME", os.path.join(os.path.expanduser("~"), ".cache")
+    )
+    digest = hashlib.sha1(font_dir.encode("utf8")).hexdigest()[:16]
+    return os.path.join(cache_dir, "trdg", "fonts-{}.json".format(digest))
+
+
+def _probe_font(path: str) -> Optional[Dict]:
+    """
+    Load a font file and describe it, returns None if it can't be loaded
+    """
+
+    try:
+        with open(path, "rb") as f:
+            font_bytes = f.read()
+    except OSError:
+        return None
+
+    image_font = None
+    sizes = []
+    for size in PROBE_SIZES:
+        try:
+            if image_font is None:
+                image_font = ImageFont.truetype(BytesIO(font_bytes), size)
+            else:
+                image_font = image_font.font_variant(size=size)
+            sizes.append(size)
+        except OSError:
+            continue
+
+    if image_font is None:
+        return None
+
+    try:
+        coverage = read_cmap(font_bytes)
+    except (ValueError, struct.error):
+        coverage = []
+
+    family, style = image_font.getname()
+    return {
+        "family": family,
+        "style": style,
+        "scalable": len(sizes) == len(PROBE_SIZES),
+        "sizes": sizes,
+        "coverage": coverage,
+    }
+
+
+class FontRegistry(object):
+    """
+    Scans a font directory once, validates that every font file loads and
+    keeps the result in a manifest that is reused until the files change.
+    """
+
+    def __init__(self, font_dir: str, manifest_path: str = None):
+        self.font_dir = os.path.abspath(font_dir)
+        self.manifest_path = (
+            manifest_path
+            if manifest_path is not None
+            else _default_manifest_path(self.font_dir)
+        )
+        self.entries = []
+        self._coverage_index = None
+        self.refresh()
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    @property
+    def fonts(self) -> List[str]:
+        """Paths of all the valid fonts of the directory"""
+        return [e["path"] for e in self.entries]
+
+    def fonts_for_size(self, size: int) -> List[str]:
+        """Paths of the fonts that can be loaded at a given size"""
+        return [
+            e["path"] for e in self.entries if e["scalable"] or size in e["sizes"]
+        ]
+
+    @property
+    def coverage_index(self) -> GlyphCoverageIndex:
+        """Character to fonts inverted index, built from the manifest"""
+        if self._coverage_index is None:
+            self._coverage_index = GlyphCoverageIndex(
+                self.fonts, [e["coverage"] for e in self.entries]
+            )
+        return self._coverage_index
+
+    def fonts_for_text(self, text: str) -> List[str]:
+        """Paths of the fonts that have a glyph for every character of text"""
+        return self.coverage_index.fonts_for_text(text)
+
+    def refresh(self) -> None:
+        """
+        Rescan the directory, only loading the fonts that are new or changed
+        since the manifest was written
+        """
+
+        known = {e["path"]: e for e in self._read_manifest()}
+
+        manifest_entries = []
+        changed = False
+        for dir_entry in sorted(os.scandir(self.font_dir), key=lambda e: e.name):
+            if not dir_entry.is_file() or not dir_entry.name.lower().endswith(
+                FONT_EXTENSIONS
+            ):
+                continue
+            stat = dir_entry.stat()
+            entry = known.pop(dir_entry.path, None)
+            if entry is None or (entry["mtime"], entry["bytes"]) != (
+                stat.st_mtime,
+                stat.st_size,
+            ):
+                changed = True
+                info = _probe_font(dir_entry.path)
+                # Invalid fonts are kept in the manifest so they are not probed again
+                entry = {
+                    "path": dir_entry.path,
+                    "mtime": stat.st_mtime,
+                    "bytes": stat.st_size,
+                    "valid": info is not None,
+                }
+                if info is not None:
+                    entry.update(info)
+            manifest_entries.append(entry)
+
+        # Anything left in known was deleted from the directory
+        if changed or known:
+            self._write_manifest(manifest_entries)
+
+        self.entries = [e for e in manifest_entries if e["valid"]]
+        self._coverage_index = None
+
+    def _read_manifest(self) -> List[Dict]:
+        try:
+            with open(self.manifest_path, "r", encoding="utf8") as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return []
+        if (
+            manifest.get("version") != MANIFEST_VERSION
+            or manifest.get("font_dir") != self.font_dir
+        ):
+            return []
+        return manifest["fonts"]
+
+    def _write_manifest(self, entries: List[Dict]) -> None:
+        try:
+            os.makedirs(os.path.dirname(self.manifest_path), exist_ok=True)
+            tmp_path = "{}.{}.tmp".format(self.manifest_path, os.getpid())
+            with open(tmp_path, "w", encoding="utf8") as f:
+                json.dump(
+                    {
+                        "version": MANIFEST_VERSION,
+                        "font_dir": self.font_dir,
+                        "fonts": entries,
+                    },
+                    f,
+                    ensure_ascii=False,
+                )
+            os.replace(tmp_path, self.manifest_path)
+        except OSError:
+            # A read-only cache directory only costs us a rescan next time
+            pass
+
+
+_registries = {}
+
+
+def get_font_registry(font_dir: str) -> FontRegistry:
+    """
+    Get the registry of a font directory, scanning it only once per process
+    """
+
+    font_dir = os.path.abspath(font_dir)
+    if font_dir not in _registries:
+        _registries[font_dir] = FontRegistry(font_dir)
+    return _registries[font_dir]
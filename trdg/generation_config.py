@@ -0,0 +1,198 @@
+"""
+Generation parameters shared by all the samples of a run
+"""
+
+from enum import IntEnum
+from typing import List, Sequence, Union
+
+from trdg.utils import parse_colors
+
+
+class Orientation(IntEnum):
+    HORIZONTAL = 0
+    VERTICAL = 1
+
+
+class BackgroundType(IntEnum):
+    GAUSSIAN_NOISE = 0
+    PLAIN_WHITE = 1
+    QUASICRYSTAL = 2
+    IMAGE = 3
+
+
+class DistorsionType(IntEnum):
+    NONE = 0
+    SINE = 1
+    COSINE = 2
+    RANDOM = 3
+
+
+class DistorsionOrientation(IntEnum):
+    VERTICAL = 0
+    HORIZONTAL = 1
+    BOTH = 2
+
+
+class Alignment(IntEnum):
+    LEFT = 0
+    CENTER = 1
+    RIGHT = 2
+
+
+class BboxFormat(IntEnum):
+    NONE = 0
+    BOXES = 1
+    TESSERACT = 2
+
+
+def _margins(margins: Union[int, Sequence[int]]) -> tuple:
+    if isinstance(margins, int):
+        return (margins,) * 4
+    margins = tuple(int(m) for m in margins)
+    if len(margins) == 1:
+        return margins * 4
+    if len(margins) != 4:
+        raise ValueError("Margins must be one or four values")
+    return margins
+
+
+class GenerationConfig(object):
+    """
+    Immutable set of the generation parameters that don't change from one
+    sample to the next, parsed once: colors are RGB tuples, margins a
+    (top, left, bottom, right) tuple and the option ints are enums.
+
+    It is sent to each worker once, so that a task only has to carry
+    (index, text, font, seed).
+    """
+
+    __slots__ = (
+        "fonts",
+        "out_dir",
+        "size",
+        "extension",
+        "skewing_angle",
+        "random_skew",
+        "blur",
+        "random_blur",
+        "background_type",
+        "distorsion_type",
+        "distorsion_orientation",
+        "is_handwritten",
+        "name_format",
+        "width",
+        "alignment",
+        "text_color",
+        "orientation",
+        "space_width",
+        "character_spacing",
+        "margins",
+        "fit",
+        "output_mask",
+        "word_split",
+        "image_dir",
+        "image_cache_bytes",
+        "image_max_height",
+        "texture_bank_size",
+        "texture_bank_dir",
+        "stroke_width",
+        "stroke_fill",
+        "image_mode",
+        "output_bboxes",
+    )
+
+    def __init__(
+        self,
+        fonts: List[str] = (),
+        out_dir: str = None,
+        size: int = 32,
+        extension: str = "jpg",
+        skewing_angle: int = 0,
+        random_skew: bool = False,
+        blur: int = 0,
+        random_blur: bool = False,
+        background_type: int = 0,
+        distorsion_type: int = 0,
+        distorsion_orientation: int = 0,
+        is_handwritten: bool = False,
+        name_format: int = 0,
+        width: int = -1,
+        alignment: int = 1,
+        text_color: str = "#282828",
+        orientation: int = 0,
+        space_width: float = 1.0,
+        character_spacing: int = 0,
+        margins: Union[int, Sequence[int]] = (5, 5, 5, 5),
+        fit: bool = False,
+        output_mask: bool = False,
+        word_split: bool = False,
+        image_dir: str = None,
+        image_cache_bytes: int = 1024 * 1024 * 1024,
+        image_max_height: int = None,
+        texture_bank_size: int = 0,
+        texture_bank_dir: str = None,
+        stroke_width: int = 0,
+        stroke_fill: str = "#282828",
+        image_mode: str = "RGB",
+        output_bboxes: int = 0,
+    ):
+        values = {
+            "fonts": tuple(fonts),
+            "out_dir": out_dir,
+            "size": int(size),
+            "extension": extension,
+            "skewing_angle": int(skewing_angle),
+            "random_skew": bool(random_skew),
+            "blur": blur,
+            "random_blur": bool(random_blur),
+            "background_type": BackgroundType(background_type),
+            "distorsion_type": DistorsionType(distorsion_type),
+            "distorsion_orientation": DistorsionOrientation(distorsion_orientation),
+            "is_handwritten": bool(is_handwritten),
+            # Unknown name formats fall back to the default when saving
+            "name_format": int(name_format),
+            "width": int(width),
+            "alignment": Alignment(alignment),
+            "text_color": parse_colors(text_color),
+            "orientation": Orientation(orientation),
+            "space_width": space_width,
+            "character_spacing": int(character_spacing),
+            "margins": _margins(margins),
+            "fit": bool(fit),
+            "output_mask": bool(output_mask),
+            "word_split": bool(word_split),
+            "image_dir": image_dir,
+            "image_cache_bytes": int(image_cache_bytes),
+            "image_max_height": (
+                int(image_max_height) if image_max_height is not None else None
+            ),
+            "texture_bank_size": int(texture_bank_size),
+            "texture_bank_dir": texture_bank_dir,
+            "stroke_width": int(stroke_width),
+            "stroke_fill": parse_colors(stroke_fill),
+            "image_mode": image_mode,
+            "output_bboxes": BboxFormat(output_bboxes),
+        }
+        self.__setstate__(values)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("GenerationConfig is immutable")
+
+    def __delattr__(self, name):
+        raise AttributeError("GenerationConfig is immutable")
+
+    def __getstate__(self) -> dict:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def __setstate__(self, state: dict) -> None:
+        for name, value in state.items():
+            object.__setattr__(self, name, value)
+
+    def __repr__(self) -> str:
+        return "GenerationConfig({})".format(
+            ", ".join(
+                "{}={!r}".format(name, getattr(self, name))
+                for name in self.__slots__
+                if name != "fonts"
+            )
+        )
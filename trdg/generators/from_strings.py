@@ -2,6 +2,7 @@ import os
 from typing import List, Tuple
 
 from trdg.data_generator import FakeTextDataGenerator
+from trdg.generation_config import GenerationConfig
 from trdg.utils import load_dict, load_fonts
 
 # support RTL
@@ -9,6 +10,37 @@ from arabic_reshaper import ArabicReshaper
 from bidi.algorithm import get_display
 
 
+# Attributes of the generator the generation config is made of, read again
+# before every sample as the generator used to
+CONFIG_ATTRIBUTES = (
+    "fonts",
+    "size",
+    "skewing_angle",
+    "random_skew",
+    "blur",
+    "random_blur",
+    "background_type",
+    "distorsion_type",
+    "distorsion_orientation",
+    "is_handwritten",
+    "width",
+    "alignment",
+    "text_color",
+    "orientation",
+    "space_width",
+    "character_spacing",
+    "margins",
+    "fit",
+    "output_mask",
+    "word_split",
+    "image_dir",
+    "stroke_width",
+    "stroke_fill",
+    "image_mode",
+    "output_bboxes",
+)
+
+
 class GeneratorFromStrings:
     """Generator that uses a given list of strings"""
 
@@ -89,6 +121,30 @@ class GeneratorFromStrings:
         self.stroke_width = stroke_width
         self.stroke_fill = stroke_fill
         self.image_mode = image_mode
+        self._config = None
+        self._config_values = None
+        # Parsed here so that invalid options raise right away
+        self._update_config()
+
+    @property
+    def config(self) -> GenerationConfig:
+        """
+        Config of the current attributes, only parsed again once one of them
+        was changed
+        """
+
+        return self._update_config()
+
+    def _update_config(self) -> GenerationConfig:
+        values = {}
+        for name in CONFIG_ATTRIBUTES:
+            value = getattr(self, name)
+            # Lists are copied, they may be changed in place
+            values[name] = tuple(value) if isinstance(value, list) else value
+        if values != self._config_values:
+            self._config = GenerationConfig(extension=None, **values)
+            self._config_values = values
+        return self._config
 
     def __iter__(self):
         return self
@@ -101,37 +157,11 @@ class GeneratorFromStrings:
             raise StopIteration
         self.generated_count += 1
         return (
-            FakeTextDataGenerator.generate(
+            FakeTextDataGenerator.generate_from_config(
                 self.generated_count,
                 self.strings[(self.generated_count - 1) % len(self.strings)],
                 self.fonts[(self.generated_count - 1) % len(self.fonts)],
-                None,
-                self.size,
-                None,
-                self.skewing_angle,
-                self.random_skew,
-                self.blur,
-                self.random_blur,
-                self.background_type,
-                self.distorsion_type,
-                self.distorsion_orientation,
-                self.is_handwritten,
-                0,
-                self.width,
-                self.alignment,
-                self.text_color,
-                self.orientation,
-                self.space_width,
-                self.character_spacing,
-                self.margins,
-                self.fit,
-                self.output_mask,
-                self.word_split,
-                self.image_dir,
-                self.stroke_width,
-                self.stroke_fill,
-                self.image_mode,
-                self.output_bboxes,
+                self.config,
             ),
             self.orig_strings[(self.generated_count - 1) % len(self.orig_strings)]
             if self.rtl
@@ -0,0 +1,168 @@
+"""
+Rotation, distortion and resize of the text image in one resampling pass
+"""
+
+import math
+from typing import List, Tuple
+
+import cv2
+import numpy as np
+from PIL import Image
+
+from trdg.distorsion_generator import DisplacementField
+
+# Most source pixels averaged per output pixel and axis when shrinking
+MAX_SUPERSAMPLING = 4
+
+# cv2.remap only takes images smaller than this on both axes
+MAX_SOURCE_SIZE = 32767
+
+
+def rotation(size: Tuple[int, int], angle: float) -> Tuple[List[float], Tuple[int, int]]:
+    """
+    Affine matrix from the rotated image back to the original one and the
+    size of the rotated image, as Image.rotate(angle, expand=1) computes them.
+    The matrix is None when there is no rotation.
+    """
+
+    if angle % 360 == 0:
+        return None, size
+
+    width, height = size
+    angle_degrees = angle
+    angle = -math.radians(angle % 360)
+    a = round(math.cos(angle), 15)
+    b = round(math.sin(angle), 15)
+    matrix = [a, b, 0.0, -b, a, 0.0]
+
+    def transform(x, y):
+        return (
+            matrix[0] * x + matrix[1] * y + matrix[2],
+            matrix[3] * x + matrix[4] * y + matrix[5],
+        )
+
+    center_x, center_y = width / 2.0, height / 2.0
+    matrix[2], matrix[5] = transform(-center_x, -center_y)
+    matrix[2] += center_x
+    matrix[5] += center_y
+
+    corners = [transform(x, y) for x, y in ((0, 0), (width, 0), (width, height), (0, height))]
+    new_width = math.ceil(max(x for x, _ in corners)) - math.floor(
+        min(x for x, _ in corners)
+    )
+    new_height = math.ceil(max(y for _, y in corners)) - math.floor(
+        min(y for _, y in corners)
+    )
+    # Pillow transposes these instead, the rounding of the corners would add
+    # a pixel on both axes
+    if angle_degrees % 360 in (90, 270):
+        new_width, new_height = height, width
+    matrix[2], matrix[5] = transform(
+        -(new_width - width) / 2.0, -(new_height - height) / 2.0
+    )
+
+    return matrix, (new_width, new_height)
+
+
+def _source_coordinates(
+    us: np.ndarray,
+    vs: np.ndarray,
+    scale: Tuple[float, float],
+    field: DisplacementField,
+    matrix: List[float],
+) -> Tuple:
+    """
+    Coordinates in the original image of points of the resized image, and
+    whether the distortion gives them a source
+    """
+
+    xs = us * scale[0]
+    ys = vs * scale[1]
+    valid = True
+    if field is not None:
+        xs, ys, valid = field.source(xs, ys)
+    if matrix is not None:
+        xs, ys = (
+            matrix[0] * xs + matrix[1] * ys + matrix[2],
+            matrix[3] * xs + matrix[4] * ys + matrix[5],
+        )
+    return xs, ys, valid
+
+
+def warp(
+    image: Image,
+    mask: Image,
+    matrix: List[float],
+    field: DisplacementField,
+    size: Tuple[int, int],
+    new_size: Tuple[int, int],
+) -> Tuple:
+    """
+    Resample the text image and its optional label mask to new_size as if they
+    were rotated with matrix, then distorted with field into an image of size,
+    then resized. The image is interpolated once, averaging several points per
+    pixel when it shrinks, and the mask takes its nearest labels.
+    """
+
+    if matrix is None and field is None:
+        return (
+            image.resize(new_size, Image.Resampling.LANCZOS),
+            mask.resize(new_size, Image.Resampling.NEAREST) if mask is not None else None,
+        )
+
+    new_width, new_height = new_size
+    scale = (size[0] / new_width, size[1] / new_height)
+
+    # Shrinking averages a grid of points per pixel: the map is made at that
+    # finer resolution and the result reduced by area
+    samples = min(MAX_SUPERSAMPLING, max(1, math.ceil(max(scale))))
+    xs, ys, valid = _source_coordinates(
+        (np.arange(new_width * samples, dtype=np.float32)[None, :] + 0.5) / samples,
+        (np.arange(new_height * samples, dtype=np.float32)[:, None] + 0.5) / samples,
+        scale,
+        field,
+        matrix,
+    )
+    # Points without a source are sent outside of the image, cv2 puts pixel
+    # centers on whole coordinates
+    map_x = np.where(valid, xs - 0.5, -2).astype(np.float32)
+    map_y = np.where(valid, ys - 0.5, -2).astype(np.float32)
+    # Alpha is premultiplied so that transparent pixels don't darken the edges,
+    # grayscale text keeps its two bands
+    mode = "LA" if image.mode == "LA" else "RGBA"
+    premultiplied = "La" if mode == "LA" else "RGBa"
+    new_img_arr = cv2.remap(
+        np.asarray(image.convert(premultiplied)),
+        map_x,
+        map_y,
+        cv2.INTER_LINEAR,
+        borderMode=cv2.BORDER_CONSTANT,
+        borderValue=0,
+    )
+    if samples > 1:
+        new_img_arr = cv2.resize(new_img_arr, new_size, interpolation=cv2.INTER_AREA)
+    new_img = Image.frombytes(premultiplied, new_size, new_img_arr.tobytes()).convert(
+        mode
+    )
+
+    new_mask = None
+    if mask is not None:
+        mask_arr = np.asarray(mask)
+        height, width = mask_arr.shape[:2]
+        xs, ys, valid = _source_coordinates(
+            np.arange(new_width, dtype=np.float64)[None, :] + 0.5,
+            np.arange(new_height, dtype=np.float64)[:, None] + 0.5,
+            scale,
+            field,
+            matrix,
+        )
+        columns = np.floor(xs).astype(np.intp)
+        rows = np.floor(ys).astype(np.intp)
+        valid = valid & (columns >= 0) & (columns < width) & (rows >= 0) & (rows < height)
+        flat = mask_arr.reshape((height * width, -1) if mask_arr.ndim == 3 else -1)
+        flat = np.concatenate((flat, np.zeros_like(flat[:1])))
+        new_mask = Image.fromarray(
+            np.take(flat, np.where(valid, rows * width + columns, height * width), axis=0)
+        )
+
+    return new_img, new_mask
@@ -0,0 +1,278 @@
+"""
+Glyph rasterization and blending with NumPy, and a glyph bitmap atlas
+"""
+
+import weakref
+from functools import partial
+from typing import Tuple
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont
+
+
+def _div255(a: np.ndarray) -> np.ndarray:
+    # Same rounding as Pillow's DIV255 so that we match ImageDraw exactly
+    a = a + 128
+    return ((a >> 8) + a) >> 8
+
+
+def blend_bitmap(
+    arr: np.ndarray, xy: Tuple[int, int], bitmap: np.ndarray, ink: Tuple
+) -> None:
+    """
+    Blend a glyph bitmap of coverage values into an image array in place, the
+    same way ImageDraw does when it draws text
+    """
+
+    x, y = xy
+    height, width = arr.shape[:2]
+    x0, y0 = max(x, 0), max(y, 0)
+    x1, y1 = min(x + bitmap.shape[1], width), min(y + bitmap.shape[0], height)
+    if x1 <= x0 or y1 <= y0:
+        return
+
+    region = arr[y0:y1, x0:x1]
+    coverage = bitmap[y0 - y : y1 - y, x0 - x : x1 - x].astype(np.int32)
+    if not coverage.any():
+        return
+    out = region.astype(np.int32)
+
+    channels = out.shape[2] if out.ndim == 3 else 1
+    if channels == 1:
+        out = out[..., np.newaxis]
+    color_coverage = coverage
+    if channels in (2, 4):
+        # Color is fully replaced where the destination is still transparent
+        color_coverage = np.where(
+            (coverage != 0) & (out[..., -1] == 0), 255, coverage
+        )
+
+    for i in range(channels):
+        c = coverage if channels in (2, 4) and i == channels - 1 else color_coverage
+        out[..., i] = _div255(out[..., i] * (255 - c) + ink[i] * c)
+
+    region[...] = out.reshape(region.shape)
+
+
+def rasterize(
+    image_font: ImageFont, text: str, stroke_width: int = 0, fontmode: str = "L"
+) -> Tuple[np.ndarray, int, int]:
+    """
+    Coverage bitmap of a text and its offset from the drawing position. With a
+    stroke, the bitmap covers the stroke and the glyphs inside of it.
+    """
+
+    left, top, right, bottom = image_font.getbbox(
+        text, fontmode, stroke_width=stroke_width
+    )
+    canvas = Image.new("L", (max(right - left, 0), max(bottom - top, 0)), 0)
+    if canvas.width > 0 and canvas.height > 0:
+        draw = ImageDraw.Draw(canvas)
+        draw.fontmode = fontmode
+        draw.text(
+            (-left, -top),
+            text,
+            fill=255,
+            font=image_font,
+            stroke_width=stroke_width,
+            stroke_fill=255,
+        )
+    return np.asarray(canvas), left, top
+
+
+def ink_box(
+    bitmap: np.ndarray, left: int, top: int
+) -> Tuple[int, int, int, int]:
+    """
+    Box (left, top, right, bottom) of the non-zero pixels of a bitmap drawn at
+    offset (left, top), None when it has none
+    """
+
+    rows = np.flatnonzero(bitmap.any(axis=1))
+    if len(rows) == 0:
+        return None
+    columns = np.flatnonzero(bitmap.any(axis=0))
+    return (
+        left + int(columns[0]),
+        top + int(rows[0]),
+        left + int(columns[-1]) + 1,
+        top + int(rows[-1]) + 1,
+    )
+
+
+def draw_text_and_label(
+    arr: np.ndarray,
+    label_arr: np.ndarray,
+    xy: Tuple[int, int],
+    text: str,
+    image_font: ImageFont,
+    fill: Tuple,
+    label: Tuple,
+    stroke_width: int = 0,
+    stroke_fill: Tuple = None,
+) -> None:
+    """
+    Draw a text into an image array like ImageDraw.text and write label into
+    label_arr on every pixel the text touches, rasterizing the text only once.
+    Without label_arr only the text is drawn.
+    """
+
+    channels = arr.shape[2] if arr.ndim == 3 else 1
+    ink = _ink(fill, channels)
+    x, y = xy
+
+    if stroke_width:
+        stroke_ink = ink if stroke_fill is None else _ink(stroke_fill, channels)
+        # The stroke covers the glyphs, it is mostly what the label follows
+        bitmap, left, top = rasterize(image_font, text, stroke_width)
+        blend_bitmap(arr, (x + left, y + top), bitmap, stroke_ink)
+        if ink != stroke_ink:
+            fill_bitmap, fill_left, fill_top = rasterize(image_font, text)
+            blend_bitmap(arr, (x + fill_left, y + fill_top), fill_bitmap, ink)
+            # Some marks reach outside of their stroke
+            _fill_label(label_arr, (x + fill_left, y + fill_top), fill_bitmap, label)
+    else:
+        bitmap, left, top = rasterize(image_font, text)
+        blend_bitmap(arr, (x + left, y + top), bitmap, ink)
+
+    _fill_label(label_arr, (x + left, y + top), bitmap, label)
+
+
+def _fill_label(
+    label_arr: np.ndarray, xy: Tuple[int, int], bitmap: np.ndarray, label: Tuple
+) -> None:
+    if label_arr is None:
+        return
+
+    x, y = xy
+    height, width = label_arr.shape[:2]
+    x0, y0 = max(x, 0), max(y, 0)
+    x1, y1 = min(x + bitmap.shape[1], width), min(y + bitmap.shape[0], height)
+    if x1 <= x0 or y1 <= y0:
+        return
+
+    channels = label_arr.shape[2] if label_arr.ndim == 3 else 1
+    label = _ink(label, channels)
+    covered = bitmap[y0 - y : y1 - y, x0 - x : x1 - x] != 0
+    label_arr[y0:y1, x0:x1][covered] = label if label_arr.ndim == 3 else label[0]
+
+
+class GlyphAtlas(object):
+    """
+    Coverage bitmaps of the glyphs of one font at one size, rasterized by
+    FreeType once per (character, stroke width, font mode).
+    """
+
+    def __init__(self, image_font: ImageFont):
+        self.image_font = image_font
+        self.hits = 0
+        self.misses = 0
+        self._glyphs = {}
+        # (text, stroke width, font mode) -> box of its ink
+        self._ink_boxes = {}
+
+    def __len__(self) -> int:
+        return len(self._glyphs)
+
+    def get(
+        self, char: str, stroke_width: int = 0, fontmode: str = "L"
+    ) -> Tuple[np.ndarray, int, int]:
+        """
+        Bitmap of a character and its offset from the drawing position. With a
+        stroke, the bitmap covers the stroke and the glyph inside of it.
+        """
+
+        key = (char, stroke_width, fontmode)
+        glyph = self._glyphs.get(key)
+        if glyph is not None:
+            self.hits += 1
+            return glyph
+
+        self.misses += 1
+        glyph = rasterize(self.image_font, char, stroke_width, fontmode)
+        self._glyphs[key] = glyph
+        return glyph
+
+    def ink_box(
+        self, text: str, stroke_width: int = 0, fontmode: str = "L"
+    ) -> Tuple[int, int, int, int]:
+        """
+        Box (left, top, right, bottom) of the pixels drawing text touches, from
+        the drawing position, None for text without ink like spaces. Only the
+        bitmaps of single characters are kept, the boxes of every text are.
+        """
+
+        key = (text, stroke_width, fontmode)
+        if key in self._ink_boxes:
+            return self._ink_boxes[key]
+
+        raster = self.get if len(text) == 1 else partial(rasterize, self.image_font)
+        box = ink_box(*raster(text, 0, fontmode))
+        if stroke_width:
+            # Some marks reach outside of their stroke
+            stroke_box = ink_box(*raster(text, stroke_width, fontmode))
+            if box is None or stroke_box is None:
+                box = box or stroke_box
+            else:
+                box = (
+                    min(box[0], stroke_box[0]),
+                    min(box[1], stroke_box[1]),
+                    max(box[2], stroke_box[2]),
+                    max(box[3], stroke_box[3]),
+                )
+        self._ink_boxes[key] = box
+        return box
+
+    def draw(
+        self,
+        arr: np.ndarray,
+        xy: Tuple[int, int],
+        char: str,
+        fill: Tuple,
+        stroke_width: int = 0,
+        stroke_fill: Tuple = None,
+        fontmode: str = "L",
+    ) -> None:
+        """
+        Draw a character into an image array, equivalent to ImageDraw.text
+        """
+
+        channels = arr.shape[2] if arr.ndim == 3 else 1
+        ink = _ink(fill, channels)
+        x, y = xy
+        if stroke_width:
+            stroke_ink = ink if stroke_fill is None else _ink(stroke_fill, channels)
+            bitmap, left, top = self.get(char, stroke_width, fontmode)
+            blend_bitmap(arr, (x + left, y + top), bitmap, stroke_ink)
+            if ink == stroke_ink:
+                return
+        bitmap, left, top = self.get(char, 0, fontmode)
+        blend_bitmap(arr, (x + left, y + top), bitmap, ink)
+
+
+def _ink(color: Tuple, channels: int) -> Tuple:
+    if isinstance(color, int):
+        color = (color,)
+    if channels in (1, 2):
+        # Same luma transform as ImageDraw for RGB colors on L images
+        if len(color) >= 3:
+            luma = (color[0] * 299 + color[1] * 587 + color[2] * 114) // 1000
+            color = (luma,) + tuple(color[3:])
+    if len(color) < channels:
+        color = tuple(color) + (255,)
+    return tuple(color[:channels])
+
+
+_atlases = weakref.WeakKeyDictionary()
+
+
+def get_glyph_atlas(image_font: ImageFont) -> GlyphAtlas:
+    """
+    Get the glyph atlas of a font, it lives as long as the font object does
+    """
+
+    atlas = _atlases.get(image_font)
+    if atlas is None:
+        atlas = GlyphAtlas(image_font)
+        _atlases[image_font] = atlas
+    return atlas
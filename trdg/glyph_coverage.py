@@ -0,0 +1,169 @@
+"""
+Character coverage of fonts, read from their cmap table
+"""
+
+import bisect
+import struct
+from typing import Dict, Iterable, List, Tuple
+
+# (platform id, encoding id) of the cmap subtables that map Unicode code points
+UNICODE_ENCODINGS = {(0, 0), (0, 1), (0, 2), (0, 3), (0, 4), (0, 6), (3, 1), (3, 10)}
+
+
+def _sfnt_offset(data: bytes) -> int:
+    # Font collections start with a header pointing to each font, we use the first
+    if data[:4] == b"ttcf":
+        return struct.unpack_from(">I", data, 12)[0]
+    return 0
+
+
+def _find_table(data: bytes, tag: bytes) -> int:
+    offset = _sfnt_offset(data)
+    num_tables = struct.unpack_from(">H", data, offset + 4)[0]
+    for i in range(num_tables):
+        record = offset + 12 + 16 * i
+        if data[record : record + 4] == tag:
+            return struct.unpack_from(">I", data, record + 8)[0]
+    raise ValueError("Font has no {} table".format(tag.decode("ascii")))
+
+
+def _read_format_0(data: bytes, offset: int) -> Iterable[int]:
+    glyphs = data[offset + 6 : offset + 6 + 256]
+    return [c for c, g in enumerate(glyphs) if g != 0]
+
+
+def _read_format_4(data: bytes, offset: int) -> Iterable[int]:
+    seg_count = struct.unpack_from(">H", data, offset + 6)[0] // 2
+    end_codes = struct.unpack_from(">{}H".format(seg_count), data, offset + 14)
+    start_codes_offset = offset + 16 + 2 * seg_count
+    start_codes = struct.unpack_from(">{}H".format(seg_count), data, start_codes_offset)
+    id_deltas = struct.unpack_from(
+        ">{}h".format(seg_count), data, start_codes_offset + 2 * seg_count
+    )
+    id_range_offsets_offset = start_codes_offset + 4 * seg_count
+    id_range_offsets = struct.unpack_from(
+        ">{}H".format(seg_count), data, id_range_offsets_offset
+    )
+
+    codes = []
+    for i in range(seg_count):
+        start, end = start_codes[i], end_codes[i]
+        if start == 0xFFFF:
+            continue
+        if id_range_offsets[i] == 0:
+            codes.extend(c for c in range(start, end + 1) if (c + id_deltas[i]) & 0xFFFF)
+            continue
+        glyph_ids_offset = id_range_offsets_offset + 2 * i + id_range_offsets[i]
+        for c in range(start, end + 1):
+            glyph_offset = glyph_ids_offset + 2 * (c - start)
+            if glyph_offset + 2 > len(data):
+                break
+            glyph = struct.unpack_from(">H", data, glyph_offset)[0]
+            if glyph and (glyph + id_deltas[i]) & 0xFFFF:
+                codes.append(c)
+    return codes
+
+
+def _read_format_6(data: bytes, offset: int) -> Iterable[int]:
+    first_code, entry_count = struct.unpack_from(">HH", data, offset + 6)
+    glyphs = struct.unpack_from(">{}H".format(entry_count), data, offset + 10)
+    return [first_code + i for i, g in enumerate(glyphs) if g != 0]
+
+
+def _read_format_12(data: bytes, offset: int, many_to_one: bool) -> Iterable[int]:
+    num_groups = struct.unpack_from(">I", data, offset + 12)[0]
+    codes = []
+    for i in range(num_groups):
+        start, end, glyph = struct.unpack_from(">III", data, offset + 16 + 12 * i)
+        if glyph == 0:
+            if many_to_one:
+                continue
+            start += 1
+        codes.append(range(start, end + 1))
+    return [c for r in codes for c in r]
+
+
+def read_cmap(font_bytes: bytes) -> List[Tuple[int, int]]:
+    """
+    Read the Unicode code points a font has a glyph for, as sorted inclusive
+    (start, end) ranges
+    """
+
+    cmap_offset = _find_table(font_bytes, b"cmap")
+    num_subtables = struct.unpack_from(">H", font_bytes, cmap_offset + 2)[0]
+
+    codes = set()
+    for i in range(num_subtables):
+        platform_id, encoding_id, subtable_offset = struct.unpack_from(
+            ">HHI", font_bytes, cmap_offset + 4 + 8 * i
+        )
+        if (platform_id, encoding_id) not in UNICODE_ENCODINGS:
+            continue
+        offset = cmap_offset + subtable_offset
+        subtable_format = struct.unpack_from(">H", font_bytes, offset)[0]
+        if subtable_format == 0:
+            codes.update(_read_format_0(font_bytes, offset))
+        elif subtable_format == 4:
+            codes.update(_read_format_4(font_bytes, offset))
+        elif subtable_format == 6:
+            codes.update(_read_format_6(font_bytes, offset))
+        elif subtable_format in (12, 13):
+            codes.update(_read_format_12(font_bytes, offset, subtable_format == 13))
+
+    return codes_to_ranges(codes)
+
+
+def codes_to_ranges(codes: Iterable[int]) -> List[Tuple[int, int]]:
+    """
+    Compress a set of code points to sorted inclusive (start, end) ranges
+    """
+
+    ranges = []
+    for c in sorted(codes):
+        if ranges and ranges[-1][1] == c - 1:
+            ranges[-1][1] = c
+        else:
+            ranges.append([c, c])
+    return [tuple(r) for r in ranges]
+
+
+class GlyphCoverageIndex(object):
+    """
+    Inverted index from a character to the fonts that have a glyph for it.
+
+    Each character maps to a bitmask over the fonts, so the fonts able to render
+    a whole string are the AND of the masks of its characters. Masks are built
+    from the per-font cmap ranges the first time a character is looked up.
+    """
+
+    def __init__(self, fonts: List[str], coverages: List[List[Tuple[int, int]]]):
+        self.fonts = fonts
+        self._starts = [[r[0] for r in ranges] for ranges in coverages]
+        self._ends = [[r[1] for r in ranges] for ranges in coverages]
+        self._masks: Dict[str, int] = {}
+
+    def _mask(self, char: str) -> int:
+        mask = self._masks.get(char)
+        if mask is None:
+            code = ord(char)
+            mask = 0
+            for i, (starts, ends) in enumerate(zip(self._starts, self._ends)):
+                j = bisect.bisect_right(starts, code) - 1
+                if j >= 0 and code <= ends[j]:
+                    mask |= 1 << i
+            self._masks[char] = mask
+        return mask
+
+    def fonts_for_text(self, text: str) -> List[str]:
+        """
+        Fonts that have a glyph for every non-whitespace character of text
+        """
+
+        mask = (1 << len(self.fonts)) - 1
+        for char in set(text):
+            if char.isspace():
+                continue
+            mask &= self._mask(char)
+            if mask == 0:
+                return []
+        return [f for i, f in enumerate(self.fonts) if mask >> i & 1]
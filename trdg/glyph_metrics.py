@@ -0,0 +1,99 @@
+"""
+Per-font glyph metrics tables used to lay out whole strings at once
+"""
+
+import weakref
+from typing import Iterable
+
+import numpy as np
+from PIL import ImageFont
+
+
+class GlyphMetrics(object):
+    """
+    Advance widths and bottoms of the glyphs of one font at one size, the
+    bottoms giving the height of a line.
+
+    The tables are NumPy arrays indexed by code point, filled with FreeType the
+    first time a character is seen, so laying out a string is a single fancy
+    indexing operation once its characters are known.
+    """
+
+    def __init__(self, image_font: ImageFont, zero_width_chars: Iterable[str] = ()):
+        self.image_font = image_font
+        self._zero_width_chars = set(zero_width_chars)
+        self._known = np.zeros(0, dtype=bool)
+        self._advance = np.zeros(0, dtype=np.int32)
+        self._bottom = np.zeros(0, dtype=np.int32)
+        self._zero_width = np.zeros(0, dtype=bool)
+
+    def _grow(self, size: int) -> None:
+        # Over-allocate so that a script block only triggers a few reallocations
+        size = max(size, 2 * len(self._known), 256)
+        for name in (
+            "_known",
+            "_advance",
+            "_bottom",
+            "_zero_width",
+        ):
+            old = getattr(self, name)
+            new = np.zeros(size, dtype=old.dtype)
+            new[: len(old)] = old
+            setattr(self, name, new)
+
+    def codes(self, text: str) -> np.ndarray:
+        """
+        Code points of text, with the metrics of all of them loaded
+        """
+
+        codes = np.frombuffer(text.encode("utf-32-le"), dtype=np.uint32).astype(
+            np.intp
+        )
+        if len(codes) == 0:
+            return codes
+
+        max_code = codes.max()
+        if max_code >= len(self._known):
+            self._grow(max_code + 1)
+
+        for code in np.unique(codes[~self._known[codes]]):
+            char = chr(code)
+            # Casting as int to preserve the old behavior
+            self._advance[code] = round(self.image_font.getlength(char))
+            self._bottom[code] = self.image_font.getbbox(char)[3]
+            self._zero_width[code] = char in self._zero_width_chars
+            self._known[code] = True
+
+        return codes
+
+    def advances(self, text: str) -> np.ndarray:
+        """Advance width of each character"""
+        codes = self.codes(text)
+        return self._advance[codes]
+
+    def widths(self, text: str) -> np.ndarray:
+        """Advance width of each character, zero for combining marks"""
+        codes = self.codes(text)
+        return np.where(self._zero_width[codes], 0, self._advance[codes])
+
+    def bottoms(self, text: str) -> np.ndarray:
+        """Bottom of the bounding box of each character"""
+        codes = self.codes(text)
+        return self._bottom[codes]
+
+
+_metrics = weakref.WeakKeyDictionary()
+
+
+def get_glyph_metrics(
+    image_font: ImageFont, zero_width_chars: Iterable[str] = ()
+) -> GlyphMetrics:
+    """
+    Get the metrics table of a font, it lives as long as the font object does
+    """
+
+    metrics = _metrics.get(image_font)
+    if metrics is None:
+        metrics = GlyphMetrics(image_font, zero_width_chars)
+        _metrics[image_font] = metrics
+    return metrics
@@ -7,10 +7,12 @@ import matplotlib.pyplot as plt
 import matplotlib.cm as cm
 import matplotlib.mlab as mlab
 import seaborn
-from PIL import Image, ImageColor
+from PIL import Image
 from collections import namedtuple
 import warnings
 
+from trdg.utils import parse_colors
+
 warnings.filterwarnings("ignore")
 
 
@@ -193,7 +195,7 @@ def generate(text, text_color):
             sess, os.path.join(cd, os.path.join("handwritten_model/model-29"))
         )
         images = []
-        colors = [ImageColor.getrgb(c) for c in text_color.split(",")]
+        colors = parse_colors(text_color)
         c1, c2 = colors[0], colors[-1]
 
         color = "#{:02x}{:02x}{:02x}".format(
@@ -0,0 +1,210 @@
+"""
+Process-wide cache of decoded background images
+"""
+
+import os
+from collections import OrderedDict
+from typing import Dict, List, Tuple
+
+from PIL import Image
+
+# Scales JPEG images can be decoded at, as reduction factors
+JPEG_REDUCTIONS = (8, 4, 2)
+# Files of an image directory that are taken for images
+IMAGE_EXTENSIONS = (".bmp", ".gif", ".jpeg", ".jpg", ".png", ".tif", ".tiff", ".webp")
+
+
+def _image_nbytes(image: Image) -> int:
+    # 32 bit modes aside, every band is one byte per pixel
+    return (
+        image.width
+        * image.height
+        * len(image.getbands())
+        * (4 if image.mode in ("I", "F") else 1)
+    )
+
+
+class ImageCache(object):
+    """
+    LRU cache of decoded images keyed by path and decoding scale, bounded by
+    the number of bytes of pixel data it keeps. JPEG images asked for with a
+    minimum size are decoded straight at the smallest scale that covers it.
+    With max_height, taller images are reduced to that height once when they
+    are loaded, backgrounds only ever use a strip of them.
+
+    It also keeps the listing of the images of the image directories, listed
+    again when their modification time changes.
+    """
+
+    def __init__(self, max_bytes: int = 1024 * 1024 * 1024, max_height: int = None):
+        self.max_bytes = max_bytes
+        self.max_height = max_height
+        self.hits = 0
+        self.misses = 0
+        # (path, reduction factor) -> image
+        self._images = OrderedDict()
+        self._nbytes = 0
+        # path -> (width, height, format) read from the header
+        self._headers = {}
+        # directory -> (modification time, names)
+        self._listings = {}
+
+    def __len__(self) -> int:
+        return len(self._images)
+
+    @property
+    def nbytes(self) -> int:
+        """Number of bytes of decoded pixels held by the cache"""
+        return self._nbytes
+
+    def get(self, path: str, min_size: Tuple[int, int] = None) -> Image:
+        """
+        Return the decoded image at path, loading it if necessary. With
+        min_size (width, height), a JPEG is decoded at 1/2, 1/4 or 1/8 of its
+        size when that still covers min_size, unless a larger copy is already
+        decoded. The image is shared and must not be modified in place.
+        """
+
+        reduction = self._reduction(path, min_size) if min_size is not None else 1
+        for cached_reduction in JPEG_REDUCTIONS + (1,):
+            if cached_reduction > reduction:
+                continue
+            key = (path, cached_reduction)
+            image = self._images.get(key)
+            if image is not None:
+                self.hits += 1
+                self._images.move_to_end(key)
+                return image
+
+        self.misses += 1
+        key = (path, reduction)
+        image = self._load(path, reduction)
+        self._images[key] = image
+        self._nbytes += _image_nbytes(image)
+        self._evict(key)
+
+        return image
+
+    def list_dir(self, image_dir: str) -> List[str]:
+        """
+        Names of the image files of image_dir, by extension, only listed
+        again once the directory was modified
+        """
+
+        mtime = os.stat(image_dir).st_mtime_ns
+        listing = self._listings.get(image_dir)
+        if listing is None or listing[0] != mtime:
+            names = [
+                name
+                for name in os.listdir(image_dir)
+                if name.lower().endswith(IMAGE_EXTENSIONS)
+            ]
+            listing = (mtime, names)
+            self._listings[image_dir] = listing
+        return listing[1]
+
+    def preload(self, image_dir: str) -> int:
+        """
+        Decode the images of a directory until the budget is used, returns the
+        number of images held
+        """
+
+        for name in self.list_dir(image_dir):
+            path = os.path.join(image_dir, name)
+            if (path, 1) in self._images:
+                continue
+            try:
+                image = self._load(path)
+            except OSError:
+                continue
+            nbytes = _image_nbytes(image)
+            if self._nbytes + nbytes > self.max_bytes:
+                break
+            self._images[(path, 1)] = image
+            self._nbytes += nbytes
+        return len(self._images)
+
+    def clear(self) -> None:
+        self._images.clear()
+        self._headers.clear()
+        self._listings.clear()
+        self._nbytes = 0
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "entries": len(self._images),
+            "bytes": self._nbytes,
+        }
+
+    def _reduction(self, path: str, min_size: Tuple[int, int]) -> int:
+        header = self._headers.get(path)
+        if header is None:
+            with Image.open(path) as image:
+                header = (image.width, image.height, image.format)
+            self._headers[path] = header
+        width, height, image_format = header
+        if image_format == "JPEG":
+            for reduction in JPEG_REDUCTIONS:
+                if width // reduction >= min_size[0] and height // reduction >= min_size[1]:
+                    return reduction
+        return 1
+
+    def _load(self, path: str, reduction: int = 1) -> Image:
+        image = Image.open(path)
+        height = image.height // reduction
+        if self.max_height is not None:
+            height = min(height, self.max_height)
+        if height < image.height:
+            # Only JPEG decoders can, they pick the smallest scale at least as
+            # large as asked
+            image.draft(image.mode, (image.width * height // image.height, height))
+        image.load()
+        if self.max_height is not None and image.height > self.max_height:
+            image = image.resize(
+                (
+                    max(1, round(image.width * self.max_height / image.height)),
+                    self.max_height,
+                ),
+                Image.Resampling.LANCZOS,
+            )
+        return image
+
+    def _evict(self, keep: Tuple[str, int]) -> None:
+        while len(self._images) > 1 and self._nbytes > self.max_bytes:
+            key = next(iter(self._images))
+            if key == keep:
+                break
+            self._nbytes -= _image_nbytes(self._images.pop(key))
+
+
+_image_cache = ImageCache()
+
+
+def get_image(path: str, min_size: Tuple[int, int] = None) -> Image:
+    """
+    Get a decoded image from the process-wide image cache
+    """
+    return _image_cache.get(path, min_size)
+
+
+def decode_image(path: str) -> Image:
+    """
+    Decode an image as the process-wide cache does, without keeping it there
+    """
+    return _image_cache._load(path)
+
+
+def list_images(image_dir: str) -> List[str]:
+    """
+    Names of the image files of an image directory, from the process-wide cache
+    """
+    return _image_cache.list_dir(image_dir)
+
+
+def image_cache_stats() -> Dict[str, int]:
+    """
+    Hit/miss counters and occupancy of the process-wide image cache
+    """
+    return _image_cache.stats()
@@ -8,18 +8,23 @@ sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
 import random as rnd
 import string
 import sys
-from multiprocessing import Pool
+import time
+from collections import Counter
+from multiprocessing import Pool, Queue
+from queue import Empty
 
 from tqdm import tqdm
 
-from trdg.data_generator import FakeTextDataGenerator
+from trdg.generation_config import GenerationConfig
 from trdg.string_generator import (
     create_strings_from_dict,
     create_strings_from_file,
     create_strings_from_wikipedia,
     create_strings_randomly,
 )
+from trdg.font_registry import get_font_registry
 from trdg.utils import load_dict, load_fonts
+from trdg.worker import generate_task, init_worker
 
 
 def margins(margin):
@@ -29,6 +34,61 @@ def margins(margin):
     return [int(m) for m in margins]
 
 
+def collect_warmups(warmup_queue, worker_count, timeout=1.0):
+    """
+    Warm-up entries of the workers that are done warming up. Workers still
+    starting never report, so we stop waiting after timeout.
+    """
+
+    warmups = []
+    for _ in range(worker_count):
+        try:
+            warmups.append(warmup_queue.get(timeout=timeout))
+        except Empty:
+            break
+    return warmups
+
+
+def report_throughput(warmups, done_times):
+    """
+    Print the worker warm-up time apart from the throughput once all the
+    workers that reported were warm
+    """
+
+    warm = 0
+    if warmups:
+        durations = [end - start for _, start, end in warmups]
+        print(
+            "Worker warm-up: {:.2f}s mean, {:.2f}s max over {} workers".format(
+                sum(durations) / len(durations), max(durations), len(durations)
+            )
+        )
+        warm = max(end for _, _, end in warmups)
+
+    steady = [t for t in done_times if t > warm]
+    if len(steady) > 1:
+        print(
+            "Steady state: {:.1f} samples/s over {} samples".format(
+                (len(steady) - 1) / (steady[-1] - steady[0]), len(steady)
+            )
+        )
+
+
+def report_rejections(rejections, attempts):
+    """
+    Print how many of the attempts were rejected, by cause
+    """
+
+    rejected = sum(rejections.values())
+    print(
+        "Rejected {} of {} samples generated ({:.1%})".format(
+            rejected, attempts, rejected / attempts if attempts else 0
+        )
+    )
+    for cause, count in rejections.most_common():
+        print("  {}: {} ({:.1%})".format(cause, count, count / attempts))
+
+
 def parse_arguments():
     """
     Parse the command line arguments of the program.
@@ -300,6 +360,38 @@ def parse_arguments():
         help="Define an image directory to use when background is set to image",
         default=os.path.join(os.path.split(os.path.realpath(__file__))[0], "images"),
     )
+    parser.add_argument(
+        "-icm",
+        "--image_cache_mb",
+        type=int,
+        nargs="?",
+        help="Define how many megabytes of decoded background images each process keeps",
+        default=1024,
+    )
+    parser.add_argument(
+        "-imh",
+        "--image_max_height",
+        type=int,
+        nargs="?",
+        help="Reduce the background images taller than this height once when they are loaded",
+        default=None,
+    )
+    parser.add_argument(
+        "-tbs",
+        "--texture_bank_size",
+        type=int,
+        nargs="?",
+        help="Define how many textures or background images each process cuts the backgrounds from, 0 makes every background",
+        default=0,
+    )
+    parser.add_argument(
+        "-tbd",
+        "--texture_bank_dir",
+        type=str,
+        nargs="?",
+        help="Define a directory where the bank textures are saved once and memory-mapped by every process",
+        default=None,
+    )
     parser.add_argument(
         "-ca",
         "--case",
@@ -352,12 +444,15 @@ def main():
     # Argument parsing
     args = parse_arguments()
 
-    # Create the directory if it does not exist.
-    try:
-        os.makedirs(args.output_dir)
-    except OSError as e:
-        if e.errno != errno.EEXIST:
-            raise
+    # Create the directories if they do not exist.
+    for directory in (args.output_dir, args.texture_bank_dir):
+        if directory is None:
+            continue
+        try:
+            os.makedirs(directory)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
 
     # Creating word list
     if args.dict:
@@ -374,11 +469,7 @@ def main():
 
     # Create font (path) list
     if args.font_dir:
-        fonts = [
-            os.path.join(args.font_dir, p)
-            for p in os.listdir(args.font_dir)
-            if os.path.splitext(p)[1] == ".ttf"
-        ]
+        fonts = get_font_registry(args.font_dir).fonts
     elif args.font:
         if os.path.isfile(args.font):
             fonts = [args.font]
@@ -434,54 +525,95 @@ def main():
 
     string_count = len(strings)
 
-    p = Pool(args.thread_count)
-    for _ in tqdm(
-        p.imap_unordered(
-            FakeTextDataGenerator.generate_from_tuple,
-            zip(
-                [i for i in range(0, string_count)],
-                strings,
-                [fonts[rnd.randrange(0, len(fonts))] for _ in range(0, string_count)],
-                [args.output_dir] * string_count,
-                [args.format] * string_count,
-                [args.extension] * string_count,
-                [args.skew_angle] * string_count,
-                [args.random_skew] * string_count,
-                [args.blur] * string_count,
-                [args.random_blur] * string_count,
-                [args.background] * string_count,
-                [args.distorsion] * string_count,
-                [args.distorsion_orientation] * string_count,
-                [args.handwritten] * string_count,
-                [args.name_format] * string_count,
-                [args.width] * string_count,
-                [args.alignment] * string_count,
-                [args.text_color] * string_count,
-                [args.orientation] * string_count,
-                [args.space_width] * string_count,
-                [args.character_spacing] * string_count,
-                [args.margins] * string_count,
-                [args.fit] * string_count,
-                [args.output_mask] * string_count,
-                [args.word_split] * string_count,
-                [args.image_dir] * string_count,
-                [args.stroke_width] * string_count,
-                [args.stroke_fill] * string_count,
-                [args.image_mode] * string_count,
-                [args.output_bboxes] * string_count,
-            ),
-        ),
-        total=args.count,
-    ):
-        pass
+    config = GenerationConfig(
+        fonts=fonts,
+        out_dir=args.output_dir,
+        size=args.format,
+        extension=args.extension,
+        skewing_angle=args.skew_angle,
+        random_skew=args.random_skew,
+        blur=args.blur,
+        random_blur=args.random_blur,
+        background_type=args.background,
+        distorsion_type=args.distorsion,
+        distorsion_orientation=args.distorsion_orientation,
+        is_handwritten=args.handwritten,
+        name_format=args.name_format,
+        width=args.width,
+        alignment=args.alignment,
+        text_color=args.text_color,
+        orientation=args.orientation,
+        space_width=args.space_width,
+        character_spacing=args.character_spacing,
+        margins=args.margins,
+        fit=args.fit,
+        output_mask=args.output_mask,
+        word_split=args.word_split,
+        image_dir=args.image_dir,
+        image_cache_bytes=args.image_cache_mb * 1024 * 1024,
+        image_max_height=args.image_max_height,
+        texture_bank_size=args.texture_bank_size,
+        texture_bank_dir=args.texture_bank_dir,
+        stroke_width=args.stroke_width,
+        stroke_fill=args.stroke_fill,
+        image_mode=args.image_mode,
+        output_bboxes=args.output_bboxes,
+    )
+
+    warmup_queue = Queue()
+    p = Pool(
+        args.thread_count, initializer=init_worker, initargs=(config, warmup_queue)
+    )
+    done_times = []
+    # Rejected samples are generated again, with other fonts and seeds, until
+    # every string has its image or a whole round fails
+    saved = []
+    rejections = Counter()
+    pending = list(range(string_count))
+    with tqdm(total=string_count) as progress:
+        while pending:
+            rejected = []
+            for index, cause in p.imap_unordered(
+                generate_task,
+                [
+                    (
+                        i,
+                        strings[i],
+                        fonts[rnd.randrange(0, len(fonts))],
+                        rnd.getrandbits(32),
+                    )
+                    for i in pending
+                ],
+            ):
+                if cause is None:
+                    saved.append(index)
+                    done_times.append(time.time())
+                    progress.update()
+                else:
+                    rejections[cause] += 1
+                    rejected.append(index)
+            if len(rejected) == len(pending):
+                print(
+                    "No sample of the last {} strings could be generated".format(
+                        len(rejected)
+                    )
+                )
+                break
+            pending = rejected
+    # Read before terminating the pool, a worker stopped while warming up
+    # never reports
+    warmups = collect_warmups(warmup_queue, args.thread_count)
     p.terminate()
 
+    report_throughput(warmups, done_times)
+    report_rejections(rejections, len(saved) + sum(rejections.values()))
+
     if args.name_format == 2:
         # Create file with filename-to-label connections
         with open(
             os.path.join(args.output_dir, "labels.txt"), "w", encoding="utf8"
         ) as f:
-            for i in range(string_count):
+            for i in sorted(saved):
                 file_name = str(i) + "." + args.extension
                 label = strings[i]
                 if args.space_width == 0:
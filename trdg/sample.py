@@ -0,0 +1,53 @@
+"""
+Generated sample with its optional character mask and bounding boxes
+"""
+
+from typing import List, Tuple
+
+from PIL import Image
+
+from trdg.utils import extents_to_bboxes, mask_to_bboxes
+
+
+class SampleRejected(ValueError):
+    """
+    Raised instead of a sample when it is dropped, cause tells why
+    """
+
+    def __init__(self, cause: str):
+        super().__init__(cause)
+        self.cause = cause
+
+
+class Sample(object):
+    """
+    A generated image with what was produced of its characters: their label
+    mask if it was asked for and their pixel extents when the layout could
+    follow them. Bounding boxes are only computed when they are asked for.
+    """
+
+    __slots__ = ("image", "mask", "extents", "_bboxes")
+
+    def __init__(self, image: Image, mask: Image = None, extents: List = None):
+        self.image = image
+        self.mask = mask
+        self.extents = extents
+        self._bboxes = {}
+
+    def bboxes(self, tess: bool = False) -> List[Tuple[int, int, int, int]]:
+        """
+        Bounding boxes of the characters, with y going up from the bottom of
+        the image in Tesseract mode
+        """
+
+        if tess not in self._bboxes:
+            if self.extents is not None:
+                width, height = self.image.size
+                self._bboxes[tess] = extents_to_bboxes(
+                    self.extents, width, height, tess
+                )
+            elif self.mask is not None:
+                self._bboxes[tess] = mask_to_bboxes(self.mask, tess)
+            else:
+                raise ValueError("Sample was generated without a mask")
+        return self._bboxes[tess]
@@ -0,0 +1,112 @@
+"""
+Pre-generated background textures that backgrounds are cut from
+"""
+
+import os
+import random as rnd
+from typing import Callable, List
+
+import numpy as np
+
+# (background type, image directory) -> TextureBank the backgrounds of that
+# type are cut from
+_texture_banks = {}
+
+
+class TextureBank(object):
+    """
+    Set of large uint8 textures, grayscale (height, width) or color
+    (height, width, channels), from which backgrounds are cut as randomly
+    placed and randomly flipped windows. The windows are views of the
+    textures, nothing is copied.
+    """
+
+    def __init__(self, textures: List[np.ndarray]):
+        self.textures = list(textures)
+
+    def __len__(self) -> int:
+        return len(self.textures)
+
+    @property
+    def nbytes(self) -> int:
+        """Number of bytes of the textures, mapped from disk or not"""
+        return sum(texture.nbytes for texture in self.textures)
+
+    @classmethod
+    def create(
+        cls, names: List[str], make_texture: Callable, memmap_dir: str = None
+    ) -> "TextureBank":
+        """
+        Bank of the textures made by make_texture(name) for each name. With
+        memmap_dir they are saved there as name.npy, reused when the file is
+        already there, and memory-mapped instead of held in memory.
+        """
+
+        textures = []
+        for name in names:
+            if memmap_dir is None:
+                textures.append(make_texture(name))
+                continue
+            path = os.path.join(memmap_dir, "{}.npy".format(name))
+            if not os.path.exists(path):
+                # Other processes may be making the same texture, none of
+                # them maps a file that isn't fully written
+                tmp_path = "{}.{}.tmp".format(path, os.getpid())
+                with open(tmp_path, "wb") as f:
+                    np.save(f, make_texture(name))
+                os.replace(tmp_path, path)
+            textures.append(np.load(path, mmap_mode="r"))
+        return cls(textures)
+
+    def window(self, height: int, width: int) -> np.ndarray:
+        """
+        View of a random height x width window of a random texture, flipped on
+        either axis half of the time. None when no texture is large enough.
+        """
+
+        textures = [
+            texture
+            for texture in self.textures
+            if texture.shape[0] >= height and texture.shape[1] >= width
+        ]
+        if not textures:
+            return None
+
+        texture = textures[rnd.randint(0, len(textures) - 1)]
+        y = rnd.randint(0, texture.shape[0] - height)
+        x = rnd.randint(0, texture.shape[1] - width)
+        window = texture[y : y + height, x : x + width]
+        if rnd.random() < 0.5:
+            window = window[:, ::-1]
+        if rnd.random() < 0.5:
+            window = window[::-1]
+        return window
+
+
+def set_texture_bank(background_type: int, image_dir: str, bank: TextureBank) -> None:
+    """
+    Cut the backgrounds of a type out of bank from now on, or make them all
+    again when bank is None. image_dir only tells image banks apart.
+    """
+
+    key = (background_type, image_dir if background_type == 3 else None)
+    if bank is None:
+        _texture_banks.pop(key, None)
+    else:
+        _texture_banks[key] = bank
+
+
+def texture_window(
+    background_type: int, height: int, width: int, image_dir: str = None
+) -> np.ndarray:
+    """
+    Window of the texture bank of a background type, None without a bank or
+    when its textures are all smaller
+    """
+
+    bank = _texture_banks.get(
+        (background_type, image_dir if background_type == 3 else None)
+    )
+    if bank is None:
+        return None
+    return bank.window(height, width)
@@ -2,13 +2,17 @@
 Utility functions
 """
 
+import math
 import os
 import re
 import unicodedata
 from typing import List, Tuple
 
 import numpy as np
-from PIL import Image, ImageDraw, ImageFont
+from PIL import Image, ImageColor, ImageDraw, ImageFont
+
+from trdg.font_registry import get_font_registry
+from trdg.image_cache import _image_cache, get_image
 
 
 def load_dict(path: str) -> List[str]:
@@ -29,74 +33,206 @@ def load_dict(path: str) -> List[str]:
 def load_fonts(lang: str) -> List[str]:
     """Load all fonts in the fonts directories"""
 
-    if lang in os.listdir(os.path.join(os.path.dirname(__file__), "fonts")):
-        return [
-            os.path.join(os.path.dirname(__file__), "fonts/{}".format(lang), font)
-            for font in os.listdir(
-                os.path.join(os.path.dirname(__file__), "fonts/{}".format(lang))
-            )
-        ]
+    fonts_dir = os.path.join(os.path.dirname(__file__), "fonts")
+    if lang in os.listdir(fonts_dir):
+        return get_font_registry(os.path.join(fonts_dir, lang)).fonts
     else:
-        return [
-            os.path.join(os.path.dirname(__file__), "fonts/latin", font)
-            for font in os.listdir(
-                os.path.join(os.path.dirname(__file__), "fonts/latin")
-            )
-        ]
+        return get_font_registry(os.path.join(fonts_dir, "latin")).fonts
+
+
+def parse_colors(colors) -> Tuple[Tuple[int, ...], ...]:
+    """
+    Parse comma separated colors such as "#000000,#888888", colors that are
+    already parsed are returned as they are
+    """
+
+    if isinstance(colors, str):
+        return tuple(ImageColor.getrgb(c) for c in colors.split(","))
+    return colors
+
+
+def preload_images(image_dir: str) -> int:
+    """
+    Decode the images of a directory once, as many as the image cache budget
+    holds, so that load_image doesn't have to, returns the number of images
+    loaded
+    """
+
+    return _image_cache.preload(image_dir)
+
+
+def load_image(path: str, min_size: Tuple[int, int] = None) -> Image:
+    """
+    Get an image decoded, from the image cache. With min_size (width, height)
+    JPEG images may be decoded at a reduced scale that still covers it. The
+    returned image is shared and must not be modified in place.
+    """
+
+    return get_image(path, min_size)
 
 
 def mask_to_bboxes(mask: List[Tuple[int, int, int, int]], tess: bool = False):
     """Process the mask and turns it into a list of AABB bounding boxes"""
 
     mask_arr = np.array(mask)
+    if mask_arr.ndim == 2:
+        labels = mask_arr
+    elif mask_arr.shape[2] == 3:
+        labels = decode_mask(mask_arr)
+    else:
+        # Character colors are RGB, nothing else ever matched them
+        return []
 
-    bboxes = []
+    return extents_to_bboxes(
+        label_extents(labels),
+        mask_arr.shape[1],
+        mask_arr.shape[0],
+        tess,
+    )
+
+
+def decode_mask(mask_arr: np.ndarray) -> np.ndarray:
+    """
+    Turn an RGB mask where character i is drawn with the color
+    ((i + 1) // (255 * 255), (i + 1) // 255, (i + 1) % 255) into an image of
+    labels i + 1, 0 for the background and for any color no character has
+    """
+
+    r, g, b = (mask_arr[..., c].astype(np.int32) for c in range(3))
+    labels = g * 255 + b
+    # Blue never reaches 255, green neither below 255 * 255 characters
+    labels[(r != 0) | (g == 255) | (b == 255)] = 0
+    return labels
+
+
+def to_label_mask(mask: Image) -> Image:
+    """
+    Turn a color encoded character mask into a single channel 16 bits mask of
+    the character labels
+    """
 
-    i = 0
+    if mask.mode == "I;16":
+        return mask
+    return Image.fromarray(decode_mask(np.array(mask.convert("RGB"))).astype(np.uint16))
+
+
+def label_extents(labels: np.ndarray) -> List:
+    """
+    Inclusive pixel extents (min x, min y, max x, max y) of labels 1 to the
+    highest one of a label image, None for the labels that have no pixel
+    """
+
+    ys, xs = np.nonzero(labels)
+    if len(ys) == 0:
+        return []
+    values = labels[ys, xs]
+    count = int(values.max()) + 1
+
+    # Per label min and max of the coordinates, all in one pass over the pixels
+    min_x = np.full(count, labels.shape[1], dtype=np.intp)
+    min_y = np.full(count, labels.shape[0], dtype=np.intp)
+    max_x = np.full(count, -1, dtype=np.intp)
+    max_y = np.full(count, -1, dtype=np.intp)
+    np.minimum.at(min_x, values, xs)
+    np.minimum.at(min_y, values, ys)
+    np.maximum.at(max_x, values, xs)
+    np.maximum.at(max_y, values, ys)
+
+    return [
+        (x0, y0, x1, y1) if x1 >= 0 else None
+        for x0, y0, x1, y1 in zip(
+            min_x[1:].tolist(), min_y[1:].tolist(), max_x[1:].tolist(), max_y[1:].tolist()
+        )
+    ]
+
+
+def resize_extents(
+    extents: List, size: Tuple[int, int], new_size: Tuple[int, int]
+) -> List:
+    """
+    Map inclusive pixel extents through a nearest neighbor resize from size to
+    new_size, None for the ones that vanish
+    """
+
+    scale_x = size[0] / new_size[0]
+    scale_y = size[1] / new_size[1]
+    resized = []
+    for extent in extents:
+        if extent is not None:
+            x0, y0, x1, y1 = extent
+            # The destination pixel j samples the source pixel (j + 0.5) * scale
+            x0, x1 = math.ceil(x0 / scale_x - 0.5), math.ceil((x1 + 1) / scale_x - 0.5) - 1
+            y0, y1 = math.ceil(y0 / scale_y - 0.5), math.ceil((y1 + 1) / scale_y - 0.5) - 1
+            x0, y0 = max(x0, 0), max(y0, 0)
+            x1, y1 = min(x1, new_size[0] - 1), min(y1, new_size[1] - 1)
+            extent = (x0, y0, x1, y1) if x0 <= x1 and y0 <= y1 else None
+        resized.append(extent)
+    return resized
+
+
+def translate_extents(
+    extents: List, offset: Tuple[int, int], size: Tuple[int, int]
+) -> List:
+    """
+    Move inclusive pixel extents by offset and clip them to an image of the
+    given size, None for the ones that end up outside of it
+    """
+
+    dx, dy = offset
+    translated = []
+    for extent in extents:
+        if extent is not None:
+            x0, y0, x1, y1 = extent
+            x0, y0 = max(x0 + dx, 0), max(y0 + dy, 0)
+            x1, y1 = min(x1 + dx, size[0] - 1), min(y1 + dy, size[1] - 1)
+            extent = (x0, y0, x1, y1) if x0 <= x1 and y0 <= y1 else None
+        translated.append(extent)
+    return translated
+
+
+def extents_to_bboxes(
+    extents: List, width: int, height: int, tess: bool = False
+) -> List[Tuple[int, int, int, int]]:
+    """
+    Turn the inclusive pixel extents of every character, None where it has no
+    pixel, into the bounding boxes mask_to_bboxes would find in a mask of the
+    given size
+    """
+
+    bboxes = []
     space_thresh = 1
-    while True:
-        try:
-            color_tuple = ((i + 1) // (255 * 255), (i + 1) // 255, (i + 1) % 255)
-            letter = np.where(np.all(mask_arr == color_tuple, axis=-1))
-            if space_thresh == 0 and letter:
-                x1 = min(bboxes[-1][2] + 1, np.min(letter[1]) - 1)
-                y1 = (
-                    min(bboxes[-1][3] + 1, np.min(letter[0]) - 1)
-                    if not tess
-                    else min(
-                        mask_arr.shape[0] - np.min(letter[0]) + 2, bboxes[-1][1] - 1
-                    )
-                )
-                x2 = max(bboxes[-1][2] + 1, np.min(letter[1]) - 2)
-                y2 = (
-                    max(bboxes[-1][3] + 1, np.min(letter[0]) - 2)
-                    if not tess
-                    else max(
-                        mask_arr.shape[0] - np.min(letter[0]) + 2, bboxes[-1][1] - 1
-                    )
-                )
-                bboxes.append((x1, y1, x2, y2))
-                space_thresh += 1
+    # The scan of the mask stops at the second missing character in a row
+    for extent in list(extents) + [None, None]:
+        if space_thresh == 0:
+            if extent is None or not bboxes:
+                break
+            # A box between the previous character and this one for the space
+            min_x, min_y = extent[0], extent[1]
+            prev = bboxes[-1]
+            if not tess:
+                y1 = min(prev[3] + 1, min_y - 1)
+                y2 = max(prev[3] + 1, min_y - 2)
+            else:
+                y1 = min(height - min_y + 2, prev[1] - 1)
+                y2 = max(height - min_y + 2, prev[1] - 1)
             bboxes.append(
-                (
-                    max(0, np.min(letter[1]) - 1),
-                    max(0, np.min(letter[0]) - 1)
-                    if not tess
-                    else max(0, mask_arr.shape[0] - np.max(letter[0]) - 1),
-                    min(mask_arr.shape[1] - 1, np.max(letter[1]) + 1),
-                    min(mask_arr.shape[0] - 1, np.max(letter[0]) + 1)
-                    if not tess
-                    else min(
-                        mask_arr.shape[0] - 1, mask_arr.shape[0] - np.min(letter[0]) + 1
-                    ),
-                )
+                (min(prev[2] + 1, min_x - 1), y1, max(prev[2] + 1, min_x - 2), y2)
             )
-            i += 1
-        except Exception as ex:
-            if space_thresh == 0:
-                break
+            space_thresh += 1
+        if extent is None:
             space_thresh -= 1
-            i += 1
+            continue
+        min_x, min_y, max_x, max_y = extent
+        bboxes.append(
+            (
+                max(0, min_x - 1),
+                max(0, min_y - 1) if not tess else max(0, height - max_y - 1),
+                min(width - 1, max_x + 1),
+                min(height - 1, max_y + 1)
+                if not tess
+                else min(height - 1, height - min_y + 1),
+            )
+        )
 
     return bboxes
 
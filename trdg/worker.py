@@ -0,0 +1,88 @@
+"""
+Per-process state of the generation workers
+"""
+
+import os
+import time
+from typing import Tuple
+
+from PIL import Image
+
+from trdg.background_atlas import is_atlas, load_atlas
+from trdg.background_generator_update import use_texture_bank
+from trdg.data_generator import FakeTextDataGenerator, SampleRejected
+from trdg.font_cache import _font_cache, get_font
+from trdg.generation_config import BackgroundType, GenerationConfig, Orientation
+from trdg.image_cache import _image_cache
+from trdg.utils import preload_images
+
+# Config of the run, set once per process by init_worker
+_config = None
+
+
+def init_worker(config: GenerationConfig, warmup_queue=None) -> None:
+    """
+    Pool initializer, keeps the config of the run and loads once per process
+    everything the tasks would otherwise load on their first use: image
+    plugins, fonts, as many backgrounds as the image cache holds and the
+    texture bank. The time it took is put on warmup_queue as (pid, start, end).
+    """
+
+    global _config
+    _config = config
+
+    start = time.time()
+
+    # Pillow registers its file format plugins on the first open or save
+    Image.init()
+
+    if not config.is_handwritten:
+        # Only as many fonts as the cache holds, the others would just be evicted
+        for font in sorted(set(config.fonts))[: _font_cache.max_entries]:
+            try:
+                get_font(font, config.size)
+            except OSError:
+                continue
+
+    _image_cache.max_bytes = config.image_cache_bytes
+    _image_cache.max_height = config.image_max_height
+    if config.background_type == BackgroundType.IMAGE and config.image_dir is not None:
+        if is_atlas(config.image_dir):
+            load_atlas(config.image_dir)
+        elif os.path.isdir(config.image_dir) and config.texture_bank_size <= 0:
+            # Banked images are decoded into the bank, not the image cache
+            preload_images(config.image_dir)
+
+    if config.texture_bank_size > 0 and not is_atlas(config.image_dir):
+        # Textures as long as the longest lines usually are, along the text
+        height, width = max(256, config.size), 2048
+        if config.orientation == Orientation.VERTICAL:
+            height, width = width, height
+        use_texture_bank(
+            config.background_type,
+            config.texture_bank_size,
+            height,
+            width,
+            config.image_dir,
+            config.texture_bank_dir,
+        )
+
+    if warmup_queue is not None:
+        warmup_queue.put((os.getpid(), start, time.time()))
+
+
+def generate_task(task: Tuple[int, str, str, int]) -> Tuple[int, str]:
+    """
+    Generate the sample of an (index, text, font, seed) task with the config
+    the worker was initialized with. Returns the index and why the sample was
+    rejected, None when it was saved.
+    """
+
+    index, text, font, seed = task
+    try:
+        FakeTextDataGenerator.generate_from_config(
+            index, text, font, _config, seed, raise_rejections=True
+        )
+    except SampleRejected as e:
+        return index, e.cause
+    return index, None